@@ -0,0 +1,76 @@
+"""Measure queries per second with 1..N searching threads while another thread keeps indexing pages.
+
+Run from the repository root:
+
+    python -m benchmarks.concurrency --pages 2000 --threads 1 2 4 8
+"""
+import argparse
+import os
+import random
+import tempfile
+from contextlib import redirect_stdout
+from io import StringIO
+from threading import Event, Thread, current_thread
+from time import perf_counter
+from cursorsearch import CursorSearch
+from benchmarks.corpus import WhitespaceCrawler, build_database, make_pages, make_vocabulary
+
+
+def write_pages(path, corpus, stop, written):
+    crawler = WhitespaceCrawler(path, batch_size=20)
+    rounds = 0
+    while not stop.is_set():
+        rounds += 1
+        for (url, text, links) in corpus:
+            if stop.is_set():
+                break
+            url = url.replace("/p/", f"/{current_thread().name}-{rounds}/")
+            crawler.index_page(url, text, links)
+            written.append(url)
+    crawler.flush()
+
+
+def run(path, predictor_path, queries, threads, crawl_corpus):
+    engine = CursorSearch(path, predictor_path, concurrent=True, search_threads=threads)
+    engine.warm_up()
+    stop = Event()
+    written = []
+    writer = Thread(target=write_pages, args=(path, crawl_corpus, stop, written))
+    writer.start()
+    start = perf_counter()
+    engine.search_many(queries)
+    elapsed = perf_counter() - start
+    stop.set()
+    writer.join()
+    engine.executor.shutdown()
+    return elapsed, len(written)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--words", type=int, default=300)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    directory = tempfile.TemporaryDirectory()
+    path = os.path.join(directory.name, "index.db")
+    predictor_path = os.path.join(directory.name, "predictor.db")
+    build_database(path, make_pages(args.pages, words_per_page=args.words))
+    rnd = random.Random(0)
+    vocabulary = make_vocabulary(5000)[20:500]
+    queries = [" ".join(rnd.sample(vocabulary, 2)) for _ in range(args.queries)]
+    crawl_corpus = make_pages(args.pages, words_per_page=args.words, seed=1)
+
+    print(f"{os.cpu_count()} CPUs, {args.pages} pages, {len(queries)} queries per run")
+    with redirect_stdout(StringIO()):
+        results = [(threads, run(path, predictor_path, queries, threads, crawl_corpus)) for threads in args.threads]
+    for (threads, (elapsed, written)) in results:
+        print(f"{threads:>3} threads: {len(queries) / elapsed:,.1f} queries/s, "
+              f"{written} pages indexed meanwhile")
+    directory.cleanup()
+
+
+if __name__ == "__main__":
+    main()
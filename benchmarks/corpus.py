@@ -0,0 +1,49 @@
+import random
+from contextlib import redirect_stdout
+from io import StringIO
+from cursorsearch.crawl.crawler import Crawler
+
+
+class WhitespaceCrawler(Crawler):
+    def separate_words(self, text):
+        return text.split(" ")
+
+
+def make_vocabulary(size, seed=0):
+    rnd = random.Random(seed)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    vocabulary = set()
+    while len(vocabulary) < size:
+        vocabulary.add("".join(rnd.choice(letters) for _ in range(rnd.randint(3, 9))))
+    return sorted(vocabulary)
+
+
+def make_pages(pages, words_per_page=500, vocabulary_size=5000, links_per_page=10, seed=0):
+    """Generate a synthetic corpus as a list of `(url, text, links)` tuples.
+
+    Word frequencies follow a Zipf-like distribution so that a handful of words appear on nearly every
+    page, like in real text. `links` is a list of `(url, link_text)` pairs pointing at other pages.
+    """
+    rnd = random.Random(seed)
+    vocabulary = make_vocabulary(vocabulary_size, seed)
+    weights = [1.0 / (rank + 1) for rank in range(len(vocabulary))]
+    urls = [f"https://www.helloworld.net/p/{i}" for i in range(pages)]
+    corpus = []
+    for url in urls:
+        text = " ".join(rnd.choices(vocabulary, weights, k=words_per_page))
+        links = [(rnd.choice(urls), " ".join(rnd.choices(vocabulary, weights, k=3)))
+                 for _ in range(links_per_page)]
+        corpus.append((url, text, links))
+    return corpus
+
+
+def build_database(path, corpus, batch_size=200):
+    """Index a synthetic corpus into a fresh database at `path` and compute its PageRank."""
+    crawler = WhitespaceCrawler(path, batch_size=batch_size)
+    crawler.create_index_tables()
+    with redirect_stdout(StringIO()):
+        with crawler.bulk_load():
+            for (url, text, links) in corpus:
+                crawler.index_page(url, text, links)
+        crawler.calculate_pagerank()
+    return crawler
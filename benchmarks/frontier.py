@@ -0,0 +1,56 @@
+"""Measure the memory the crawl frontier needs per million seen URLs, against a plain Python set.
+
+URLs are pushed as a crawl would find them, with repeated links, and popped to keep the queue at a fixed
+size, so most seen URLs are no longer queued. Run from the repository root:
+
+    python -m benchmarks.frontier --urls 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+from time import perf_counter
+from cursorsearch.crawl.frontier import Frontier
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--urls", type=int, default=1000000)
+    parser.add_argument("--repeats", type=int, default=3, help="links to already seen URLs per new URL")
+    parser.add_argument("--queue", type=int, default=10000, help="URLs kept queued")
+    parser.add_argument("--error-rate", type=float, default=0.001)
+    args = parser.parse_args()
+
+    directory = tempfile.TemporaryDirectory()
+    frontier = Frontier(os.path.join(directory.name, "frontier.db"), error_rate=args.error_rate)
+    rnd = random.Random(0)
+    urls = [f"https://www.helloworld.net/p/{i}?ref={i % 7}" for i in range(args.urls)]
+    start = perf_counter()
+    for (i, url) in enumerate(urls):
+        frontier.push(url)
+        for _ in range(args.repeats):
+            frontier.push(urls[rnd.randrange(i + 1)])
+        while len(frontier) > args.queue:
+            frontier.done(frontier.pop())
+    frontier.checkpoint()
+    elapsed = perf_counter() - start
+    stats = frontier.stats()
+
+    seen = set(urls)
+    set_bytes = sys.getsizeof(seen) + sum([sys.getsizeof(url) for url in seen])
+    per_million = 1000000 / len(urls)
+    pushes = len(urls) * (1 + args.repeats)
+    print(f"{len(urls):,} URLs, {pushes:,} pushes in {elapsed:.1f} s ({pushes / elapsed:,.0f} pushes/s)")
+    print(f"bloom filter: {stats['bloom_bytes'] * per_million / 2 ** 20:8.2f} MiB per million URLs "
+          f"in {stats['bloom_filters']} filters")
+    print(f"queue:        {stats['queue_bytes'] / 2 ** 20:8.2f} MiB for {stats['queued']:,} queued URLs")
+    print(f"python set:   {set_bytes * per_million / 2 ** 20:8.2f} MiB per million URLs")
+    print(f"on disk:      {stats['disk_bytes'] * per_million / 2 ** 20:8.2f} MiB per million URLs")
+    print(f"exact lookups: {stats['lookups']:,}, false positives: {stats['false_positives']:,}")
+    del frontier
+    directory.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Measure indexing throughput of the crawler, one page at a time versus the bulk indexer.
+
+Run from the repository root:
+
+    python -m benchmarks.indexing --pages 200
+"""
+import argparse
+import os
+import tempfile
+from contextlib import redirect_stdout
+from io import StringIO
+from time import perf_counter
+from cursorsearch.crawl.crawler import Crawler
+from benchmarks.corpus import WhitespaceCrawler, make_pages
+
+
+def run(corpus, batch_size, tokenize):
+    directory = tempfile.TemporaryDirectory()
+    path = os.path.join(directory.name, "index.db")
+    crawler = (Crawler if tokenize else WhitespaceCrawler)(path, batch_size=batch_size)
+    crawler.create_index_tables()
+    start = perf_counter()
+    with redirect_stdout(StringIO()):
+        if batch_size > 0:
+            with crawler.bulk_load():
+                for (url, text, links) in corpus:
+                    crawler.index_page(url, text, links)
+        else:
+            for (url, text, links) in corpus:
+                crawler.index_page(url, text, links)
+            crawler.flush()
+    elapsed = perf_counter() - start
+    tokens = crawler.tokens_indexed
+    del crawler
+    directory.cleanup()
+    return tokens, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--words", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--tokenize", action="store_true", help="include jieba tokenization in the timings")
+    args = parser.parse_args()
+
+    corpus = make_pages(args.pages, words_per_page=args.words)
+    for (name, batch_size) in [("per-token", 0), ("bulk", args.batch_size)]:
+        tokens, elapsed = run(corpus, batch_size, args.tokenize)
+        print(f"{name:>10}: {tokens} tokens in {elapsed:.2f}s, {tokens / elapsed:,.0f} tokens/s")
+
+
+if __name__ == "__main__":
+    main()
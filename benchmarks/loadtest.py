@@ -0,0 +1,169 @@
+"""Load test the HTTP search service and report throughput and tail latency for several numbers of clients.
+
+Every client keeps one connection open and sends searches back to back, picking queries with a Zipf-like
+popularity so a few trending queries make up much of the traffic, and clicks a result of some of them. Without
+`--url` a synthetic index is built and `python -m cursorsearch.serve` is started on it. Client and server share
+the machine's cores. Run from the repository root:
+
+    python -m benchmarks.loadtest --pages 2000 --clients 1 8 32 128
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from time import perf_counter
+from urllib.parse import urlencode, urlsplit
+from benchmarks.corpus import build_database, make_pages, make_vocabulary
+
+
+async def request(reader, writer, method, path, body=None):
+    data = b"" if body is None else json.dumps(body).encode("utf-8")
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(data)}\r\n\r\n".encode("latin-1") + data)
+    await writer.drain()
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionResetError("The server closed the connection")
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        (name, _, value) = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    payload = await reader.readexactly(length) if length else b""
+    return int(status_line.split()[1]), json.loads(payload) if payload else None
+
+
+async def fetch(host, port, method, path, body=None):
+    (reader, writer) = await asyncio.open_connection(host, port)
+    try:
+        return await request(reader, writer, method, path, body)
+    finally:
+        writer.close()
+
+
+async def client(host, port, queries, weights, click_rate, deadline, rnd, results):
+    connection = None
+    while perf_counter() < deadline:
+        try:
+            if connection is None:
+                connection = await asyncio.open_connection(host, port)
+            query = rnd.choices(queries, weights)[0]
+            start = perf_counter()
+            (status, body) = await request(*connection, "GET", "/search?" + urlencode({"q": query, "limit": 10}))
+            results.append((status, perf_counter() - start))
+            if status == 200 and body["results"] and rnd.random() < click_rate:
+                url_ids = [row["url_id"] for row in body["results"]]
+                await request(*connection, "POST", "/click", {"query_words": body["query_words"],
+                                                              "url_ids": url_ids, "url_id": rnd.choice(url_ids)})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            results.append((0, 0.0))
+            connection = None
+    if connection is not None:
+        connection[1].close()
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))] * 1000 if values else float("nan")
+
+
+async def run(host, port, clients, duration, queries, weights, click_rate, seed):
+    (_, before) = await fetch(host, port, "GET", "/stats")
+    results = []
+    deadline = perf_counter() + duration
+    start = perf_counter()
+    await asyncio.gather(*[client(host, port, queries, weights, click_rate, deadline, random.Random(seed + i),
+                                  results) for i in range(clients)])
+    elapsed = perf_counter() - start
+    (_, after) = await fetch(host, port, "GET", "/stats")
+    latencies = sorted([latency for (status, latency) in results if status == 200])
+    statuses = {}
+    for (status, _) in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    searches = after["searches"] - before["searches"]
+    coalesced = after["coalesced"] - before["coalesced"]
+    print(f"{clients:>4} clients: {len(results) / elapsed:8.1f} req/s, {len(latencies) / elapsed:8.1f} ok/s, "
+          f"p50 {percentile(latencies, 0.5):7.1f} ms, p99 {percentile(latencies, 0.99):7.1f} ms, "
+          f"max {percentile(latencies, 1.0):7.1f} ms, 503 {statuses.get(503, 0):>5}, 504 {statuses.get(504, 0):>4}, "
+          f"failed {statuses.get(0, 0) + statuses.get(500, 0)}, {coalesced} of {searches + coalesced} searches "
+          "coalesced")
+
+
+def start_server(directory, args):
+    path = os.path.join(directory, "index.db")
+    build_database(path, make_pages(args.pages, words_per_page=args.words))
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    log_path = os.path.join(directory, "serve.log")
+    with open(log_path, "w") as log:
+        server = subprocess.Popen([sys.executable, "-m", "cursorsearch.serve", path,
+                                   "--predictor", os.path.join(directory, "predictor.db"), "--port", str(port),
+                                   "--threads", str(args.threads), "--max-pending", str(args.max_pending),
+                                   "--timeout", str(args.timeout), "--cache-size", str(args.cache_size)]
+                                  + (["--use-index"] if args.use_index else []), stdout=log, stderr=subprocess.STDOUT)
+    for _ in range(600):
+        try:
+            if asyncio.run(fetch("127.0.0.1", port, "GET", "/health"))[0] == 200:
+                return server, port
+        except OSError:
+            pass
+        if server.poll() is not None:
+            break
+        time.sleep(0.1)
+    server.kill()
+    with open(log_path) as output:
+        raise RuntimeError(f"The search service did not start:\n{output.read()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default=None, help="service to test, e.g. http://127.0.0.1:8080. "
+                                                    "Defaults to starting one on a synthetic index")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32, 128])
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per number of clients")
+    parser.add_argument("--distinct", type=int, default=500, help="distinct queries")
+    parser.add_argument("--click-rate", type=float, default=0.05, help="share of searches followed by a click")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--words", type=int, default=200, help="words per page")
+    parser.add_argument("--threads", type=int, default=4, help="search threads of the started service")
+    parser.add_argument("--max-pending", type=int, default=64)
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--cache-size", type=int, default=0, help="search results the started service caches")
+    parser.add_argument("--use-index", action="store_true")
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    vocabulary = make_vocabulary(5000)[20:1000]
+    queries = [" ".join(rnd.sample(vocabulary, rnd.randint(1, 2))) for _ in range(args.distinct)]
+    weights = [1.0 / (rank + 1) for rank in range(len(queries))]
+    directory = tempfile.TemporaryDirectory()
+    server = None
+    if args.url is None:
+        (server, port) = start_server(directory.name, args)
+        host = "127.0.0.1"
+    else:
+        url = urlsplit(args.url)
+        (host, port) = (url.hostname, url.port or 80)
+    print(f"{os.cpu_count()} CPUs, {args.distinct} distinct queries, {args.duration:.0f} s per run")
+    try:
+        for clients in args.clients:
+            asyncio.run(run(host, port, clients, args.duration, queries, weights, args.click_rate, args.seed))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+        directory.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Measure parse and tokenize throughput of downloaded pages on the calling thread versus a process pool.
+
+Run from the repository root:
+
+    python -m benchmarks.parsing --pages 200 --workers 1 2 4
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+from cursorsearch.crawl.parse import init_worker, tokenize_page
+from benchmarks.corpus import make_pages
+
+BASE_URL = "https://www.helloworld.net"
+
+
+def make_html(corpus):
+    documents = []
+    for (url, text, links) in corpus:
+        anchors = "".join(f'<a href="{link_url[len(BASE_URL):]}">{link_text}</a>' for (link_url, link_text) in links)
+        documents.append((url, f"<html><head><title>{url}</title></head><body><article>{text}</article>"
+                               f"{anchors}</body></html>".encode()))
+    return documents
+
+
+def run(documents, workers):
+    start = perf_counter()
+    if workers == 0:
+        init_worker()
+        records = [tokenize_page(url, content, BASE_URL) for (url, content) in documents]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as parser:
+            records = list(parser.map(tokenize_page, *zip(*documents), [BASE_URL] * len(documents), chunksize=8))
+    elapsed = perf_counter() - start
+    return sum(len(words) for (_, words, _) in records), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--words", type=int, default=1000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    documents = make_html(make_pages(args.pages, words_per_page=args.words))
+    print(f"{os.cpu_count()} CPUs")
+    for workers in [0] + args.workers:
+        tokens, elapsed = run(documents, workers)
+        name = "inline" if workers == 0 else f"{workers} procs"
+        print(f"{name:>10}: {len(documents)} pages in {elapsed:.2f}s, {len(documents) / elapsed:,.1f} pages/s, "
+              f"{tokens / elapsed:,.0f} tokens/s")
+
+
+if __name__ == "__main__":
+    main()
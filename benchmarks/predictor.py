@@ -0,0 +1,105 @@
+"""Measure the size and inference latency of the click-learning network without indexes, with them and compacted.
+
+Clicks are simulated for random queries over a fixed set of words and URLs, so the tables grow like a busy
+search engine's. The same queries are then predicted from a database without the indexes (as written by older
+versions), after they were added, after pruning weights that hardly differ from their default and after
+dropping the least recently used hidden nodes. Run from the repository root:
+
+    python -m benchmarks.predictor --clicks 5000
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3 as sqlite
+import tempfile
+from time import perf_counter
+from cursorsearch.dl.predict import Predictor
+
+
+def time_inference(predictor, queries):
+    timings = []
+    results = []
+    for (word_ids, url_ids) in queries:
+        start = perf_counter()
+        results.append(predictor.get_result(word_ids, url_ids))
+        timings.append((perf_counter() - start) * 1000)
+    timings.sort()
+    return results, timings[len(timings) // 2], timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+
+
+def report(name, predictor, queries):
+    (results, p50, p99) = time_inference(predictor, queries)
+    size = predictor.size()
+    print(f"{name:>11}: {size['bytes'] / 2 ** 20:7.2f} MiB, {size['hiddennode']:>7,} hidden nodes, "
+          f"{size['wordhidden'] + size['hiddenurl']:>9,} weights, p50 {p50:7.2f} ms, p99 {p99:7.2f} ms")
+    return results
+
+
+def difference(results, expected):
+    return max([abs(a - b) for (result, old) in zip(results, expected) for (a, b) in zip(result, old)])
+
+
+def removed(stats):
+    return f"{stats['removed']['hiddennode']:,} hidden nodes and " \
+        f"{stats['removed']['wordhidden'] + stats['removed']['hiddenurl']:,} weights"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clicks", type=int, default=5000)
+    parser.add_argument("--words", type=int, default=2000)
+    parser.add_argument("--urls", type=int, default=20000)
+    parser.add_argument("--results", type=int, default=20, help="URLs shown per query")
+    parser.add_argument("--queries", type=int, default=200, help="queries timed per database")
+    parser.add_argument("--tolerance", type=float, default=1e-5, help="largest difference from a default pruned")
+    parser.add_argument("--keep", type=float, default=0.5, help="share of hidden nodes kept by compaction")
+    args = parser.parse_args()
+
+    directory = tempfile.TemporaryDirectory()
+    path = os.path.join(directory.name, "predictor.db")
+    predictor = Predictor(path)
+    predictor.make_tables()
+    rnd = random.Random(0)
+    clicks = []
+    for _ in range(args.clicks):
+        word_ids = rnd.sample(range(1, args.words + 1), rnd.randint(1, 3))
+        url_ids = rnd.sample(range(1, args.urls + 1), args.results)
+        clicks.append((word_ids, url_ids))
+    start = perf_counter()
+    for (word_ids, url_ids) in clicks:
+        predictor.train_query(word_ids, url_ids, rnd.choice(url_ids), commit=False)
+    predictor.commit()
+    print(f"{args.clicks:,} clicks trained in {perf_counter() - start:.1f} s")
+    # Recent clicks are searched again, as popular queries would be.
+    queries = clicks[-args.queries:]
+
+    for name in predictor.INDEXES:
+        predictor.conn.execute(f"DROP INDEX {name}")
+    predictor.conn.execute("VACUUM")
+    del predictor
+    legacy = os.path.join(directory.name, "legacy.db")
+    shutil.copy(path, legacy)
+    expected = report("no indexes", Predictor(legacy, conn=sqlite.connect(legacy)), queries)
+
+    start = perf_counter()
+    predictor = Predictor(path)
+    migrated = perf_counter() - start
+    results = report("indexed", predictor, queries)
+    print(f"{'':>13}migrated in {migrated:.2f} s, largest change in a prediction {difference(results, expected):.2g}")
+
+    stats = predictor.compact(tolerance=args.tolerance)
+    results = report("pruned", predictor, queries)
+    print(f"{'':>13}removed {removed(stats)}, largest change in a prediction {difference(results, expected):.2g}")
+
+    stats = predictor.compact(max_hidden_nodes=int(predictor.size()["hiddennode"] * args.keep),
+                              tolerance=args.tolerance)
+    results = report("LRU budget", predictor, queries)
+    print(f"{'':>13}removed {removed(stats)}, largest change in a recent prediction "
+          f"{difference(results, expected):.2g}")
+    del predictor
+    directory.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""Recrawl a site served from a local HTTP server and check which pages are skipped, re-indexed or fail.
+
+The pages of a synthetic corpus are served by `http.server`: a third answer conditional requests by `ETag`, a
+third by `Last-Modified` and the rest send neither, so only their content hash tells they are unchanged. After a
+full crawl some pages get new text, and some are replaced by a document without a `<body>`, like a PDF or a
+redirect stub. The recrawl is then expected to skip the unchanged pages, re-index the changed ones and count the
+broken ones as failed without stopping. Run from the repository root:
+
+    python -m benchmarks.recrawl --pages 300 --changed 0.1 --broken 5
+"""
+import argparse
+import os
+import random
+import tempfile
+from contextlib import redirect_stdout
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from threading import Thread
+from time import monotonic, perf_counter, time
+from benchmarks.corpus import WhitespaceCrawler, make_pages
+
+
+class Site(object):
+    def __init__(self, corpus) -> None:
+        """Pages served by the local server: path -> `(body, content type, ETag, Last-Modified)`.
+
+        `requests` counts the requests served and `started` keeps the `monotonic` time each one arrived at.
+        """
+        super().__init__()
+        self.pages = {}
+        self.requests = 0
+        self.started = []
+        self.not_modified = 0
+        self.modified = time() - 86400
+        for (i, (url, text, links)) in enumerate(corpus):
+            self.set_page(i, text, links)
+
+    def path(self, i):
+        return f"/p/{i}"
+
+    def set_page(self, i, text, links, broken=False):
+        anchors = "".join(f'<a href="{link_url[link_url.index("/p/"):]}">{link_text}</a>'
+                          for (link_url, link_text) in links)
+        if broken:
+            body = b"%PDF-1.4\n% not an HTML page\n"
+            content_type = "application/pdf"
+        else:
+            body = f"<html><head><title>page {i}</title></head><body><article>{text}</article>{anchors}" \
+                   "</body></html>".encode()
+            content_type = "text/html; charset=utf-8"
+        self.modified += 1
+        etag = f'"{i}-{self.modified:.0f}"' if i % 3 == 0 else None
+        last_modified = formatdate(self.modified, usegmt=True) if i % 3 == 1 else None
+        self.pages[self.path(i)] = (body, content_type, etag, last_modified)
+
+    def make_handler(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                site.started.append(monotonic())
+                site.requests += 1
+                page = site.pages.get(self.path)
+                if page is None:
+                    self.send_error(404)
+                    return
+                (body, content_type, etag, last_modified) = page
+                since = self.headers.get("If-Modified-Since")
+                if (etag is not None and self.headers.get("If-None-Match") == etag) or \
+                        (last_modified is not None and since is not None and
+                         parsedate_to_datetime(since) >= parsedate_to_datetime(last_modified)):
+                    site.not_modified += 1
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                if etag is not None:
+                    self.send_header("ETag", etag)
+                if last_modified is not None:
+                    self.send_header("Last-Modified", last_modified)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--words", type=int, default=200, help="words per page")
+    parser.add_argument("--changed", type=float, default=0.1, help="share of pages whose text changes")
+    parser.add_argument("--broken", type=int, default=5, help="pages replaced by a document without a body")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    corpus = make_pages(args.pages, words_per_page=args.words, seed=args.seed)
+    site = Site(corpus)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), site.make_handler())
+    Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    urls = [base_url + site.path(i) for i in range(args.pages)]
+
+    directory = tempfile.TemporaryDirectory()
+    crawler = WhitespaceCrawler(os.path.join(directory.name, "index.db"))
+    crawler.BASE_URL = base_url
+    crawler.create_index_tables()
+    start = perf_counter()
+    with redirect_stdout(StringIO()):
+        crawler.crawl(urls)
+    print(f"crawl:            {args.pages} pages in {perf_counter() - start:.2f} s, {site.requests} requests")
+
+    rnd = random.Random(args.seed)
+    picked = rnd.sample(range(args.pages), min(args.pages, int(args.pages * args.changed) + args.broken))
+    (broken, changed) = (set(picked[:args.broken]), set(picked[args.broken:]))
+    for i in changed:
+        (_, text, links) = corpus[i]
+        site.set_page(i, f"{text} recrawled{i}", links)
+    for i in broken:
+        (_, text, links) = corpus[i]
+        site.set_page(i, text, links, broken=True)
+    unchanged = [i for i in range(args.pages) if i not in changed and i not in broken]
+    expected = {
+        "not_modified": len([i for i in unchanged if i % 3 != 2]),
+        "unchanged": len([i for i in unchanged if i % 3 == 2]),
+        "changed": len(changed),
+        "failed": len(broken)
+    }
+
+    site.requests = site.not_modified = 0
+    start = perf_counter()
+    with redirect_stdout(StringIO()):
+        stats = crawler.recrawl(urls)
+    elapsed = perf_counter() - start
+    counts = dict([(name, stats[name]) for name in expected])
+    print(f"recrawl:          {args.pages} pages in {elapsed:.2f} s, {site.not_modified} answered 304 Not Modified")
+    for name in expected:
+        print(f"{name + ':':<17} {counts[name]:>5} (expected {expected[name]})")
+    reindexed = sum([crawler.conn.execute(
+        "SELECT COUNT(*) FROM wordlocation JOIN wordlist ON wordlist.rowid=wordlocation.wordid "
+        "WHERE wordlist.word=?", (f"recrawled{i}",)).fetchone()[0] for i in changed])
+    print(f"changed pages searchable by their new text: {reindexed} of {len(changed)}")
+    print("recrawl " + ("OK" if counts == expected and reindexed == len(changed) and
+                        sorted(stats["changed_urls"]) == sorted([urls[i] for i in changed]) else "MISMATCH"))
+
+    start = perf_counter()
+    with redirect_stdout(StringIO()):
+        stats = crawler.recrawl(urls)
+    print(f"second recrawl:   {perf_counter() - start:.2f} s, {stats['changed']} changed, "
+          f"{stats['not_modified']} not modified, {stats['unchanged']} unchanged, {stats['failed']} failed")
+    server.shutdown()
+    crawler.conn.close()
+    directory.cleanup()
+
+
+if __name__ == "__main__":
+    main()
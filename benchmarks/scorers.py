@@ -0,0 +1,75 @@
+"""Time every built-in scorer on the candidates of a broad one-word query, as dicts and as columns.
+
+The dict time calls the scorer with the matched rows, the column time scores the `Candidates` built once from
+them. Fusion is the weighted sum of all scorers and the ranking of the candidates. Run from the repository root:
+
+    python -m benchmarks.scorers --pages 10000
+"""
+import argparse
+import os
+import tempfile
+from time import perf_counter
+from cursorsearch.core.engine import Searcher
+from cursorsearch.scoring.columns import Candidates, rank_columns
+from cursorsearch.scoring.scoring import get_url_ids, score_column
+from benchmarks.corpus import build_database, make_pages, make_vocabulary
+
+
+def best_of(repeat, func):
+    timings = []
+    for _ in range(repeat):
+        start = perf_counter()
+        func()
+        timings.append(perf_counter() - start)
+    return min(timings) * 1000
+
+
+def fuse_dicts(scores):
+    total_scores = dict([(url_id, 0) for url_id in scores[0][1]])
+    for (weight, values) in scores:
+        for url_id in total_scores:
+            total_scores[url_id] += weight * values[url_id]
+    return sorted([(score, url_id) for (url_id, score) in total_scores.items()], reverse=True)
+
+
+def fuse_columns(candidates, scores):
+    total_scores = sum([weight * values for (weight, values) in scores])
+    return rank_columns(candidates.url_ids, total_scores)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=10000)
+    parser.add_argument("--words", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--use-index", action="store_true", help="match and score from the in-memory index")
+    args = parser.parse_args()
+
+    directory = tempfile.TemporaryDirectory()
+    path = os.path.join(directory.name, "index.db")
+    corpus = make_pages(args.pages, words_per_page=args.words)
+    build_database(path, corpus)
+    searcher = Searcher(path, predictDbName=os.path.join(directory.name, "predictor.db"), use_index=args.use_index)
+    word = make_vocabulary(5000)[0]
+    rows, word_ids = searcher.get_match_rows(word)
+    candidates = len(get_url_ids(rows))
+    print(f"query {word!r}: {len(rows)} rows, {candidates} candidate URLs")
+    kwargs = {"wordIds": word_ids, "conn": searcher.conn, "predictor": searcher.predictor, "index": searcher.index}
+    print(f"{'':>20}  {'dict':>9}     {'column':>9}")
+    print(f"{'candidates':>20}: {'':>9}     {best_of(args.repeat, lambda: Candidates(rows)):9.1f} ms")
+    columns = Candidates(rows)
+    for (_, func) in searcher.weights:
+        dict_time = best_of(args.repeat, lambda: func(rows, **kwargs))
+        column_time = best_of(args.repeat, lambda: score_column(func, columns, **kwargs))
+        print(f"{func.__name__:>20}: {dict_time:9.1f} ms  {column_time:9.1f} ms")
+    scores = [(weight, func(rows, **kwargs)) for (weight, func) in searcher.weights]
+    dict_time = best_of(args.repeat, lambda: fuse_dicts(scores))
+    scores = [(weight, score_column(func, columns, **kwargs)) for (weight, func) in searcher.weights]
+    column_time = best_of(args.repeat, lambda: fuse_columns(columns, scores))
+    print(f"{'fusion':>20}: {dict_time:9.1f} ms  {column_time:9.1f} ms")
+    del searcher
+    directory.cleanup()
+
+
+if __name__ == "__main__":
+    main()
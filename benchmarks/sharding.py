@@ -0,0 +1,108 @@
+"""Compare query latency of one unsharded searcher with 1..N shards searched by worker processes.
+
+Every sharded ranking is checked against the unsharded one. Latency only drops with more shards when there
+are as many free cores: with fewer, the workers take turns and a sharded query costs about as much as an
+unsharded one plus the coordination. So next to the measured latency, the time every shard worker was busy
+is used to estimate the latency with a core per shard, the measured time with the sum of the workers' time
+replaced by the longest of them. Last, some pages are added and the shards are refreshed, which is timed
+against writing them again. Run from the repository root:
+
+    python -m benchmarks.sharding --pages 5000 --shards 1 2 4
+"""
+import argparse
+import os
+import random
+import sqlite3 as sqlite
+import tempfile
+from contextlib import redirect_stdout
+from io import StringIO
+from time import perf_counter
+from cursorsearch.core.engine import Searcher
+from cursorsearch.core.shard import ShardedSearcher, refresh_shards, write_shards
+from benchmarks.corpus import build_database, make_pages, make_vocabulary
+
+
+def percentiles(timings):
+    timings = sorted(timings)
+    return timings[len(timings) // 2], timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+
+
+def time_queries(searcher, queries):
+    timings = []
+    estimates = []
+    results = []
+    for q in queries:
+        start = perf_counter()
+        results.append(searcher.query(q))
+        timings.append((perf_counter() - start) * 1000)
+        if hasattr(searcher, "take_busy"):
+            busy = searcher.take_busy()
+            estimates.append(timings[-1] - (sum(busy) - max(busy)) * 1000)
+    return (results,) + percentiles(timings) + (percentiles(estimates) if estimates else (None, None))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=5000)
+    parser.add_argument("--words", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--use-index", action="store_true", help="keep the postings of every shard in memory")
+    parser.add_argument("--added", type=int, default=50, help="pages added before the shards are refreshed")
+    args = parser.parse_args()
+
+    directory = tempfile.TemporaryDirectory()
+    path = os.path.join(directory.name, "index.db")
+    predictor_path = os.path.join(directory.name, "predictor.db")
+    shard_path = os.path.join(directory.name, "shards")
+    corpus = make_pages(args.pages + args.added, words_per_page=args.words)
+    crawler = build_database(path, corpus[:args.pages])
+    rnd = random.Random(0)
+    vocabulary = make_vocabulary(5000)[20:500]
+    queries = [" ".join(rnd.sample(vocabulary, rnd.randint(1, 2))) for _ in range(args.queries)]
+
+    searcher = Searcher(path, predictDbName=predictor_path, use_index=args.use_index, quiet=True)
+    searcher.warm_up()
+    (expected, p50, p99, _, _) = time_queries(searcher, queries)
+    print(f"{os.cpu_count()} CPUs, {args.pages} pages, {len(queries)} queries")
+    if os.cpu_count() < max(args.shards):
+        print("  fewer CPUs than shards: the measured latency cannot drop, see the estimate with a core per shard")
+    print(f"  unsharded: p50 {p50:8.2f} ms, p99 {p99:8.2f} ms")
+    conn = sqlite.connect(path)
+    for shards in args.shards:
+        start = perf_counter()
+        write_shards(conn, shard_path, shards)
+        exported = perf_counter() - start
+        sharded = ShardedSearcher(shard_path, predictDbName=predictor_path, use_index=args.use_index, quiet=True)
+        sharded.warm_up()
+        (results, p50, p99, core_p50, core_p99) = time_queries(sharded, queries)
+        sharded.close()
+        print(f"{shards:>3} shards: p50 {p50:8.2f} ms, p99 {p99:8.2f} ms, "
+              f"with a core per shard p50 {core_p50:8.2f} ms, p99 {core_p99:8.2f} ms, written in {exported:.1f} s, "
+              f"{'same' if results == expected else 'DIFFERENT'} rankings")
+
+    shards = max(args.shards)
+    write_shards(conn, shard_path, shards)
+    with redirect_stdout(StringIO()):
+        for (url, text, links) in corpus[args.pages:]:
+            crawler.index_page(url, text, links)
+        crawler.flush()
+        crawler.calculate_pagerank(incremental=True)
+    start = perf_counter()
+    refresh_shards(crawler.conn, shard_path)
+    refreshed = perf_counter() - start
+    sharded = ShardedSearcher(shard_path, predictDbName=predictor_path, use_index=args.use_index, quiet=True)
+    searcher.reload_index()
+    same = [sharded.query(q) for q in queries] == [searcher.query(q) for q in queries]
+    sharded.close()
+    start = perf_counter()
+    write_shards(conn, shard_path, shards)
+    print(f"  {args.added} pages added: {shards} shards refreshed in {refreshed:.2f} s, written again in "
+          f"{perf_counter() - start:.2f} s, {'same' if same else 'DIFFERENT'} rankings")
+    conn.close()
+    crawler.conn.close()
+    directory.cleanup()
+
+
+if __name__ == "__main__":
+    main()
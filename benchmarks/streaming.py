@@ -0,0 +1,66 @@
+"""Compare the peak memory and time of `iter_query` against `query` on broad queries.
+
+`query` ranks every match and the caller then resolves the URL of every result; `iter_query` is read for the
+first `--read` results and, separately, to the end. Peak memory is the `tracemalloc` peak of Python and NumPy
+allocations during the call, after a warm-up run, so SQLite's own page cache is not included. Everything is
+seeded, so runs with the same arguments are comparable. Run from the repository root:
+
+    python -m benchmarks.streaming --pages 100000 --read 10
+"""
+import argparse
+import gc
+import os
+import tempfile
+import tracemalloc
+from itertools import islice
+from time import perf_counter
+from cursorsearch.core.engine import Searcher
+from benchmarks.corpus import build_database, make_pages, make_vocabulary
+
+
+def measure(func):
+    """`(peak bytes, seconds)` of `func`, the time taken from a second run without tracing."""
+    func()
+    gc.collect()
+    tracemalloc.start()
+    func()
+    (_, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    start = perf_counter()
+    func()
+    return peak, perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=20000)
+    parser.add_argument("--words", type=int, default=50, help="words per page")
+    parser.add_argument("--read", type=int, default=10, help="results read from iter_query")
+    parser.add_argument("--use-index", action="store_true", help="match and score from the in-memory index")
+    args = parser.parse_args()
+
+    directory = tempfile.TemporaryDirectory()
+    path = os.path.join(directory.name, "index.db")
+    build_database(path, make_pages(args.pages, words_per_page=args.words))
+    searcher = Searcher(path, predictDbName=os.path.join(directory.name, "predictor.db"), use_index=args.use_index,
+                        quiet=True)
+    vocabulary = make_vocabulary(5000)
+
+    def query_all(q):
+        results = searcher.query(q)["results"]
+        return searcher.get_url_names([result["url_id"] for result in results])
+
+    print(f"{'query':>20} {'matches':>8}  {'method':<16} {'peak':>9}  {'time':>9}")
+    for q in [vocabulary[0], vocabulary[1], f"{vocabulary[0]} {vocabulary[2]}"]:
+        matches = len(searcher.query(q)["results"])
+        for (name, func) in [("query", lambda: query_all(q)),
+                             (f"iter_query[:{args.read}]", lambda: list(islice(searcher.iter_query(q), args.read))),
+                             ("iter_query", lambda: list(searcher.iter_query(q)))]:
+            (peak, elapsed) = measure(func)
+            print(f"{q:>20} {matches:>8}  {name:<16} {peak / 2 ** 20:7.1f} MB  {elapsed * 1000:6.1f} ms")
+    del searcher
+    directory.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""Build a synthetic index from scratch and report indexing, PageRank, query and predictor timings.
+
+Everything is seeded, so two runs with the same arguments index the same pages and run the same queries,
+and their numbers can be compared to catch regressions. Run from the repository root:
+
+    python -m benchmarks.suite --pages 5000 --queries 300 --json results.json
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+from contextlib import redirect_stdout
+from io import StringIO
+from time import perf_counter
+from cursorsearch.core.engine import Searcher
+from benchmarks.corpus import WhitespaceCrawler, make_pages, make_vocabulary
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def summarize(values):
+    return {
+        "mean": sum(values) / len(values),
+        "p50": percentile(values, 0.5),
+        "p99": percentile(values, 0.99),
+        "max": max(values)
+    }
+
+
+def mean_of(dicts):
+    totals = {}
+    for values in dicts:
+        for (name, value) in values.items():
+            totals[name] = totals.get(name, 0) + value
+    return dict([(name, total / len(dicts)) for (name, total) in totals.items()])
+
+
+def bench_indexing(path, corpus, batch_size):
+    crawler = WhitespaceCrawler(path, batch_size=batch_size)
+    crawler.create_index_tables()
+    tokens = sum([len(text.split(" ")) + sum([len(words.split(" ")) for (_, words) in links])
+                  for (_, text, links) in corpus])
+    with redirect_stdout(StringIO()):
+        start = perf_counter()
+        with crawler.bulk_load():
+            for (url, text, links) in corpus:
+                crawler.index_page(url, text, links)
+        indexing = perf_counter() - start
+        start = perf_counter()
+        crawler.calculate_pagerank()
+        pagerank = perf_counter() - start
+    return {
+        "pages": len(corpus),
+        "tokens": tokens,
+        "seconds": indexing,
+        "pages_per_second": len(corpus) / indexing,
+        "tokens_per_second": tokens / indexing,
+        "pagerank_seconds": pagerank
+    }
+
+
+def bench_queries(searcher, queries, limit):
+    collected = []
+    searcher.on_stats = collected.append
+    searcher.collect_stats = True
+    results = [searcher.query(q, limit=limit) for q in queries]
+    searcher.collect_stats = False
+    searcher.on_stats = None
+    return results, {
+        "queries": len(queries),
+        "limit": limit,
+        "latency_ms": summarize([stats.total for stats in collected]),
+        "stages_ms": mean_of([stats.stages for stats in collected]),
+        "scorers_ms": mean_of([stats.scorers for stats in collected]),
+        "counters": mean_of([stats.counters for stats in collected])
+    }
+
+
+def bench_predictor(searcher, clicks):
+    predictor = searcher.predictor
+    start = perf_counter()
+    for (word_ids, url_ids, selected) in clicks:
+        predictor.train_query(word_ids, url_ids, selected)
+    training = perf_counter() - start
+    timings = []
+    for (word_ids, url_ids, _) in clicks:
+        start = perf_counter()
+        predictor.get_result(word_ids, url_ids)
+        timings.append((perf_counter() - start) * 1000)
+    return {
+        "clicks": len(clicks),
+        "train_ms_per_click": training * 1000 / max(1, len(clicks)),
+        "infer_ms": summarize(timings) if timings else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=5000)
+    parser.add_argument("--words", type=int, default=200, help="words per page")
+    parser.add_argument("--vocabulary", type=int, default=5000)
+    parser.add_argument("--links", type=int, default=10, help="links per page")
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--limit", type=int, default=10, help="results per query, 0 ranks every match")
+    parser.add_argument("--clicks", type=int, default=100, help="clicks to train the predictor on")
+    parser.add_argument("--batch-size", type=int, default=200, help="pages per indexing transaction")
+    parser.add_argument("--use-index", action="store_true", help="match and score from the in-memory index")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    directory = tempfile.TemporaryDirectory()
+    path = os.path.join(directory.name, "index.db")
+    corpus = make_pages(args.pages, words_per_page=args.words, vocabulary_size=args.vocabulary,
+                        links_per_page=args.links, seed=args.seed)
+    report = {"arguments": vars(args), "indexing": bench_indexing(path, corpus, args.batch_size)}
+
+    searcher = Searcher(path, predictDbName=os.path.join(directory.name, "predictor.db"),
+                        use_index=args.use_index, quiet=True)
+    searcher.warm_up()
+    rnd = random.Random(args.seed)
+    vocabulary = make_vocabulary(args.vocabulary, args.seed)[20:500]
+    queries = [" ".join(rnd.sample(vocabulary, rnd.randint(1, 3))) for _ in range(args.queries)]
+    (results, report["search"]) = bench_queries(searcher, queries, args.limit or None)
+
+    clicks = []
+    for result in results:
+        url_ids = [row["url_id"] for row in result["results"][:10]]
+        if url_ids and len(clicks) < args.clicks:
+            clicks.append((result["query_words"], url_ids, rnd.choice(url_ids)))
+    report["predictor"] = bench_predictor(searcher, clicks)
+    del searcher
+    directory.cleanup()
+
+    indexing = report["indexing"]
+    search = report["search"]
+    predictor = report["predictor"]
+    print(f"indexing: {indexing['pages']} pages, {indexing['tokens']:,} tokens in {indexing['seconds']:.2f} s "
+          f"({indexing['pages_per_second']:,.0f} pages/s, {indexing['tokens_per_second']:,.0f} tokens/s)")
+    print(f"pagerank: {indexing['pagerank_seconds'] * 1000:.1f} ms")
+    latency = search["latency_ms"]
+    print(f"search:   {search['queries']} queries, p50 {latency['p50']:.2f} ms, p99 {latency['p99']:.2f} ms, "
+          f"max {latency['max']:.2f} ms")
+    for (name, ms) in search["stages_ms"].items():
+        print(f"  {name:>20}: {ms:8.3f} ms")
+    for (name, ms) in search["scorers_ms"].items():
+        print(f"  {name:>20}: {ms:8.3f} ms")
+    for (name, value) in search["counters"].items():
+        print(f"  {name:>20}: {value:8.1f}")
+    if predictor["infer_ms"] is not None:
+        print(f"predictor: train {predictor['train_ms_per_click']:.2f} ms/click, "
+              f"infer p50 {predictor['infer_ms']['p50']:.2f} ms, p99 {predictor['infer_ms']['p99']:.2f} ms")
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump(report, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
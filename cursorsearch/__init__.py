@@ -1,8 +1,21 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import monotonic
 from cursorsearch.core.engine import Searcher
+from cursorsearch.core.segment import write_segment
+from cursorsearch.core.shard import ShardedSearcher, refresh_shards, write_shards
 from cursorsearch.crawl.crawler import Crawler
+from cursorsearch.crawl.concurrent import ConcurrentCrawler
+from cursorsearch.dl.predict import Predictor
+from cursorsearch.dl.trainer import TrainingQueue
+from cursorsearch.util import Generation
 
 class CursorSearch(object):
-    def __init__(self, database_name: str = "search_index.db", predictor_database_name: str = "predictor.db", weights: list = []) -> None:
+    def __init__(self, database_name: str = "search_index.db", predictor_database_name: str = "predictor.db", weights: list = [],
+                 use_index: bool = False, crawl_workers: int = 0,
+                 index_batch_size: int = 0, background_training: bool = False, cache_size: int = 0,
+                 parse_workers: int = 0, segment_path: str = None, concurrent: bool = False,
+                 search_threads: int = 4, quiet: bool = False, on_stats=None, shard_path: str = None) -> None:
         """Cursor Search Engine
 
         CursorSearch is a simple search engine based on Python. It supports Unicode-like word seperation using the 
@@ -50,31 +63,189 @@ class CursorSearch(object):
             database_name (str, optional): Path to the main data storage database. Defaults to "search_index.db".
             predictor_database_name (str, optional): Path to the predictor datanase. Defaults to "predictor.db".
             weights (list, optional): List of method used to calculate weights of URLs. Defaults to [].
+            use_index (bool, optional): Match queries against an in-memory inverted index instead of joining the
+                `wordlocation` table in SQL. Defaults to False.
+            crawl_workers (int, optional): Number of pages to download concurrently while crawling. 0 crawls one page
+                at a time. Defaults to 0.
+            index_batch_size (int, optional): Number of crawled pages written to the database per transaction. 0 writes
+                every token as it is found. Defaults to 0.
+            background_training (bool, optional): Queue clicks passed to `train` and learn from them in batches on a
+                worker thread instead of on the caller's thread. Defaults to False.
+            cache_size (int, optional): Number of query results to keep in an LRU cache. Entries are dropped as soon as
+                the index or the predictor changes. 0 disables the cache. Defaults to 0.
+            parse_workers (int, optional): Number of processes that parse and tokenize downloaded pages when
+                `crawl_workers` is set. 0 parses on the crawling thread. Defaults to 0.
+            segment_path (str, optional): Search a memory-mapped segment written by `export_segment` instead of the
+                `wordlocation` table. Defaults to None.
+            concurrent (bool, optional): Serve searches from several threads at once. Both databases are switched to
+                WAL mode, every searching thread reads through its own read-only connection, and crawling and training
+                write through one connection per database. Defaults to False.
+            search_threads (int, optional): Number of threads `search_many` runs queries on in `concurrent` mode.
+                Defaults to 4.
+            quiet (bool, optional): Don't print the top results of every search. Defaults to False.
+            on_stats (function, optional): Called with a `QueryStats` after every search, holding the milliseconds
+                spent tokenizing, matching, in each scorer and looking up URLs, and the number of rows matched and
+                SQL statements issued. The last one is also kept as `searcher.last_stats`. Defaults to None.
+            shard_path (str, optional): Search the shards written by `export_shards` to this directory, each from
+                its own worker process. `crawl` and `recrawl` keep them up to date. Cannot be combined with
+                `segment_path`. Defaults to None.
         """
         super().__init__()
-        self.searcher = Searcher(database_name, predictDbName=predictor_database_name, weights=weights)
-        self.crawler = Crawler(database_name)
-        self.predictor = self.searcher.predictor
+        self.generation = Generation()
+        self.shard_path = shard_path
+        if shard_path is not None:
+            if segment_path is not None:
+                raise ValueError("segment_path and shard_path cannot be combined")
+            self.searcher = ShardedSearcher(shard_path, predictDbName=predictor_database_name, weights=weights,
+                                            use_index=use_index, cache_size=cache_size, generation=self.generation,
+                                            concurrent=concurrent, quiet=quiet, on_stats=on_stats)
+        else:
+            self.searcher = Searcher(database_name, predictDbName=predictor_database_name, weights=weights,
+                                     use_index=use_index, cache_size=cache_size, generation=self.generation,
+                                     segment=segment_path, concurrent=concurrent, quiet=quiet,
+                                     on_stats=on_stats)
+        if crawl_workers > 0:
+            self.crawler = ConcurrentCrawler(database_name, workers=crawl_workers, batch_size=index_batch_size,
+                                             generation=self.generation, parse_workers=parse_workers)
+        else:
+            self.crawler = Crawler(database_name, batch_size=index_batch_size, generation=self.generation)
+        self.predictor = Predictor(predictor_database_name, generation=self.generation) if concurrent \
+            else self.searcher.predictor
+        self.write_lock = Lock()
+        self.executor = ThreadPoolExecutor(max_workers=search_threads) if concurrent else None
+        self.trainer = TrainingQueue(predictor_database_name, generation=self.generation) \
+            if background_training else None
+        self.USAGE_INTERVAL = 60.0
+        self.usage_saved = monotonic()
     
-    def search(self, query: str = 0, **kwargs) -> dict:
+    def search(self, query: str = 0, limit: int = None, offset: int = 0, exact: bool = True, **kwargs) -> dict:
         """Search for something.
 
         Args:
             query (str, optional): Query to search in the database. Defaults to 0.
+            limit (int, optional): Number of results to return. Defaults to None, which returns all of them.
+            offset (int, optional): Number of best results to skip, for later pages. Defaults to 0.
+            exact (bool, optional): Rank exactly like a search without `limit`. False only runs the expensive
+                scorers on a pool of the best matches, which is faster on broad queries but approximate.
+                Defaults to True.
 
         Returns:
             dict: Results!
         """
-        return self.searcher.query(query)
+        result = self.searcher.query(query, limit, offset, exact)
+        if monotonic() - self.usage_saved >= self.USAGE_INTERVAL:
+            self.save_usage()
+        return result
     
-    def crawl(self, start_urls: list) -> None:
+    def iter_search(self, query: str, batch_size: int = 100):
+        """Search for something and get the results lazily, best first.
+
+        Every match is scored, but only as many results as you read are sorted and have their URLs looked up, in
+        batches, so stopping early is cheap. Results come in the same order as from `search`.
+
+        ```python
+        for result in cursor_search.iter_search("your search query here"):
+            print(result["score"], result["url"])
+        ```
+
+        Args:
+            query (str): Query to search in the database.
+            batch_size (int, optional): Number of results ranked and resolved at once at first. Defaults to 100.
+
+        Returns:
+            generator: `{"score", "url_id", "url"}` dicts in score order.
+        """
+        return self.searcher.iter_query(query, batch_size)
+    
+    def search_many(self, queries: list) -> list:
+        """Search for several queries, in parallel when `concurrent` is set.
+
+        Args:
+            queries (list): Queries to search in the database.
+
+        Returns:
+            list: The results of every query, in the order of `queries`.
+        """
+        if self.executor is None:
+            return [self.search(query) for query in queries]
+        return list(self.executor.map(self.search, queries))
+    
+    def warm_up(self) -> None:
+        """Load the word segmentation dictionary, the word ids and the index now rather than on the first search.
+        """
+        self.searcher.warm_up()
+    
+    def crawl(self, start_urls: list, checkpoint: str = None) -> None:
         """Crawl the website and store the data.
 
         Args:
             start_urls (list): The URLs to start with.
+            checkpoint (str, optional): File to save the crawl frontier to as the crawl goes. If the crawl is
+                interrupted, crawling again with the same file picks up where it stopped. Defaults to None.
+        """
+        with self.write_lock:
+            self.crawler.crawl(start_urls, checkpoint=checkpoint)
+            self.crawler.calculate_pagerank(incremental=True)
+            self.update_shards()
+        self.searcher.reload_index()
+    
+    def recrawl(self, urls: list = None) -> dict:
+        """Refresh crawled pages, re-indexing only those that changed, and crawl pages they newly link to.
+
+        Pages are fetched with conditional requests, so unchanged pages cost a `304 Not Modified` at most.
+
+        Args:
+            urls (list, optional): The URLs to refresh. Defaults to None, which refreshes every crawled page.
+
+        Returns:
+            dict: How many pages were `not_modified`, `unchanged`, `changed` or `failed`, and which URLs changed.
+        """
+        with self.write_lock:
+            stats = self.crawler.recrawl(urls)
+            if stats["new_pages"]:
+                self.crawler.crawl(stats["new_pages"])
+            self.crawler.calculate_pagerank(incremental=True)
+            self.update_shards()
+        self.searcher.reload_index()
+        return stats
+    
+    def export_segment(self, path: str) -> None:
+        """Write the crawled index to an immutable, memory-mapped segment that searchers can share.
+
+        Args:
+            path (str): Directory to write the segment to.
+        """
+        with self.write_lock:
+            self.crawler.flush()
+            write_segment(self.crawler.conn, path)
+        if self.searcher.segment == path:
+            self.searcher.reload_index()
+    
+    def export_shards(self, path: str, shards: int) -> None:
+        """Partition the crawled index by URL into shard databases that a sharded `CursorSearch` searches in parallel.
+
+        ```python
+        CursorSearch("your_db_name_here.db").export_shards("your_shard_dir", 4)
+        cursor_search = CursorSearch("your_db_name_here.db", shard_path="your_shard_dir")
+        ```
+
+        Args:
+            path (str): Directory to write the shards to.
+            shards (int): Number of shards, usually the number of CPU cores.
+        """
+        with self.write_lock:
+            self.crawler.flush()
+            write_shards(self.crawler.conn, path, shards)
+        if self.shard_path == path:
+            self.searcher.reload_index()
+    
+    def update_shards(self) -> None:
+        """Bring the shards at `shard_path` up to date after a crawl, rewriting only the pages that changed.
         """
-        self.crawler.crawl(start_urls)
-        self.crawler.calculate_pagerank()
+        if self.shard_path is not None and self.searcher.shards:
+            with self.write_lock:
+                self.crawler.flush()
+                refresh_shards(self.crawler.conn, self.shard_path)
     
     def train(self, query_word_ids: list, url_ids: list, selected_url_id: int):
         """Learn from the users' clicks.
@@ -84,4 +255,58 @@ class CursorSearch(object):
             url_ids (list): The list of matched URLs that showed to the user.
             selected_url_id (int): The URL id of the one the user clicked.
         """
+        if self.trainer is not None:
+            self.trainer.put(query_word_ids, url_ids, selected_url_id)
+            return
         self.predictor.train_query(query_word_ids, url_ids, selected_url_id)
+    
+    def save_usage(self) -> None:
+        """Write when searches last used every hidden node of the click-learning network to the predictor database.
+
+        Predictions only note this in memory, and the searcher's predictor may be read-only, so `search` saves it
+        every `USAGE_INTERVAL` seconds, through the training queue when there is one. Nodes used since then look
+        idle to `compact_predictor` after a restart, so call this before shutting down.
+        """
+        self.usage_saved = monotonic()
+        used = self.searcher.take_usage()
+        if not used:
+            return
+        if self.trainer is not None:
+            self.trainer.put_usage(used)
+            return
+        with self.write_lock:
+            self.predictor.add_usage(used)
+            self.predictor.commit()
+    
+    def compact_predictor(self, max_hidden_nodes: int = None, max_idle: int = None, tolerance: float = 1e-5) -> dict:
+        """Shrink the click-learning network by dropping weights that barely differ from their default and
+        hidden nodes nobody searched for in a while.
+
+        ```python
+        cursor_search.compact_predictor(max_hidden_nodes=100000, max_idle=30 * 24 * 3600)
+        ```
+
+        Args:
+            max_hidden_nodes (int, optional): Number of most recently used hidden nodes to keep. Defaults to None.
+            max_idle (int, optional): Seconds after which an unused hidden node is dropped. Defaults to None.
+            tolerance (float, optional): How close to its default a weight has to be to be dropped. Defaults to 1e-5.
+
+        Returns:
+            dict: Rows removed from every table, and the sizes before and after.
+        """
+        self.save_usage()
+        if self.trainer is not None:
+            self.trainer.flush()
+        with self.write_lock:
+            return self.predictor.compact(max_hidden_nodes=max_hidden_nodes, max_idle=max_idle, tolerance=tolerance)
+    
+    def predictor_report(self) -> dict:
+        """Size of the click-learning network and how long predictions took so far.
+
+        Returns:
+            dict: Row counts, database size in bytes, indexes present, and the number, mean and maximum
+                milliseconds of predictions made by the searcher, or by all of its shards.
+        """
+        if self.shard_path is not None:
+            self.searcher.collect_inferences()
+        return self.searcher.predictor.report()
@@ -0,0 +1,87 @@
+from collections import OrderedDict
+from sys import getsizeof
+from threading import Lock
+from time import monotonic
+
+
+def estimate_result_size(result):
+    results = result.get("results", [])
+    size = getsizeof(result) + getsizeof(results) + getsizeof(result.get("query_words", []))
+    if results:
+        sample = results[0]
+        size += len(results) * (getsizeof(sample) + sum([getsizeof(value) for value in sample.values()]))
+    return size
+
+
+class ResultCache(object):
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024, ttl=None) -> None:
+        """Bounded LRU cache of query results.
+
+        Every entry is stored with the index generation it was computed in, and is only served while the
+        generation is unchanged and, if `ttl` is set, while it is younger than `ttl` seconds. The least recently
+        used entries are evicted once either `max_entries` or the estimated `max_bytes` is exceeded.
+
+        Args:
+            max_entries (int, optional): Maximum number of cached results. Defaults to 1024.
+            max_bytes (int, optional): Approximate memory cap in bytes. Defaults to 64 MiB.
+            ttl (float, optional): Maximum age of an entry in seconds. Defaults to None.
+        """
+        super().__init__()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key, generation):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            (value, entry_generation, created, size) = entry
+            if entry_generation != generation or (self.ttl is not None and monotonic() - created > self.ttl):
+                self.remove(key)
+                self.invalidations += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, generation, value):
+        size = estimate_result_size(value)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (value, generation, monotonic(), size)
+            self.size += size
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def remove(self, key):
+        entry = self.entries.pop(key)
+        self.size -= entry[3]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations
+        }
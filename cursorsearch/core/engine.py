@@ -1,21 +1,62 @@
+import numpy as np
 import sqlite3 as sqlite
-from cursorsearch.util import seperate_words
+from collections import OrderedDict
+from threading import RLock
+from cursorsearch.util import Generation, ReaderPool, chunks, enable_wal, get_data_version
 from pprint import pprint
 from cursorsearch.dl.predict import Predictor
-from cursorsearch.scoring.scoring import Scoring
+from cursorsearch.scoring.columns import Candidates, rank_columns
+from cursorsearch.scoring.scoring import Scoring, get_url_ids, score_column
+from cursorsearch.core.index import InvertedIndex, SqlPostings
+from cursorsearch.core.query import has_operators, parse_query
+from cursorsearch.core.segment import Segment
+from cursorsearch.core.topk import TopKRanker
+from cursorsearch.core.cache import ResultCache
+from cursorsearch.core.tokenizer import QueryTokenizer
+from cursorsearch.core.stats import QueryStats, stage, time_scorer
 
 
 class Searcher(object):
-    def __init__(self, dbName, predictDbName = "predictor.db", weights=[], **kwargs) -> None:
+    def __init__(self, dbName, predictDbName = "predictor.db", weights=[], use_index=False, cache_size=0,
+                 generation=None, segment=None, concurrent=False, quiet=False, collect_stats=False, on_stats=None,
+                 **kwargs) -> None:
         super().__init__()
-        self.conn = sqlite.connect(dbName)
-        self.predictor = Predictor(predictDbName)
+        self.concurrent = concurrent
+        self.quiet = quiet
+        self.collect_stats = collect_stats or on_stats is not None
+        self.on_stats = on_stats
+        self.last_stats = None
+        if concurrent:
+            writer = Predictor(predictDbName)
+            try:
+                writer.make_tables()
+            except:
+                pass
+            writer.conn.close()
+            enable_wal(dbName)
+            enable_wal(predictDbName)
+            self.conn = ReaderPool(dbName)
+        else:
+            self.conn = sqlite.connect(dbName)
+        self.segment = segment
+        self.use_index = use_index or segment is not None
+        self.index = None
+        self.rankers = OrderedDict()
+        self.lock = RLock()
+        self.MAX_RANKERS = 64
+        self.TOP_K_POOL_FACTOR = 4
+        self.generation = generation if generation is not None else Generation()
+        self.cache = ResultCache(max_entries=cache_size) if cache_size > 0 else None
+        self.tokenizer = QueryTokenizer(self.conn if segment is None else None)
+        self.predictor = Predictor(predictDbName, generation=self.generation,
+                                   conn=ReaderPool(predictDbName) if concurrent else None)
         self.score = Scoring()
         self.weights = []
-        try:
-            self.predictor.make_tables()
-        except:
-            pass
+        if not concurrent:
+            try:
+                self.predictor.make_tables()
+            except:
+                pass
         if weights == []:
             self.weights = [(1.0, self.score.frequency_score),
                             (1.5, self.score.location_score),
@@ -30,60 +71,244 @@ class Searcher(object):
     def __del__(self):
         self.conn.close()
 
-    def get_match_rows(self, q):
+    def reload_index(self):
+        with self.lock:
+            self.rankers.clear()
+            if self.segment is not None:
+                self.index = Segment(self.segment)
+                self.tokenizer.load(self.index.get_word_map())
+            elif self.use_index:
+                self.index = InvertedIndex(self.conn)
+
+    def load_index(self):
+        with self.lock:
+            if self.index is None:
+                self.reload_index()
+
+    def warm_up(self):
+        """Pay for loading jieba, the word ids and, with `use_index`, the inverted index before the first query."""
+        self.tokenizer.warm_up()
+        if self.use_index:
+            self.load_index()
+
+    def take_usage(self):
+        """When the predictor's hidden nodes were last used by searches since the last call, see `Predictor.touch`."""
+        return self.predictor.take_usage()
+
+    def get_generation(self):
+        """Tag identifying the current state of the index and predictor databases.
+
+        Besides the shared `Generation` counter, SQLite's `data_version` catches commits made by other processes.
+        """
+        return (self.generation.value, get_data_version(self.conn), get_data_version(self.predictor.conn))
+
+    def get_word_ids(self, q):
+        if self.segment is not None:
+            self.load_index()
+        return self.tokenizer.get_word_ids(q)
+
+    def get_query(self, q):
+        """Word ids of a query, plus the parsed `Query` if it uses phrase, NEAR, OR or NOT operators, else None."""
+        if not has_operators(q):
+            return self.get_word_ids(q), None
+        if self.segment is not None:
+            self.load_index()
+        query = parse_query(q, self.tokenizer.tokenize, self.tokenizer.get_word_id)
+        return query.word_ids(), query
+
+    def get_posting_source(self):
+        if self.use_index:
+            self.load_index()
+            return self.index
+        return SqlPostings(self.conn)
+
+    def match_query(self, word_ids, query=None):
+        if query is None:
+            return self.match_word_ids(word_ids)
+        return query.match(self.get_posting_source())
+
+    def match_word_ids(self, word_ids):
+        if self.use_index:
+            self.load_index()
+            return self.index.match(word_ids)
+        if not word_ids:
+            return []
         fields = "w0.urlid"
         tables = ""
         clauses = ""
-        word_ids = []
-
-        words = seperate_words(q)
-        table_number = 0
-
-        for word in words:
-            word_row = self.conn.execute(
-                "SELECT rowid FROM wordlist WHERE word=?", (word,)).fetchone()
-            if word_row is not None:
-                word_id = word_row[0]
-                word_ids.append(word_id)
-                if table_number > 0:
-                    tables += ","
-                    clauses += " AND "
-                    clauses += f"w{table_number - 1}.urlid=w{table_number}.urlid AND "
-                fields += f",w{table_number}.location"
-                tables += f"wordlocation w{table_number}"
-                clauses += f"w{table_number}.wordid={word_id}"
-                table_number += 1
+        for (table_number, word_id) in enumerate(word_ids):
+            if table_number > 0:
+                tables += ","
+                clauses += " AND "
+                clauses += f"w{table_number - 1}.urlid=w{table_number}.urlid AND "
+            fields += f",w{table_number}.location"
+            tables += f"wordlocation w{table_number}"
+            clauses += f"w{table_number}.wordid={word_id}"
         cursor = self.conn.execute(
             f"SELECT {fields} FROM {tables} WHERE {clauses}")
         rows = [row for row in cursor]
-        return rows, word_ids
+        return rows
 
-    def get_scored_list(self, rows, wordIds):
-        total_scores = dict([(row[0], 0) for row in rows])
-        weights = [(weight, func(rows, wordIds=wordIds, conn=self.conn,
-                    predictor=self.predictor)) for (weight, func) in self.weights]
+    def get_match_rows(self, q):
+        (word_ids, query) = self.get_query(q)
+        return self.match_query(word_ids, query), word_ids
 
-        for (weight, scores) in weights:
-            for url in total_scores:
-                total_scores[url] += weight * scores[url]
+    def get_score_columns(self, rows, wordIds, stats=None):
+        """Score every matched URL at once: the `Candidates` of `rows`, and the weighted sum of all scorers as an
+        array aligned with their `url_ids`.
+        """
+        candidates = Candidates(rows)
+        total_scores = np.zeros(len(candidates))
+        if not len(candidates):
+            return candidates, total_scores
+        for (weight, func) in self.weights:
+            with time_scorer(stats, func):
+                scores = score_column(func, candidates, wordIds=wordIds, conn=self.conn, predictor=self.predictor,
+                                      index=self.index)
+            total_scores += weight * scores
+        return candidates, total_scores
 
-        return total_scores
+    def get_scored_list(self, rows, wordIds, stats=None):
+        if not rows:
+            return {}
+        (candidates, total_scores) = self.get_score_columns(rows, wordIds, stats)
+        return candidates.to_dict(total_scores)
 
     def get_url_name(self, id):
+        if self.segment is not None:
+            self.load_index()
+            return self.index.get_url_name(id)
         return self.conn.execute("SELECT url FROM urllist WHERE rowid=?", (id,)).fetchone()[0]
 
-    def query(self, q):
-        (rows, word_ids) = self.get_match_rows(q)
-        scores = self.get_scored_list(rows, word_ids)
-        ranked_scores = sorted([(score, url)
-                               for (url, score) in scores.items()], reverse=True)
-        for (score, url_id) in ranked_scores[:10]:
-            print(f"{score}\t{url_id}\t{self.get_url_name(url_id)}")
+    def get_url_names(self, url_ids):
+        if self.segment is not None:
+            self.load_index()
+            return dict([(url_id, self.index.get_url_name(url_id)) for url_id in url_ids])
+        names = {}
+        for chunk in chunks(url_ids):
+            names.update(self.conn.execute(
+                f"SELECT rowid,url FROM urllist WHERE rowid IN ({','.join(['?'] * len(chunk))})", chunk).fetchall())
+        return names
+
+    def match_rows(self, word_ids, query=None, stats=None):
+        with stage(stats, "match"):
+            rows = self.match_query(word_ids, query)
+        if stats is not None:
+            stats.count("urls_matched", len(get_url_ids(rows)))
+            stats.count("rows_matched", len(rows))
+        return rows
+
+    def get_ranker(self, word_ids, generation, query=None, stats=None, exact=True):
+        key = (tuple(word_ids), query.key() if query is not None else None, exact)
+        with self.lock:
+            (ranker_generation, ranker) = self.rankers.get(key, (None, None))
+        if ranker is None or ranker_generation != generation:
+            rows = self.match_rows(word_ids, query, stats)
+            with stage(stats, "score"):
+                ranker = TopKRanker(rows, word_ids, self.weights, pool_factor=self.TOP_K_POOL_FACTOR,
+                                    exact=exact, stats=stats, conn=self.conn,
+                                    predictor=self.predictor, index=self.index)
+        elif stats is not None:
+            stats.count("ranker_hits")
+        with self.lock:
+            self.rankers[key] = (generation, ranker)
+            self.rankers.move_to_end(key)
+            while len(self.rankers) > self.MAX_RANKERS:
+                self.rankers.popitem(last=False)
+        return ranker
+
+    def rank(self, word_ids, limit=None, offset=0, generation=None, query=None, stats=None, exact=True):
+        if limit is None:
+            rows = self.match_rows(word_ids, query, stats)
+            with stage(stats, "score"):
+                (candidates, total_scores) = self.get_score_columns(rows, word_ids, stats)
+            with stage(stats, "rank"):
+                ranked_scores = rank_columns(candidates.url_ids, total_scores)
+        else:
+            ranker = self.get_ranker(word_ids, generation, query, stats, exact)
+            with stage(stats, "score"):
+                ranked_scores = ranker.top(offset + limit, stats)[offset:]
         return {
             "query_words": word_ids,
             "results": [{"score": score, "url_id": url_id} for (score, url_id) in ranked_scores]
         }
 
+    def query(self, q, limit=None, offset=0, exact=True):
+        """Rank the pages matching `q`, best first.
+
+        Args:
+            q (str): Query to search for.
+            limit (int, optional): Number of results to return. Defaults to None, which returns all of them.
+            offset (int, optional): Number of best results to skip. Defaults to 0.
+            exact (bool, optional): With a `limit`, run every scorer on all matches so the results are the same
+                as without one. Otherwise the expensive scorers only run on a pool of the best matches by the
+                cheap scorers, which is faster but approximate (see `TopKRanker`). Defaults to True.
+
+        Returns:
+            dict: The `query_words` ids and the `results`, `{"score", "url_id"}` dicts.
+        """
+        if not self.collect_stats:
+            return self.run_query(q, limit, offset, exact=exact)
+        stats = QueryStats(q)
+        with stats.trace(self.conn, self.predictor.conn):
+            result = self.run_query(q, limit, offset, stats, exact)
+        self.last_stats = stats.finish()
+        if self.on_stats is not None:
+            self.on_stats(stats)
+        return result
+
+    def run_query(self, q, limit=None, offset=0, stats=None, exact=True):
+        with stage(stats, "tokenize"):
+            (word_ids, query) = self.get_query(q)
+        generation = self.get_generation()
+        if self.cache is None:
+            result = self.rank(word_ids, limit, offset, generation, query, stats, exact)
+        else:
+            key = (tuple(word_ids), query.key() if query is not None else None, tuple(self.weights), limit, offset,
+                   exact)
+            with stage(stats, "cache"):
+                result = self.cache.get(key, generation)
+            if result is None:
+                result = self.rank(word_ids, limit, offset, generation, query, stats, exact)
+                self.cache.put(key, generation, result)
+            elif stats is not None:
+                stats.count("cache_hits")
+        if not self.quiet:
+            top = result["results"][:10]
+            with stage(stats, "urls"):
+                names = self.get_url_names([result_row["url_id"] for result_row in top])
+            for result_row in top:
+                print(f"{result_row['score']}\t{result_row['url_id']}\t{names[result_row['url_id']]}")
+        return result
+
+    def iter_query(self, q, batch_size=100):
+        """Yield the results of a query one by one, best first, without sorting or resolving all of them up front.
+
+        Every match is scored once, like `query` without a limit, so scores are normalized over all matches and
+        the results come in the same order as `query`. They are picked from the scores with a partial sort,
+        `batch_size` at first and twice as many whenever the caller reads past them, and URLs are looked up
+        `batch_size` at a time. Nothing is printed or cached.
+
+        Args:
+            q (str): Query to search for.
+            batch_size (int, optional): Number of results ranked and resolved at once at first. Defaults to 100.
+
+        Yields:
+            dict: `{"score", "url_id", "url"}` of the next result.
+        """
+        (word_ids, query) = self.get_query(q)
+        (candidates, total_scores) = self.get_score_columns(self.match_query(word_ids, query), word_ids)
+        served = 0
+        count = batch_size
+        while served < len(candidates):
+            ranked = rank_columns(candidates.url_ids, total_scores, count)
+            for start in range(served, len(ranked), batch_size):
+                batch = ranked[start:start + batch_size]
+                names = self.get_url_names([url_id for (_, url_id) in batch])
+                for (score, url_id) in batch:
+                    yield {"score": score, "url_id": url_id, "url": names[url_id]}
+            served = len(ranked)
+            count *= 2
 
 if __name__ == "__main__":
     engine = Searcher("search_index.db")
@@ -0,0 +1,244 @@
+from array import array
+from bisect import bisect_left
+from itertools import islice, product
+import sqlite3 as sqlite
+
+
+def encode_positions(positions):
+    """Delta and varint encode a sorted list of word positions."""
+    data = bytearray()
+    last = 0
+    for position in positions:
+        delta = position - last
+        last = position
+        while delta >= 0x80:
+            data.append((delta & 0x7f) | 0x80)
+            delta >>= 7
+        data.append(delta)
+    return bytes(data)
+
+
+def decode_positions(data):
+    positions = []
+    last = value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        last += value
+        positions.append(last)
+        value = shift = 0
+    return positions
+
+
+def min_chain_distance(position_lists):
+    """Smallest `sum(abs(p[i] - p[i - 1]))` over every way of picking one position per list.
+
+    This is what `Scoring.distance_score` computes over the rows of the SQL self-join, but done with
+    two linear sweeps per word instead of walking the cartesian product of the position lists.
+    """
+    costs = [(position, 0) for position in position_lists[0]]
+    for positions in position_lists[1:]:
+        best = []
+        j = 0
+        running = None
+        for position in positions:
+            while j < len(costs) and costs[j][0] <= position:
+                candidate = costs[j][1] - costs[j][0]
+                if running is None or candidate < running:
+                    running = candidate
+                j += 1
+            best.append(None if running is None else running + position)
+        j = len(costs) - 1
+        running = None
+        for i in range(len(positions) - 1, -1, -1):
+            position = positions[i]
+            while j >= 0 and costs[j][0] >= position:
+                candidate = costs[j][1] + costs[j][0]
+                if running is None or candidate < running:
+                    running = candidate
+                j -= 1
+            if running is not None and (best[i] is None or running - position < best[i]):
+                best[i] = running - position
+        costs = list(zip(positions, best))
+    return min(cost for (_, cost) in costs)
+
+
+class MatchRows(object):
+    def __init__(self, positions=None) -> None:
+        """Matched URLs of a query, with the positions of each query word kept per URL.
+
+        `positions` maps every matched url id to one sorted position list per query word. The built-in
+        scorers read these directly. Iterating the object still yields the `(urlid, location, ...)` tuples
+        the SQL self-join returns, so custom scoring functions written against `rows` keep working.
+
+        Args:
+            positions (dict, optional): url id -> list of position lists. Defaults to None.
+        """
+        super().__init__()
+        self.positions = positions if positions is not None else {}
+        self.url_ids = list(self.positions)
+
+    def __iter__(self):
+        for (url_id, position_lists) in self.positions.items():
+            for locations in product(*position_lists):
+                yield (url_id,) + locations
+
+    def __len__(self):
+        total = 0
+        for position_lists in self.positions.values():
+            count = 1
+            for positions in position_lists:
+                count *= len(positions)
+            total += count
+        return total
+
+    def __bool__(self):
+        return bool(self.positions)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        row = next(islice(iter(self), i, None), None)
+        if row is None:
+            raise IndexError("MatchRows index out of range")
+        return row
+
+
+class PostingList(object):
+    def __init__(self) -> None:
+        super().__init__()
+        self.url_ids = array("q")
+        self.positions = []
+
+    def append(self, url_id, positions):
+        self.url_ids.append(url_id)
+        self.positions.append(encode_positions(positions))
+
+    def seek(self, url_id, lo=0):
+        return bisect_left(self.url_ids, url_id, lo)
+
+    def get_positions(self, i):
+        return decode_positions(self.positions[i])
+
+    def __len__(self):
+        return len(self.url_ids)
+
+
+class SqlPostings(object):
+    def __init__(self, conn) -> None:
+        """Reads the posting list of a word straight from the `wordlocation` table when there is no index in memory."""
+        super().__init__()
+        self.conn = conn
+
+    def get_postings(self, word_id):
+        cursor = self.conn.execute(
+            "SELECT urlid,location FROM wordlocation WHERE wordid=? ORDER BY urlid,location", (word_id,))
+        posting = PostingList()
+        current = None
+        positions = []
+        for (url_id, location) in cursor:
+            if url_id != current:
+                if current is not None:
+                    posting.append(current, positions)
+                current = url_id
+                positions = []
+            positions.append(location)
+        if current is None:
+            return None
+        posting.append(current, positions)
+        return posting
+
+    def get_page_positions(self, url_id):
+        """Sorted positions of every indexed word on a page, skipping the tokens that were not indexed."""
+        return [location for (location,) in self.conn.execute(
+            "SELECT location FROM wordlocation WHERE urlid=? ORDER BY location", (url_id,))]
+
+
+class InvertedIndex(object):
+    def __init__(self, conn=None) -> None:
+        """In-memory inverted index built from the `wordlocation` table.
+
+        Every word id gets a posting list of sorted url ids, each with a compressed list of the word's
+        positions on that page, and every url id gets the compressed positions of all its indexed words so
+        proximity operators can count words rather than tokens. Conjunctive queries are answered by
+        intersecting posting lists instead of self-joining `wordlocation` once per query word.
+
+        Args:
+            conn (sqlite3.Connection, optional): Connection to load the index from. Defaults to None.
+        """
+        super().__init__()
+        self.postings = {}
+        self.pages = {}
+        self.inbound_counts = None
+        self.pageranks = None
+        if conn is not None:
+            self.load(conn)
+            self.load_link_stats(conn)
+
+    def load(self, conn):
+        postings = {}
+        pages = {}
+        cursor = conn.execute(
+            "SELECT wordid,urlid,location FROM wordlocation ORDER BY wordid,urlid,location")
+        current = None
+        positions = []
+        for (word_id, url_id, location) in cursor:
+            if (word_id, url_id) != current:
+                if current is not None:
+                    postings.setdefault(current[0], PostingList()).append(current[1], positions)
+                current = (word_id, url_id)
+                positions = []
+            positions.append(location)
+            pages.setdefault(url_id, array("q")).append(location)
+        if current is not None:
+            postings.setdefault(current[0], PostingList()).append(current[1], positions)
+        self.postings = postings
+        self.pages = dict([(url_id, encode_positions(sorted(locations))) for (url_id, locations) in pages.items()])
+
+    def load_link_stats(self, conn):
+        """Keep the inbound link count and PageRank of every URL in memory for the link-based scorers."""
+        self.inbound_counts = dict(conn.execute("SELECT toid,COUNT(*) FROM link GROUP BY toid").fetchall())
+        try:
+            self.pageranks = dict(conn.execute("SELECT urlid,score FROM pagerank").fetchall())
+        except sqlite.OperationalError:
+            self.pageranks = None
+
+    def get_postings(self, word_id):
+        return self.postings.get(word_id)
+
+    def get_page_positions(self, url_id):
+        return decode_positions(self.pages.get(url_id, b""))
+
+    def match(self, word_ids):
+        if not word_ids:
+            return MatchRows()
+        lists = [self.get_postings(word_id) for word_id in word_ids]
+        if any(posting is None for posting in lists):
+            return MatchRows()
+
+        order = sorted(range(len(lists)), key=lambda i: len(lists[i]))
+        shortest = lists[order[0]]
+        cursors = [0] * len(lists)
+        positions = {}
+        for (i, url_id) in enumerate(shortest.url_ids):
+            found = {order[0]: i}
+            for k in order[1:]:
+                j = lists[k].seek(url_id, cursors[k])
+                cursors[k] = j
+                if j == len(lists[k]) or lists[k].url_ids[j] != url_id:
+                    break
+                found[k] = j
+            else:
+                cache = {}
+                position_lists = []
+                for k in range(len(lists)):
+                    key = id(lists[k])
+                    if key not in cache:
+                        cache[key] = lists[k].get_positions(found[k])
+                    position_lists.append(cache[key])
+                positions[url_id] = position_lists
+            if any(cursors[k] >= len(lists[k]) for k in order[1:]):
+                break
+        return MatchRows(positions)
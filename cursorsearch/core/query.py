@@ -0,0 +1,372 @@
+import re
+from bisect import bisect_left
+from cursorsearch.core.index import MatchRows
+
+QUERY_TOKEN = re.compile(r'-?"[^"]*"|\S+')
+NEAR_OPERATOR = re.compile(r"^NEAR/(\d+)$")
+
+
+def merge_hits(results):
+    hits = {}
+    for (_, result_hits) in results:
+        for (word_id, positions) in result_hits.items():
+            hits.setdefault(word_id, set()).update(positions)
+    return dict([(word_id, sorted(positions)) for (word_id, positions) in hits.items()])
+
+
+def merge_anchors(results):
+    return sorted(set([anchor for (anchors, _) in results for anchor in anchors]))
+
+
+def intersect_docs(nodes, postings):
+    docs = None
+    for node in sorted(nodes, key=lambda node: node.cost(postings)):
+        docs = node.docs(postings) if docs is None else docs & node.docs(postings)
+        if not docs:
+            break
+    return docs if docs is not None else set()
+
+
+class PostingCache(object):
+    def __init__(self, source) -> None:
+        """Posting lists and page positions of `source`, each read at most once while evaluating a query.
+
+        Called with a word id it returns that word's posting list, so the query nodes can use it like a function.
+        """
+        super().__init__()
+        self.source = source
+        self.postings = {}
+        self.pages = {}
+
+    def __call__(self, word_id):
+        if word_id not in self.postings:
+            self.postings[word_id] = self.source.get_postings(word_id)
+        return self.postings[word_id]
+
+    def page_positions(self, url_id):
+        if url_id not in self.pages:
+            self.pages[url_id] = self.source.get_page_positions(url_id)
+        return self.pages[url_id]
+
+
+class Term(object):
+    def __init__(self, word_id) -> None:
+        super().__init__()
+        self.word_id = word_id
+
+    def key(self):
+        return ("term", self.word_id)
+
+    def word_ids(self):
+        return [self.word_id]
+
+    def cost(self, postings):
+        posting = postings(self.word_id)
+        return len(posting) if posting is not None else 0
+
+    def docs(self, postings):
+        posting = postings(self.word_id)
+        return set(posting.url_ids.tolist()) if posting is not None else set()
+
+    def match(self, postings, url_id):
+        posting = postings(self.word_id)
+        if posting is None:
+            return None
+        i = posting.seek(url_id)
+        if i == len(posting) or posting.url_ids[i] != url_id:
+            return None
+        positions = posting.get_positions(i)
+        return (positions, {self.word_id: positions})
+
+    def restrict(self, result, anchors):
+        return (anchors, {self.word_id: anchors})
+
+
+class Phrase(object):
+    def __init__(self, terms) -> None:
+        """Words that have to appear in this order, `terms` being `(word_id, offset)` pairs.
+
+        The offset of a word is its position in the tokenized phrase, so tokens that are never indexed, like
+        spaces, still take up their place. A phrase matches at start position `p` when every word has `p + offset`
+        among its positions, found by intersecting the shifted position lists of one page at a time.
+        """
+        super().__init__()
+        self.terms = terms
+
+    def key(self):
+        return ("phrase", tuple(self.terms))
+
+    def word_ids(self):
+        return [word_id for (word_id, _) in self.terms]
+
+    def cost(self, postings):
+        return min([Term(word_id).cost(postings) for (word_id, _) in self.terms])
+
+    def docs(self, postings):
+        return intersect_docs([Term(word_id) for (word_id, _) in self.terms], postings)
+
+    def match(self, postings, url_id):
+        starts = None
+        for (word_id, offset) in self.terms:
+            result = Term(word_id).match(postings, url_id)
+            if result is None:
+                return None
+            shifted = set([position - offset for position in result[0]])
+            starts = shifted if starts is None else starts & shifted
+            if not starts:
+                return None
+        return self.restrict(None, sorted(starts))
+
+    def restrict(self, result, anchors):
+        hits = {}
+        for (word_id, offset) in self.terms:
+            hits.setdefault(word_id, set()).update([anchor + offset for anchor in anchors])
+        return (anchors, dict([(word_id, sorted(positions)) for (word_id, positions) in hits.items()]))
+
+
+class Near(object):
+    def __init__(self, left, right, distance) -> None:
+        super().__init__()
+        self.left = left
+        self.right = right
+        self.distance = distance
+
+    def key(self):
+        return ("near", self.distance, self.left.key(), self.right.key())
+
+    def word_ids(self):
+        return self.left.word_ids() + self.right.word_ids()
+
+    def cost(self, postings):
+        return min(self.left.cost(postings), self.right.cost(postings))
+
+    def docs(self, postings):
+        return intersect_docs([self.left, self.right], postings)
+
+    def match(self, postings, url_id):
+        left = self.left.match(postings, url_id)
+        if left is None:
+            return None
+        right = self.right.match(postings, url_id)
+        if right is None:
+            return None
+        # Distances count indexed words, like phrase offsets, not the whitespace tokens between them.
+        page = postings.page_positions(url_id)
+        (left_anchors, right_anchors) = (left[0], right[0])
+        right_words = [bisect_left(page, anchor) for anchor in right_anchors]
+        kept_left = []
+        kept_right = []
+        lo = 0
+        marked = 0
+        for anchor in left_anchors:
+            word = bisect_left(page, anchor)
+            while lo < len(right_words) and right_words[lo] < word - self.distance:
+                lo += 1
+            hi = max(lo, marked)
+            while hi < len(right_words) and right_words[hi] <= word + self.distance:
+                hi += 1
+            if lo < len(right_words) and right_words[lo] <= word + self.distance:
+                kept_left.append(anchor)
+                kept_right.extend(right_anchors[max(lo, marked):hi])
+                marked = hi
+        if not kept_left:
+            return None
+        results = [self.left.restrict(left, kept_left), self.right.restrict(right, kept_right)]
+        return (merge_anchors(results), merge_hits(results))
+
+    def restrict(self, result, anchors):
+        return result
+
+
+class And(object):
+    def __init__(self, children) -> None:
+        super().__init__()
+        self.children = children
+
+    def key(self):
+        return ("and",) + tuple([child.key() for child in self.children])
+
+    def word_ids(self):
+        return [word_id for child in self.children for word_id in child.word_ids()]
+
+    def cost(self, postings):
+        return min([child.cost(postings) for child in self.children])
+
+    def docs(self, postings):
+        return intersect_docs(self.children, postings)
+
+    def match(self, postings, url_id):
+        results = []
+        for child in self.children:
+            result = child.match(postings, url_id)
+            if result is None:
+                return None
+            results.append(result)
+        return (merge_anchors(results), merge_hits(results))
+
+    def restrict(self, result, anchors):
+        return result
+
+
+class Or(And):
+    def key(self):
+        return ("or",) + tuple([child.key() for child in self.children])
+
+    def cost(self, postings):
+        return sum([child.cost(postings) for child in self.children])
+
+    def docs(self, postings):
+        docs = set()
+        for child in self.children:
+            docs |= child.docs(postings)
+        return docs
+
+    def match(self, postings, url_id):
+        results = [result for result in [child.match(postings, url_id) for child in self.children]
+                   if result is not None]
+        if not results:
+            return None
+        return (merge_anchors(results), merge_hits(results))
+
+
+class Query(object):
+    def __init__(self, include, exclude=None) -> None:
+        """A parsed query: every node in `include` has to match a page and none in `exclude` may.
+
+        Evaluation starts from the candidate pages of the cheapest node and checks the others page by page,
+        seeking into their posting lists, so the work grows with the length of the posting lists and never
+        with the product of their positions.
+
+        Args:
+            include (list): Nodes that all have to match.
+            exclude (list, optional): Nodes that must not match. Defaults to None.
+        """
+        super().__init__()
+        self.include = include
+        self.exclude = exclude if exclude is not None else []
+
+    def key(self):
+        return (tuple([node.key() for node in self.include]), tuple([node.key() for node in self.exclude]))
+
+    def word_ids(self):
+        return [word_id for node in self.include for word_id in node.word_ids()]
+
+    def match(self, source):
+        """Evaluate the query against `source`, anything with `get_postings(word_id)` and `get_page_positions(url_id)`.
+
+        Every page gets the same position lists, so the scorers compare pages on the same words: one list per
+        query word, except that an OR group gets a single list with the positions of whichever alternatives
+        matched. A page matching one alternative is thereby neither favored by the distance scorer nor
+        penalized by the location scorer against a page matching several.
+
+        Returns:
+            MatchRows: The matching pages, with the positions of every query word that took part in the match.
+        """
+        postings = PostingCache(source)
+        if not self.include:
+            return MatchRows()
+        root = And(self.include)
+        excluded = [(node, node.docs(postings)) for node in self.exclude]
+        positions = {}
+        for url_id in sorted(root.docs(postings)):
+            if any(url_id in docs and node.match(postings, url_id) is not None for (node, docs) in excluded):
+                continue
+            results = []
+            for node in self.include:
+                result = node.match(postings, url_id)
+                if result is None:
+                    break
+                results.append(result)
+            if len(results) < len(self.include):
+                continue
+            slots = {}
+            for (node, (anchors, hits)) in zip(self.include, results):
+                if isinstance(node, Or):
+                    slots.setdefault(node.key(), set()).update(anchors)
+                    continue
+                for word_id in node.word_ids():
+                    slots.setdefault(word_id, set()).update(hits[word_id])
+            positions[url_id] = [sorted(slot) for slot in slots.values()]
+        return MatchRows(positions)
+
+
+def has_operators(q):
+    for token in QUERY_TOKEN.findall(q):
+        if token.startswith('"') or token in ("OR", "NOT") or NEAR_OPERATOR.match(token) or \
+                (token.startswith("-") and len(token) > 1):
+            return True
+    return False
+
+
+def parse_query(q, tokenize, get_word_id):
+    """Parse a query with operators into a `Query`.
+
+    Supported are `"exact phrases"`, `a NEAR/k b` (both within `k` positions of each other), `a OR b` and
+    `NOT a` or `-a`. Everything else is required, like in a plain query. Words that are not in the index are
+    ignored, as they are in plain queries.
+
+    Args:
+        q (str): The query.
+        tokenize (function): Splits text into words, as the crawler did.
+        get_word_id (function): Maps a word to its id, or None if it was never indexed.
+
+    Returns:
+        Query: The parsed query.
+    """
+    tokens = QUERY_TOKEN.findall(q)
+
+    def parse_text(text):
+        if text.startswith('"') and text.endswith('"') and len(text) > 1:
+            terms = []
+            for (offset, word) in enumerate(tokenize(text[1:-1])):
+                word_id = get_word_id(word) if word.strip() else None
+                if word_id is not None:
+                    terms.append((word_id, offset))
+            if not terms:
+                return None
+            return Phrase(terms) if len(terms) > 1 else Term(terms[0][0])
+        children = []
+        for word in tokenize(text):
+            word_id = get_word_id(word) if word.strip() else None
+            if word_id is not None:
+                children.append(Term(word_id))
+        if not children:
+            return None
+        return children[0] if len(children) == 1 else And(children)
+
+    def parse_near(i):
+        node = parse_text(tokens[i])
+        i += 1
+        while i + 1 < len(tokens) and NEAR_OPERATOR.match(tokens[i]):
+            right = parse_text(tokens[i + 1])
+            distance = int(NEAR_OPERATOR.match(tokens[i]).group(1))
+            node = Near(node, right, distance) if node is not None and right is not None else None
+            i += 2
+        return (node, i)
+
+    def parse_or(i):
+        (node, i) = parse_near(i)
+        children = [node]
+        while i + 1 < len(tokens) and tokens[i] == "OR":
+            (node, i) = parse_near(i + 1)
+            children.append(node)
+        children = [child for child in children if child is not None]
+        if len(children) > 1:
+            return (Or(children), i)
+        return (children[0] if children else None, i)
+
+    include = []
+    exclude = []
+    i = 0
+    while i < len(tokens):
+        negated = False
+        if tokens[i] == "NOT" and i + 1 < len(tokens):
+            negated = True
+            i += 1
+        elif tokens[i].startswith("-") and len(tokens[i]) > 1:
+            negated = True
+            tokens[i] = tokens[i][1:]
+        (node, i) = parse_or(i)
+        if node is not None:
+            (exclude if negated else include).append(node)
+    return Query(include, exclude)
@@ -0,0 +1,239 @@
+import json
+import os
+import numpy as np
+from cursorsearch.core.index import MatchRows
+from cursorsearch.util import next_version, publish_version
+
+SEGMENT_VERSION = 3
+
+
+def group_starts(*columns):
+    """Index of the first row of every run of equal values in the sorted `columns`."""
+    if not len(columns[0]):
+        return np.zeros(0, dtype=np.int64)
+    changed = np.zeros(len(columns[0]), dtype=bool)
+    changed[0] = True
+    for column in columns:
+        changed[1:] |= column[1:] != column[:-1]
+    return np.flatnonzero(changed)
+
+
+def pack_strings(rows):
+    """Turn `(id, text)` rows into a sorted id array, an offset array and one UTF-8 byte blob."""
+    rows = sorted(rows)
+    data = [text.encode("utf-8") for (_, text) in rows]
+    offsets = np.zeros(len(data) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in data], out=offsets[1:])
+    return (np.array([rowid for (rowid, _) in rows], dtype=np.int64), offsets,
+            np.frombuffer(b"".join(data), dtype=np.uint8))
+
+
+def write_segment(conn, path):
+    """Export the postings, words, URLs, link text and link statistics of an index database as a segment.
+
+    The segment is written to a new `path.<n>` directory and `path` is then switched to it with
+    `publish_version`, so readers never see a half written or missing segment.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the index database.
+        path (str): Directory to write the segment to. An existing segment there is replaced.
+    """
+    postings = np.fromiter((value for row in conn.execute(
+        "SELECT wordid,urlid,location FROM wordlocation ORDER BY wordid,urlid,location") for value in row),
+        dtype=np.int64).reshape(-1, 3)
+    (word_column, url_column, locations) = postings.T
+    doc_starts = group_starts(word_column, url_column)
+    doc_words = word_column[doc_starts]
+    term_starts = group_starts(doc_words)
+    arrays = {
+        "term_ids": doc_words[term_starts],
+        "term_offsets": np.append(term_starts, len(doc_starts)),
+        "doc_ids": url_column[doc_starts],
+        "doc_offsets": np.append(doc_starts, len(postings)),
+        "positions": locations.astype(np.int32)
+    }
+    by_page = np.lexsort((locations, url_column))
+    page_starts = group_starts(url_column[by_page])
+    arrays["page_ids"] = url_column[by_page][page_starts]
+    arrays["page_offsets"] = np.append(page_starts, len(postings))
+    arrays["page_positions"] = locations[by_page].astype(np.int32)
+    (arrays["word_ids"], arrays["word_offsets"], arrays["words"]) = pack_strings(
+        conn.execute("SELECT rowid,word FROM wordlist").fetchall())
+    (arrays["url_ids"], arrays["url_offsets"], arrays["urls"]) = pack_strings(
+        conn.execute("SELECT rowid,url FROM urllist").fetchall())
+    inbound = np.array(conn.execute("SELECT toid,COUNT(*) FROM link GROUP BY toid ORDER BY toid").fetchall(),
+                       dtype=np.int64).reshape(-1, 2)
+    arrays["inbound_ids"] = inbound[:, 0].copy()
+    arrays["inbound_counts"] = inbound[:, 1].copy()
+    has_pagerank = conn.execute(
+        "SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name='pagerank'").fetchone()[0] > 0
+    pageranks = conn.execute("SELECT urlid,score FROM pagerank ORDER BY urlid").fetchall() if has_pagerank else []
+    arrays["pagerank_ids"] = np.array([url_id for (url_id, _) in pageranks], dtype=np.int64)
+    arrays["pagerank_scores"] = np.array([score for (_, score) in pageranks], dtype=np.float64)
+    links = np.array(conn.execute("SELECT linkwords.wordid,link.fromid,link.toid FROM linkwords CROSS JOIN link "
+                                  "WHERE linkwords.linkid=link.rowid ORDER BY linkwords.wordid").fetchall(),
+                     dtype=np.int64).reshape(-1, 3)
+    link_starts = group_starts(links[:, 0])
+    arrays["link_word_ids"] = links[link_starts, 0]
+    arrays["link_offsets"] = np.append(link_starts, len(links))
+    arrays["links"] = links[:, 1:].copy()
+
+    staging = next_version(path)
+    os.makedirs(staging)
+    for (name, values) in arrays.items():
+        np.save(os.path.join(staging, f"{name}.npy"), values)
+    with open(os.path.join(staging, "meta.json"), "w") as meta:
+        json.dump({
+            "version": SEGMENT_VERSION,
+            "terms": len(arrays["term_ids"]),
+            "docs": len(arrays["doc_ids"]),
+            "positions": len(arrays["positions"]),
+            "urls": len(arrays["url_ids"]),
+            "has_pagerank": has_pagerank
+        }, meta)
+    publish_version(path, staging)
+
+
+class ColumnMap(object):
+    def __init__(self, keys, values) -> None:
+        """Read-only `dict`-like view over a sorted key array and a value array of the same length."""
+        super().__init__()
+        self.keys = keys
+        self.values = values
+
+    def get(self, key, default=None):
+        i = int(np.searchsorted(self.keys, key))
+        if i < len(self.keys) and self.keys[i] == key:
+            return self.values[i].item()
+        return default
+
+    def get_many(self, keys, default=None):
+        """`get` for an array of keys, returned as a float array."""
+        i = np.minimum(np.searchsorted(self.keys, keys), max(0, len(self.keys) - 1))
+        found = (self.keys[i] == keys) if len(self.keys) else np.zeros(len(keys), dtype=bool)
+        values = np.full(len(keys), default, dtype=np.float64)
+        values[found] = self.values[i[found]]
+        return values
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return len(self.keys)
+
+
+class SegmentPostingList(object):
+    def __init__(self, url_ids, offsets, positions) -> None:
+        super().__init__()
+        self.url_ids = url_ids
+        self.offsets = offsets
+        self.positions = positions
+
+    def seek(self, url_id, lo=0):
+        return lo + int(np.searchsorted(self.url_ids[lo:], url_id))
+
+    def get_positions(self, i):
+        return self.positions[self.offsets[i]:self.offsets[i + 1]].tolist()
+
+    def __len__(self):
+        return len(self.url_ids)
+
+
+class Segment(object):
+    def __init__(self, path) -> None:
+        """Immutable index segment written by `write_segment` and opened with `mmap`.
+
+        A segment is a directory of flat NumPy arrays: a term dictionary of sorted word ids pointing into
+        the sorted url ids of their postings, which in turn point into one array of word positions, the
+        positions of every page in url order for the proximity operators, plus the word and URL strings,
+        the words of every link, inbound link counts and PageRank scores. Every array is memory-mapped
+        read-only, so any number of processes searching the same segment share one copy in the page cache.
+        It answers `match` like `InvertedIndex` and can be used wherever one is expected.
+
+        Scoring reads nothing but the segment and the predictor. The index database is still opened, as
+        its `data_version` tags cached results, and crawls keep writing to it until the next export.
+
+        Args:
+            path (str): Directory of the segment.
+        """
+        super().__init__()
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as meta:
+            self.meta = json.load(meta)
+        if self.meta.get("version") != SEGMENT_VERSION:
+            raise ValueError(f"Unsupported segment version {self.meta.get('version')} in {path}")
+        for name in ["term_ids", "term_offsets", "doc_ids", "doc_offsets", "positions", "page_ids", "page_offsets",
+                     "page_positions", "word_ids", "word_offsets", "words", "url_ids", "url_offsets", "urls",
+                     "inbound_ids", "inbound_counts", "pagerank_ids", "pagerank_scores", "link_word_ids",
+                     "link_offsets", "links"]:
+            setattr(self, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r"))
+        self.inbound_counts = ColumnMap(self.inbound_ids, self.inbound_counts)
+        self.pageranks = ColumnMap(self.pagerank_ids, self.pagerank_scores) if self.meta["has_pagerank"] else None
+
+    def get_string(self, ids, offsets, data, rowid):
+        i = int(np.searchsorted(ids, rowid))
+        if i == len(ids) or ids[i] != rowid:
+            return None
+        return data[offsets[i]:offsets[i + 1]].tobytes().decode("utf-8")
+
+    def get_url_name(self, url_id):
+        return self.get_string(self.url_ids, self.url_offsets, self.urls, url_id)
+
+    def get_word(self, word_id):
+        return self.get_string(self.word_ids, self.word_offsets, self.words, word_id)
+
+    def get_word_map(self):
+        data = self.words.tobytes()
+        offsets = self.word_offsets.tolist()
+        return dict([(data[offsets[i]:offsets[i + 1]].decode("utf-8"), word_id)
+                     for (i, word_id) in enumerate(self.word_ids.tolist())])
+
+    def get_postings(self, word_id):
+        i = int(np.searchsorted(self.term_ids, word_id))
+        if i == len(self.term_ids) or self.term_ids[i] != word_id:
+            return None
+        (start, end) = (int(self.term_offsets[i]), int(self.term_offsets[i + 1]))
+        return SegmentPostingList(self.doc_ids[start:end], self.doc_offsets[start:end + 1], self.positions)
+
+    def get_links(self, word_ids):
+        """`(word id, from id, to id)` rows of the links whose text contains any of `word_ids`."""
+        rows = []
+        for word_id in word_ids:
+            i = int(np.searchsorted(self.link_word_ids, word_id))
+            if i == len(self.link_word_ids) or self.link_word_ids[i] != word_id:
+                continue
+            links = self.links[self.link_offsets[i]:self.link_offsets[i + 1]]
+            rows.append(np.column_stack([np.full(len(links), word_id, dtype=np.int64), links]))
+        return np.concatenate(rows) if rows else np.zeros((0, 3), dtype=np.int64)
+
+    def get_page_positions(self, url_id):
+        i = int(np.searchsorted(self.page_ids, url_id))
+        if i == len(self.page_ids) or self.page_ids[i] != url_id:
+            return []
+        return self.page_positions[self.page_offsets[i]:self.page_offsets[i + 1]].tolist()
+
+    def match(self, word_ids):
+        if not word_ids:
+            return MatchRows()
+        lists = dict([(word_id, self.get_postings(word_id)) for word_id in set(word_ids)])
+        if any(posting is None for posting in lists.values()):
+            return MatchRows()
+
+        url_ids = None
+        for posting in sorted(lists.values(), key=len):
+            url_ids = posting.url_ids if url_ids is None else \
+                np.intersect1d(url_ids, posting.url_ids, assume_unique=True)
+        ranges = {}
+        for (word_id, posting) in lists.items():
+            found = np.searchsorted(posting.url_ids, url_ids)
+            ranges[word_id] = (posting.offsets[found].tolist(), posting.offsets[found + 1].tolist())
+        positions = {}
+        for (i, url_id) in enumerate(url_ids.tolist()):
+            position_lists = dict([(word_id, self.positions[starts[i]:ends[i]].tolist())
+                                   for (word_id, (starts, ends)) in ranges.items()])
+            positions[url_id] = [position_lists[word_id] for word_id in word_ids]
+        return MatchRows(positions)
+
+    def stats(self):
+        files = [os.path.join(self.path, name) for name in os.listdir(self.path)]
+        return dict(self.meta, bytes=sum([os.path.getsize(name) for name in files]))
@@ -0,0 +1,467 @@
+import json
+import os
+import sqlite3 as sqlite
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import count
+from threading import RLock
+from time import process_time
+from cursorsearch.core.cache import ResultCache
+from cursorsearch.core.engine import Searcher
+from cursorsearch.core.query import has_operators, parse_query
+from cursorsearch.core.stats import QueryStats, stage
+from cursorsearch.core.tokenizer import QueryTokenizer
+from cursorsearch.crawl.crawler import Crawler
+from cursorsearch.dl.predict import Predictor
+from cursorsearch.scoring.columns import Candidates, normalize_array, rank_columns
+from cursorsearch.scoring.scoring import get_raw_column, score_column
+from cursorsearch.util import Generation, enable_wal, get_data_version, next_version, publish_version
+
+SHARD_VERSION = 1
+
+
+def get_shard(url_id, shards):
+    return url_id % shards
+
+
+def get_source(conn):
+    return [row[2] for row in conn.execute("PRAGMA database_list") if row[1] == "main"][0]
+
+
+def has_table(conn, name):
+    return conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name=?", (name,)).fetchone()[0] > 0
+
+
+def get_logged(conn):
+    """Row id of the last `pagelog` entry, or 0 if nothing was logged."""
+    if not has_table(conn, "pagelog"):
+        return 0
+    return conn.execute("SELECT IFNULL(MAX(rowid),0) FROM pagelog").fetchone()[0]
+
+
+def trim_log(conn, logged):
+    """Delete the `pagelog` entries before `logged`, which the shards already contain.
+
+    The entry at `logged` itself is kept, so SQLite keeps numbering new entries after it.
+    """
+    if logged:
+        with conn:
+            conn.execute("DELETE FROM pagelog WHERE rowid<?", (logged,))
+
+
+def write_shards(conn, path, shards):
+    """Partition an index database by url id into `shards` shard databases.
+
+    Shard `i` holds the `wordlocation` rows of the URLs with `urlid % shards == i`, the links pointing at them
+    with their link words, so inbound counts and link text are complete, and a full copy of `wordlist` and
+    `pagerank`, so word ids and PageRank scores are the same on every shard. Like `write_segment`, the shards
+    are written to a new `path.<n>` directory and `path` is switched to it with `publish_version`. The `pagelog` entries the shards contain are
+    deleted, so only one set of shards per database can be kept up to date with `refresh_shards`.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the index database. Uncommitted changes are not exported.
+        path (str): Directory to write the shards to. Existing shards there are replaced.
+        shards (int): Number of shards.
+    """
+    source = get_source(conn)
+    has_pagerank = has_table(conn, "pagerank")
+    logged = get_logged(conn)
+    staging = next_version(path)
+    os.makedirs(staging)
+    for shard in range(shards):
+        crawler = Crawler(os.path.join(staging, f"shard{shard}.db"))
+        crawler.create_index_tables()
+        with crawler.bulk_load():
+            crawler.conn.execute("ATTACH DATABASE ? AS source", (source,))
+            crawler.conn.execute("INSERT INTO wordlist(rowid,word) SELECT rowid,word FROM source.wordlist")
+            crawler.conn.execute("INSERT INTO urllist(rowid,url) SELECT rowid,url FROM source.urllist "
+                                 f"WHERE rowid%{shards}={shard}")
+            crawler.conn.execute("INSERT INTO wordlocation(urlid,wordid,location) "
+                                 f"SELECT urlid,wordid,location FROM source.wordlocation WHERE urlid%{shards}={shard}")
+            crawler.conn.execute("INSERT INTO link(rowid,fromid,toid) SELECT rowid,fromid,toid FROM source.link "
+                                 f"WHERE toid%{shards}={shard}")
+            crawler.conn.execute("INSERT INTO linkwords(wordid,linkid) SELECT wordid,linkid FROM source.linkwords "
+                                 "WHERE linkid IN (SELECT rowid FROM link)")
+            if has_pagerank:
+                crawler.conn.execute("CREATE TABLE pagerank(urlid PRIMARY KEY,score,outdegree)")
+                crawler.conn.execute("INSERT INTO pagerank SELECT urlid,score,outdegree FROM source.pagerank")
+            crawler.conn.commit()
+            crawler.conn.execute("DETACH DATABASE source")
+        crawler.conn.close()
+    with open(os.path.join(staging, "meta.json"), "w") as meta:
+        json.dump({"version": SHARD_VERSION, "shards": shards, "pagelog": logged}, meta)
+    publish_version(path, staging)
+    trim_log(conn, logged)
+
+
+def refresh_shards(conn, path):
+    """Bring the shards at `path` up to date with the pages changed since they were written or last refreshed.
+
+    The crawler logs every page it indexes, re-indexes or removes in `pagelog`. Only those pages get their
+    postings replaced on their own shard and their outbound links replaced on the shards of the linked pages.
+    New words and URLs are appended and `pagerank` is copied again, as most scores move after a crawl. Shards
+    written before the log existed are written again with `write_shards`. The applied log entries are deleted
+    afterwards, so the log only grows between refreshes.
+
+    Unlike `write_shards` the shards are changed in place, one transaction per shard, so a search running
+    meanwhile may see some shards refreshed before others until `ShardedSearcher.reload_index`.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the index database. Uncommitted changes are not exported.
+        path (str): Directory of the shards.
+    """
+    with open(os.path.join(path, "meta.json")) as meta:
+        meta = json.load(meta)
+    if meta.get("pagelog") is None:
+        write_shards(conn, path, meta["shards"])
+        return
+    shards = meta["shards"]
+    logged = get_logged(conn)
+    changed = [url_id for (url_id,) in conn.execute(
+        "SELECT DISTINCT urlid FROM pagelog WHERE rowid>? AND rowid<=?", (meta["pagelog"], logged))]
+    source = get_source(conn)
+    has_pagerank = has_table(conn, "pagerank")
+    for shard in range(shards):
+        shard_conn = sqlite.connect(os.path.join(path, f"shard{shard}.db"))
+        shard_conn.execute("ATTACH DATABASE ? AS source", (source,))
+        shard_conn.execute("CREATE TEMP TABLE changed(urlid integer PRIMARY KEY)")
+        shard_conn.executemany("INSERT INTO temp.changed(urlid) VALUES (?)", [(url_id,) for url_id in changed])
+        with shard_conn:
+            shard_conn.execute("INSERT INTO main.wordlist(rowid,word) SELECT rowid,word FROM source.wordlist "
+                               "WHERE rowid>(SELECT IFNULL(MAX(rowid),0) FROM main.wordlist)")
+            shard_conn.execute("INSERT INTO main.urllist(rowid,url) SELECT rowid,url FROM source.urllist "
+                               f"WHERE rowid%{shards}={shard} "
+                               "AND rowid>(SELECT IFNULL(MAX(rowid),0) FROM main.urllist)")
+            shard_conn.execute("DELETE FROM main.wordlocation WHERE urlid IN (SELECT urlid FROM temp.changed)")
+            shard_conn.execute("INSERT INTO main.wordlocation(urlid,wordid,location) "
+                               "SELECT urlid,wordid,location FROM source.wordlocation "
+                               f"WHERE urlid IN (SELECT urlid FROM temp.changed) AND urlid%{shards}={shard}")
+            shard_conn.execute("DELETE FROM main.linkwords WHERE linkid IN "
+                               "(SELECT rowid FROM main.link WHERE fromid IN (SELECT urlid FROM temp.changed))")
+            shard_conn.execute("DELETE FROM main.link WHERE fromid IN (SELECT urlid FROM temp.changed)")
+            shard_conn.execute("INSERT INTO main.link(rowid,fromid,toid) SELECT rowid,fromid,toid FROM source.link "
+                               f"WHERE fromid IN (SELECT urlid FROM temp.changed) AND toid%{shards}={shard}")
+            shard_conn.execute("INSERT INTO main.linkwords(wordid,linkid) SELECT wordid,linkid FROM source.linkwords "
+                               "WHERE linkid IN (SELECT rowid FROM main.link WHERE fromid IN "
+                               "(SELECT urlid FROM temp.changed))")
+            if has_pagerank:
+                shard_conn.execute("CREATE TABLE IF NOT EXISTS main.pagerank(urlid PRIMARY KEY,score,outdegree)")
+                shard_conn.execute("DELETE FROM main.pagerank")
+                shard_conn.execute("INSERT INTO main.pagerank SELECT urlid,score,outdegree FROM source.pagerank")
+        shard_conn.execute("DETACH DATABASE source")
+        shard_conn.close()
+    meta["pagelog"] = logged
+    staging = os.path.join(path, "meta.json.tmp")
+    with open(staging, "w") as meta_file:
+        json.dump(meta, meta_file)
+    os.replace(staging, os.path.join(path, "meta.json"))
+    trim_log(conn, logged)
+
+
+
+shard_args = None
+searcher = None
+pending = {}
+busy = 0.0
+
+
+def open_shard(path, predictor_path, weights, use_index):
+    """Open the shard a worker process serves. Runs once when the process starts and again on `reload_shard`."""
+    global shard_args, searcher
+    shard_args = (path, predictor_path, weights, use_index)
+    searcher = Searcher(path, predictDbName=predictor_path, weights=weights, use_index=use_index, quiet=True)
+    if use_index:
+        searcher.load_index()
+
+
+def reload_shard():
+    pending.clear()
+    open_shard(*shard_args)
+
+
+@contextmanager
+def track_busy():
+    global busy
+    start = process_time()
+    try:
+        yield
+    finally:
+        busy += process_time() - start
+
+
+def take_usage():
+    return searcher.predictor.take_usage()
+
+
+def take_inferences():
+    return searcher.predictor.take_inferences()
+
+
+def take_busy():
+    """CPU seconds this worker spent in `prepare` and `finish` since the last call."""
+    global busy
+    (spent, busy) = (busy, 0.0)
+    return spent
+
+
+def prepare(key, word_ids, query):
+    """First phase of a sharded query: match and compute the raw score of every scorer on this shard.
+
+    The raw scores are kept for `finish`, and the smallest or largest one of every scorer is returned with
+    whether smaller is better, so the coordinator can work out the extremes over all shards. Returns None if
+    nothing on the shard matches.
+    """
+    with track_busy():
+        rows = searcher.match_query(word_ids, query)
+        if not rows:
+            return None
+        candidates = Candidates(rows)
+        kwargs = {"wordIds": word_ids, "conn": searcher.conn, "predictor": searcher.predictor, "index": searcher.index}
+        scores = []
+        extremes = []
+        for (weight, func) in searcher.weights:
+            raw = get_raw_column(func)
+            if raw is None:
+                scores.append((weight, score_column(func, candidates, **kwargs), None))
+                extremes.append(None)
+                continue
+            (column_func, small_is_better) = raw
+            values = column_func(candidates, **kwargs)
+            scores.append((weight, values, small_is_better))
+            extremes.append((float(values.min() if small_is_better else values.max()), small_is_better))
+        pending[key] = (candidates.url_ids, scores)
+        return extremes
+
+
+def finish(key, extremes, limit=None):
+    """Second phase: normalize with the global `extremes`, weigh the scores and return the shard's best results."""
+    with track_busy():
+        (url_ids, scores) = pending.pop(key)
+        total_scores = np.zeros(len(url_ids))
+        for ((weight, values, small_is_better), extreme) in zip(scores, extremes):
+            if small_is_better is not None:
+                values = normalize_array(values, small_is_better, extreme)
+            total_scores += weight * values
+        return rank_columns(url_ids, total_scores, limit)
+
+
+class ShardedSearcher(object):
+    def __init__(self, path, predictDbName="predictor.db", weights=[], use_index=False, cache_size=0,
+                 generation=None, concurrent=False, quiet=False, collect_stats=False, on_stats=None) -> None:
+        """Searches shards written by `write_shards`, one worker process per shard.
+
+        A query is tokenized once and sent to every shard, which matches it against its own URLs and computes
+        the raw scores. The coordinator combines the per-shard minima and maxima into the values
+        `normalize_array` would have used on the whole index, every shard normalizes and weighs its scores
+        with them and returns its best results, and the coordinator merges those lists. Rankings are therefore
+        the same as an unsharded `Searcher.query` without a limit. Custom scorers without a raw variant (see
+        `get_raw_column`) are normalized per shard.
+
+        Like `Searcher` it can cache results and report `QueryStats`, where the time spent waiting for the
+        shards is one `shards` stage. Queries may come from several threads, every shard answers them one at a
+        time.
+
+        Args:
+            path (str): Directory of the shards.
+            predictDbName (str, optional): Path to the predictor database. Defaults to "predictor.db".
+            weights (list, optional): `(weight, func)` scorers, as in `Searcher`. Defaults to [].
+            use_index (bool, optional): Keep every shard's postings in memory. Defaults to False.
+            cache_size (int, optional): Number of query results to keep in an LRU cache. Defaults to 0.
+            generation (Generation, optional): Counter bumped whenever the index or the predictor changes.
+                Defaults to None.
+            concurrent (bool, optional): Put the predictor database in WAL mode, so the shards keep predicting
+                while clicks are trained on. Defaults to False.
+            quiet (bool, optional): Don't print the top results of every query. Defaults to False.
+            collect_stats (bool, optional): Keep the `QueryStats` of the last query as `last_stats`.
+                Defaults to False.
+            on_stats (function, optional): Called with the `QueryStats` of every query. Defaults to None.
+        """
+        super().__init__()
+        self.path = path
+        self.predict_db_name = predictDbName
+        self.weights = weights
+        self.use_index = use_index
+        self.quiet = quiet
+        self.collect_stats = collect_stats or on_stats is not None
+        self.on_stats = on_stats
+        self.last_stats = None
+        self.generation = generation if generation is not None else Generation()
+        self.cache = ResultCache(max_entries=cache_size) if cache_size > 0 else None
+        self.segment = None
+        self.shards = 0
+        self.executors = []
+        self.conns = []
+        self.tokenizer = None
+        self.keys = count()
+        self.lock = RLock()
+        self.predictor = Predictor(predictDbName, generation=self.generation)
+        try:
+            self.predictor.make_tables()
+        except:
+            pass
+        if concurrent:
+            enable_wal(predictDbName)
+        if os.path.exists(os.path.join(path, "meta.json")):
+            self.reload_index()
+
+    def __del__(self):
+        for conn in self.conns:
+            conn.close()
+
+    def close(self):
+        for executor in self.executors:
+            executor.shutdown()
+        self.executors = []
+
+    def reload_index(self):
+        with self.lock:
+            with open(os.path.join(self.path, "meta.json")) as meta:
+                meta = json.load(meta)
+            if meta.get("version") != SHARD_VERSION:
+                raise ValueError(f"Unsupported shard version {meta.get('version')} in {self.path}")
+            paths = [os.path.join(self.path, f"shard{shard}.db") for shard in range(meta["shards"])]
+            if len(self.executors) == len(paths):
+                for future in [executor.submit(reload_shard) for executor in self.executors]:
+                    future.result()
+            else:
+                self.close()
+                self.executors = [ProcessPoolExecutor(max_workers=1, initializer=open_shard,
+                                                      initargs=(shard_path, self.predict_db_name, self.weights,
+                                                                self.use_index)) for shard_path in paths]
+            for conn in self.conns:
+                conn.close()
+            self.conns = [sqlite.connect(shard_path, check_same_thread=False) for shard_path in paths]
+            self.shards = len(paths)
+            self.tokenizer = QueryTokenizer(self.conns[0])
+            if self.cache is not None:
+                self.cache.clear()
+
+    def load_index(self):
+        with self.lock:
+            if not self.executors:
+                self.reload_index()
+
+    def warm_up(self):
+        self.load_index()
+        self.tokenizer.warm_up()
+        for future in [executor.submit(len, pending) for executor in self.executors]:
+            future.result()
+
+    def take_busy(self):
+        """CPU seconds every shard spent on queries since the last call.
+
+        On a machine with fewer cores than shards the workers take turns, so the latency of a query is roughly
+        the sum of these. With a core per shard it would be closer to their maximum. CPU time is used because
+        a worker waiting for a core is not busy.
+        """
+        return [future.result() for future in [executor.submit(take_busy) for executor in self.executors]]
+
+    def take_usage(self):
+        """When the predictor's hidden nodes were last used by any shard since the last call."""
+        used = self.predictor.take_usage()
+        for future in [executor.submit(take_usage) for executor in self.executors]:
+            for (hidden_id, when) in future.result().items():
+                used[hidden_id] = max(when, used.get(hidden_id, 0))
+        return used
+
+    def collect_inferences(self):
+        """Count the predictions every shard made since the last call in the `report` of `predictor`.
+
+        The shards run the predictor, so without this it reports none. Every shard predicts for its own
+        matches, so a query counts once per shard that matched it.
+        """
+        for future in [executor.submit(take_inferences) for executor in self.executors]:
+            self.predictor.add_inferences(*future.result())
+
+    def get_query(self, q):
+        self.load_index()
+        if not has_operators(q):
+            return self.tokenizer.get_word_ids(q), None
+        query = parse_query(q, self.tokenizer.tokenize, self.tokenizer.get_word_id)
+        return query.word_ids(), query
+
+    def get_url_names(self, url_ids):
+        names = {}
+        for shard in range(self.shards):
+            shard_ids = [url_id for url_id in url_ids if get_shard(url_id, self.shards) == shard]
+            if shard_ids:
+                names.update(self.conns[shard].execute(
+                    f"SELECT rowid,url FROM urllist WHERE rowid IN ({','.join(['?'] * len(shard_ids))})",
+                    shard_ids).fetchall())
+        return names
+
+    def rank(self, word_ids, limit=None, query=None):
+        key = next(self.keys)
+        extremes = [future.result() for future in
+                    [executor.submit(prepare, key, word_ids, query) for executor in self.executors]]
+        matched = [shard_extremes for shard_extremes in extremes if shard_extremes is not None]
+        if not matched:
+            return []
+        global_extremes = []
+        for scorer_extremes in zip(*matched):
+            if scorer_extremes[0] is None:
+                global_extremes.append(None)
+                continue
+            values = [value for (value, _) in scorer_extremes]
+            global_extremes.append(min(values) if scorer_extremes[0][1] else max(values))
+        futures = [executor.submit(finish, key, global_extremes, limit)
+                   for (executor, shard_extremes) in zip(self.executors, extremes) if shard_extremes is not None]
+        ranked = sorted([row for future in futures for row in future.result()], reverse=True)
+        return ranked if limit is None else ranked[:limit]
+
+    def get_generation(self):
+        """Like `Searcher.get_generation`, with the `data_version` of every shard, which `refresh_shards` changes."""
+        return (self.generation.value, get_data_version(self.predictor.conn)) + \
+            tuple([get_data_version(conn) for conn in self.conns])
+
+    def query(self, q, limit=None, offset=0, exact=True):
+        """Like `Searcher.query`. Every shard scores all of its matches, so results are always exact."""
+        if not self.collect_stats:
+            return self.run_query(q, limit, offset)
+        stats = QueryStats(q)
+        result = self.run_query(q, limit, offset, stats)
+        self.last_stats = stats.finish()
+        if self.on_stats is not None:
+            self.on_stats(stats)
+        return result
+
+    def rank_query(self, word_ids, query, limit=None, offset=0, stats=None):
+        with stage(stats, "shards"):
+            ranked_scores = self.rank(word_ids, None if limit is None else offset + limit, query)[offset:]
+        return {
+            "query_words": word_ids,
+            "results": [{"score": score, "url_id": url_id} for (score, url_id) in ranked_scores]
+        }
+
+    def run_query(self, q, limit=None, offset=0, stats=None):
+        with stage(stats, "tokenize"):
+            (word_ids, query) = self.get_query(q)
+        if self.cache is None:
+            result = self.rank_query(word_ids, query, limit, offset, stats)
+        else:
+            generation = self.get_generation()
+            key = (tuple(word_ids), query.key() if query is not None else None, tuple(self.weights), limit, offset)
+            with stage(stats, "cache"):
+                result = self.cache.get(key, generation)
+            if result is None:
+                result = self.rank_query(word_ids, query, limit, offset, stats)
+                self.cache.put(key, generation, result)
+            elif stats is not None:
+                stats.count("cache_hits")
+        if not self.quiet:
+            top = result["results"][:10]
+            with stage(stats, "urls"):
+                names = self.get_url_names([result_row["url_id"] for result_row in top])
+            for result_row in top:
+                print(f"{result_row['score']}\t{result_row['url_id']}\t{names[result_row['url_id']]}")
+        return result
+
+    def iter_query(self, q, batch_size=100):
+        (word_ids, query) = self.get_query(q)
+        ranked = self.rank(word_ids, None, query)
+        for start in range(0, len(ranked), batch_size):
+            batch = ranked[start:start + batch_size]
+            names = self.get_url_names([url_id for (_, url_id) in batch])
+            for (score, url_id) in batch:
+                yield {"score": score, "url_id": url_id, "url": names[url_id]}
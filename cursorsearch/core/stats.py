@@ -0,0 +1,85 @@
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+
+
+class QueryStats(object):
+    def __init__(self, query=None) -> None:
+        """Timings and counters collected while answering one query.
+
+        `stages` holds the milliseconds spent in each stage (`tokenize`, `cache`, `match`, `score`, `rank` and
+        `urls`), `scorers` the milliseconds spent in each scoring function, and `counters` things like
+        `urls_matched`, `rows_matched`, `sql_statements` and `cache_hits`.
+
+        Args:
+            query (str, optional): The query the stats belong to. Defaults to None.
+        """
+        super().__init__()
+        self.query = query
+        self.stages = {}
+        self.scorers = {}
+        self.counters = {}
+        self.started = perf_counter()
+        self.total = None
+
+    @contextmanager
+    def stage(self, name):
+        start = perf_counter()
+        try:
+            yield self
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + (perf_counter() - start) * 1000
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def count_statement(self, statement):
+        self.count("sql_statements")
+
+    def add_scorer(self, func, milliseconds):
+        name = getattr(func, "__name__", repr(func))
+        self.scorers[name] = self.scorers.get(name, 0.0) + milliseconds
+
+    @contextmanager
+    def scorer(self, func):
+        start = perf_counter()
+        try:
+            yield self
+        finally:
+            self.add_scorer(func, (perf_counter() - start) * 1000)
+
+    @contextmanager
+    def trace(self, *connections):
+        """Count the SQL statements run on `connections` while the block runs."""
+        connections = [conn.get() if hasattr(conn, "get") else conn for conn in connections]
+        for conn in connections:
+            conn.set_trace_callback(self.count_statement)
+        try:
+            yield self
+        finally:
+            for conn in connections:
+                conn.set_trace_callback(None)
+
+    def finish(self):
+        self.total = (perf_counter() - self.started) * 1000
+        return self
+
+    def as_dict(self):
+        return {
+            "query": self.query,
+            "total": self.total,
+            "stages": dict(self.stages),
+            "scorers": dict(self.scorers),
+            "counters": dict(self.counters)
+        }
+
+    def __repr__(self):
+        stages = ", ".join([f"{name} {ms:.2f}ms" for (name, ms) in self.stages.items()])
+        return f"<QueryStats {self.query!r} {self.total or 0.0:.2f}ms: {stages}>"
+
+
+def stage(stats, name):
+    return stats.stage(name) if stats is not None else nullcontext()
+
+
+def time_scorer(stats, func):
+    return stats.scorer(func) if stats is not None else nullcontext()
@@ -0,0 +1,78 @@
+import jieba
+from collections import OrderedDict
+from threading import Lock
+from cursorsearch.util import seperate_words
+
+
+class QueryTokenizer(object):
+    def __init__(self, conn, cache_size=4096) -> None:
+        """Turns query strings into word ids without a SQL lookup per token.
+
+        Tokenized queries are memoized in a bounded LRU cache, and the whole `wordlist` table is read into a
+        word to id dictionary on first use. Rows in `wordlist` are never renumbered, so the dictionary stays
+        valid while the crawler adds words; a word missing from it is looked up in SQL and remembered if found.
+
+        Args:
+            conn (sqlite3.Connection): Connection to the index database, None to only use the words passed to `load`.
+            cache_size (int, optional): Maximum number of memoized queries. Defaults to 4096.
+        """
+        super().__init__()
+        self.conn = conn
+        self.cache_size = cache_size
+        self.tokens = OrderedDict()
+        self.word_ids = None
+        self.lock = Lock()
+
+    def warm_up(self):
+        """Load jieba's dictionary and the word ids now instead of on the first query."""
+        jieba.initialize()
+        if self.word_ids is None:
+            self.load()
+
+    def load(self, word_ids=None):
+        if word_ids is None:
+            word_ids = {} if self.conn is None else \
+                dict([(word, rowid) for (rowid, word) in self.conn.execute("SELECT rowid,word FROM wordlist")])
+        with self.lock:
+            self.word_ids = word_ids
+
+    def tokenize(self, q):
+        with self.lock:
+            tokens = self.tokens.get(q)
+            if tokens is not None:
+                self.tokens.move_to_end(q)
+                return tokens
+        tokens = tuple(seperate_words(q))
+        with self.lock:
+            self.tokens[q] = tokens
+            while len(self.tokens) > self.cache_size:
+                self.tokens.popitem(last=False)
+        return tokens
+
+    def get_word_id(self, word):
+        if self.word_ids is None:
+            self.load()
+        word_id = self.word_ids.get(word)
+        if word_id is None and self.conn is not None:
+            row = self.conn.execute("SELECT rowid FROM wordlist WHERE word=?", (word,)).fetchone()
+            if row is None:
+                return None
+            word_id = row[0]
+            with self.lock:
+                self.word_ids[word] = word_id
+        return word_id
+
+    def get_word_ids(self, q):
+        word_ids = []
+        for word in self.tokenize(q):
+            if not word.strip():
+                continue
+            word_id = self.get_word_id(word)
+            if word_id is not None:
+                word_ids.append(word_id)
+        return word_ids
+
+    def clear(self):
+        with self.lock:
+            self.tokens.clear()
+            self.word_ids = None
@@ -0,0 +1,94 @@
+import numpy as np
+from threading import Lock
+from cursorsearch.core.index import MatchRows
+from cursorsearch.scoring.columns import Candidates, rank_columns, top_indices
+from cursorsearch.scoring.scoring import is_expensive, score_column
+from cursorsearch.core.stats import time_scorer
+
+
+def restrict_rows(rows, url_ids):
+    if isinstance(rows, MatchRows):
+        return MatchRows(dict([(url_id, rows.positions[url_id]) for url_id in url_ids]))
+    wanted = set(url_ids)
+    return [row for row in rows if row[0] in wanted]
+
+
+class TopKRanker(object):
+    def __init__(self, rows, wordIds, weights, pool_factor=4, exact=True, stats=None, **kwargs) -> None:
+        """Ranks the first results of a query, keeping its scores so later pages are sliced without scoring again.
+
+        With `exact` every scorer runs once on all matched URLs, so scores are normalized over all matches like
+        in an unlimited query, and each page is picked from them with a partial sort (see `top_indices`). Pages
+        therefore come in the same order as `query` without a limit, and scores never go up from one page to
+        the next.
+
+        Without `exact` the expensive scorers (see `Scoring.is_expensive`) only run on a pool of the best URLs by
+        cheap score, `pool_factor` times the requested results, and are normalized over that pool. That skips
+        most of their work on broad queries but is approximate: the expensive scores of a URL depend on the pool,
+        so results may differ from the exact ranking. When a later page needs a larger pool the results already
+        returned keep their place, so pages never repeat or skip a URL, but a later page may score higher than
+        an earlier one.
+
+        Args:
+            rows: Matched rows as returned by `Searcher.get_match_rows`.
+            wordIds (list): Ids of the query words.
+            weights (list): `(weight, func)` scorers, as in `Searcher.weights`.
+            pool_factor (int, optional): Pool size as a multiple of the requested results without `exact`.
+                Defaults to 4.
+            exact (bool, optional): Normalize every scorer over all matches. Defaults to True.
+            stats (QueryStats, optional): Records the time spent in the scorers. Defaults to None.
+        """
+        super().__init__()
+        self.rows = rows
+        self.word_ids = wordIds
+        self.kwargs = kwargs
+        self.pool_factor = pool_factor
+        self.exact = exact
+        self.expensive = [] if exact else [(weight, func) for (weight, func) in weights if is_expensive(func)]
+        candidates = Candidates(rows)
+        partial = np.zeros(len(candidates))
+        if len(candidates):
+            for (weight, func) in weights:
+                if (weight, func) in self.expensive:
+                    continue
+                with time_scorer(stats, func):
+                    scores = score_column(func, candidates, wordIds=wordIds, **kwargs)
+                partial += weight * scores
+        self.url_ids = candidates.url_ids
+        self.partial = partial
+        self.pool_size = 0
+        self.ranked = []
+        self.served = []
+        self.evaluations = 0
+        self.lock = Lock()
+
+    def evaluate(self, pool_size, stats=None):
+        chosen = top_indices(self.url_ids, self.partial, pool_size)
+        pool = self.url_ids[chosen].tolist()
+        scores = dict(zip(pool, self.partial[chosen].tolist()))
+        if pool:
+            candidates = Candidates(restrict_rows(self.rows, pool))
+            for (weight, func) in self.expensive:
+                with time_scorer(stats, func):
+                    expensive_scores = candidates.to_dict(score_column(func, candidates, wordIds=self.word_ids,
+                                                                       **self.kwargs))
+                for url_id in pool:
+                    scores[url_id] += weight * expensive_scores[url_id]
+        served = set(self.served)
+        self.ranked = [(scores[url_id], url_id) for url_id in self.served] + \
+            sorted([(score, url_id) for (url_id, score) in scores.items() if url_id not in served], reverse=True)
+        self.pool_size = len(pool)
+        self.evaluations += 1
+
+    def top(self, count, stats=None):
+        with self.lock:
+            if self.pool_size < min(count, len(self.url_ids)):
+                if not self.expensive:
+                    self.ranked = rank_columns(self.url_ids, self.partial, max(self.pool_size * 2, count))
+                    self.pool_size = len(self.ranked)
+                else:
+                    self.evaluate(max(self.pool_size * 2, count * self.pool_factor), stats)
+            results = self.ranked[:count]
+            if len(results) > len(self.served):
+                self.served = [url_id for (_, url_id) in results]
+            return results
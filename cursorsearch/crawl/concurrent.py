@@ -0,0 +1,150 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from threading import Lock, Semaphore
+from time import monotonic, sleep
+from urllib.parse import urlsplit
+from requests import Session
+from requests.adapters import HTTPAdapter
+from cursorsearch.crawl.crawler import Crawler
+from cursorsearch.crawl.frontier import Frontier
+from cursorsearch.crawl.parse import init_worker, tokenize_page
+
+
+class HostLimiter(object):
+    def __init__(self, per_host=2, delay=0.0) -> None:
+        """Caps the number of concurrent requests to one host and spaces out their start times.
+
+        Args:
+            per_host (int, optional): Maximum number of requests in flight per host. Defaults to 2.
+            delay (float, optional): Minimum number of seconds between two requests to a host. Defaults to 0.0.
+        """
+        super().__init__()
+        self.per_host = per_host
+        self.delay = delay
+        self.lock = Lock()
+        self.slots = {}
+        self.next_start = {}
+
+    def acquire(self, host):
+        with self.lock:
+            slot = self.slots.setdefault(host, Semaphore(self.per_host))
+        slot.acquire()
+        with self.lock:
+            now = monotonic()
+            start = max(now, self.next_start.get(host, now))
+            self.next_start[host] = start + self.delay
+        if start > now:
+            sleep(start - now)
+
+    def release(self, host):
+        self.slots[host].release()
+
+
+PARSE_METHODS = ["parse_page", "get_page_text", "get_page_links", "separate_words"]
+
+
+class ConcurrentCrawler(Crawler):
+    def __init__(self, dbName, workers=8, per_host=4, delay=0.0, timeout=10, session=None, batch_size=0,
+                 generation=None, parse_workers=0) -> None:
+        """Crawler that keeps several page downloads in flight at once.
+
+        A bounded pool of fetcher threads downloads pages through one shared, keep-alive connection pool,
+        while the calling thread parses and indexes whatever has already arrived. With `parse_workers`
+        set, parsing and tokenizing move to a pool of processes that send back `(url, words, links)`
+        records, and the calling thread only writes them. Subclasses that override how pages are parsed or
+        tokenized are parsed on the calling thread regardless, since their methods can't run in another process.
+        SQLite is only ever written from the calling thread.
+
+        Args:
+            dbName (str): Path to the main data storage database.
+            workers (int, optional): Number of fetcher threads. Defaults to 8.
+            per_host (int, optional): Maximum number of concurrent requests per host. Defaults to 4.
+            delay (float, optional): Politeness delay between requests to the same host in seconds. Defaults to 0.0.
+            timeout (int, optional): Timeout of a single request in seconds. Defaults to 10.
+            session (requests.Session, optional): HTTP session to fetch with. Defaults to None.
+            batch_size (int, optional): Number of pages written per transaction, 0 commits every page. Defaults to 0.
+            generation (Generation, optional): Counter bumped on every commit. Defaults to None.
+            parse_workers (int, optional): Number of parser processes, 0 parses on the calling thread. Defaults to 0.
+        """
+        super().__init__(dbName, batch_size=batch_size, generation=generation)
+        self.workers = workers
+        self.parse_workers = parse_workers
+        self.timeout = timeout
+        self.limiter = HostLimiter(per_host, delay)
+        if session is None:
+            session = Session()
+            adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers.update(self.headers)
+        self.session = session
+
+    def fetch(self, page, headers=None):
+        host = urlsplit(page).netloc
+        self.limiter.acquire(host)
+        try:
+            return self.session.get(page, headers=headers, timeout=self.timeout)
+        finally:
+            self.limiter.release(host)
+
+    def can_parse_in_processes(self):
+        """Whether `tokenize_page` parses and tokenizes pages the same way as this crawler's own methods."""
+        return all([getattr(type(self), name) is getattr(Crawler, name) for name in PARSE_METHODS])
+
+    def crawl(self, pages: list, max_pages=None, checkpoint=None):
+        frontier = Frontier(checkpoint)
+        for page in pages:
+            frontier.push(page)
+        fetched = 0
+        indexed = 0
+        parser = None
+        if self.parse_workers > 0 and self.can_parse_in_processes():
+            parser = ProcessPoolExecutor(max_workers=self.parse_workers, initializer=init_worker)
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                in_flight = {}
+                parsing = {}
+                while frontier or in_flight or parsing:
+                    while frontier and len(in_flight) + len(parsing) < (self.workers + self.parse_workers) * 2 and \
+                            (max_pages is None or fetched < max_pages):
+                        page = frontier.pop()
+                        in_flight[executor.submit(self.fetch, page)] = page
+                        fetched += 1
+                    if not in_flight and not parsing:
+                        break
+                    done, _ = wait(list(in_flight) + list(parsing), return_when=FIRST_COMPLETED)
+                    for future in done:
+                        if future in parsing:
+                            (page, response) = parsing.pop(future)
+                            try:
+                                record = future.result()
+                            except:
+                                print(f"Could not parse page {page}")
+                                frontier.done(page)
+                                continue
+                            for url in self.index_record(record, response):
+                                frontier.push(url)
+                        else:
+                            page = in_flight.pop(future)
+                            try:
+                                response = future.result()
+                                if parser is not None:
+                                    parsing[parser.submit(tokenize_page, page, response.content, self.BASE_URL,
+                                                          self.IGNOREURL)] = (page, response)
+                                    continue
+                                text, links = self.parse_page(response.content)
+                            except:
+                                print(f"Could not open page {page}")
+                                frontier.done(page)
+                                continue
+                            for url in self.index_page(page, text, links, response):
+                                frontier.push(url)
+                        frontier.done(page)
+                        indexed += 1
+                        if checkpoint is not None and indexed % self.CHECKPOINT_INTERVAL == 0:
+                            self.checkpoint(frontier)
+            if checkpoint is not None:
+                self.checkpoint(frontier)
+        finally:
+            if parser is not None:
+                parser.shutdown()
+        self.flush()
@@ -1,17 +1,24 @@
-from cursorsearch.util import seperate_words
+from cursorsearch.util import Generation, chunks, seperate_words
 from requests import get as get_webpage
 from bs4 import BeautifulSoup
+from contextlib import contextmanager
+from hashlib import sha1
+from time import time
+from cursorsearch.crawl.frontier import Frontier, canonicalize_url
+from cursorsearch.crawl.indexer import BulkIndexer
+from cursorsearch.crawl.pagerank import PageRank
+from cursorsearch.crawl.parse import get_page_links, get_page_text
 import sqlite3 as sqlite
 
 
 class Crawler(object):
-    def __init__(self, dbName) -> None:
+    def __init__(self, dbName, batch_size=0, generation=None) -> None:
         super().__init__()
         self.SITEMAP_URL = "https://www.helloworld.net/blog.xml"
         self.headers = {
             "User-Agent": "CursorSpider"
         }
-        self.conn = sqlite.connect(dbName)
+        self.conn = sqlite.connect(dbName, check_same_thread=False)
         self.IGNOREWORDS = [",", ".", "。", "，", "?", "？", "!", "！",
                             "\"", "“", "”", "'", "……", "的", "了", "：", ":", "", " "]
         self.IGNOREURL = ["https://www.helloworld.net/app/download", "https://www.helloworld.net/html2md",
@@ -21,12 +28,59 @@ class Crawler(object):
         self.PAGERANK_DAMPING_FACTOR = 0.85
         self.PAGERANK_INITIAL_VALUE = 1.0
         self.PAGERANK_MIN_VALUE = 0.15
+        self.CHECKPOINT_INTERVAL = 100
+        self.SECONDARY_INDEXES = {
+            "wordurlidx": "wordlocation(wordid)",
+            "urltoidx": "link(toid)",
+            "urlfromidx": "link(fromid)",
+            "linkwordidx": "linkwords(wordid)",
+            "wordlocurlidx": "wordlocation(urlid)",
+            "linkwordlinkidx": "linkwords(linkid)"
+        }
+        self.conn.execute("CREATE TABLE IF NOT EXISTS linklog(fromid integer,toid integer,added integer)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS pagelog(urlid integer)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS pagestate(urlid integer PRIMARY KEY,etag,lastmodified,hash,fetched)")
+        self.indexer = BulkIndexer(self.conn, batch_size) if batch_size > 0 else None
+        self.tokens_indexed = 0
+        self.generation = generation if generation is not None else Generation()
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] < 1:
+            if self.conn.execute(
+                    "SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name='urllist'").fetchone()[0]:
+                self.canonicalize_urls()
+            self.conn.execute("PRAGMA user_version=1")
+            self.conn.commit()
 
     def __del__(self):
         self.conn.close()
 
     def db_commit(self):
+        if self.indexer is not None:
+            if self.indexer.end_page():
+                self.generation.bump()
+            return
+        self.conn.commit()
+        self.generation.bump()
+
+    def flush(self):
+        if self.indexer is not None:
+            self.indexer.flush()
+        self.conn.commit()
+        self.generation.bump()
+
+    @contextmanager
+    def bulk_load(self):
+        """Drop the secondary indexes for the duration of a large crawl and rebuild them afterwards."""
+        for name in self.SECONDARY_INDEXES:
+            self.conn.execute(f"DROP INDEX IF EXISTS {name}")
         self.conn.commit()
+        try:
+            yield self
+        finally:
+            self.flush()
+            for (name, columns) in self.SECONDARY_INDEXES.items():
+                self.conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {columns}")
+            self.conn.commit()
 
     def get_entry_id(self, table, field, value, createnew=True):
         cur = self.conn.execute(
@@ -39,12 +93,18 @@ class Crawler(object):
         else:
             return res[0]
 
-    def add_to_index(self, url, text):
+    def add_to_index(self, url, text, words=None):
+        url = canonicalize_url(url)
         if self.is_indexed(url):
             return
         print(f"Indexing {url}")
 
-        words = self.separate_words(text)
+        if words is None:
+            words = self.separate_words(text)
+        if self.indexer is not None:
+            self.indexer.add_page(url, words, self.IGNOREWORDS)
+            self.tokens_indexed = self.indexer.tokens
+            return
         url_id = self.get_entry_id("urllist", "url", url)
 
         for i in range(len(words)):
@@ -54,22 +114,102 @@ class Crawler(object):
             word_id = self.get_entry_id("wordlist", "word", word)
             self.conn.execute(
                 "INSERT INTO wordlocation(urlid,wordid,location) values (?,?,?)", (url_id, word_id, i))
+            self.tokens_indexed += 1
+
+    def get_url_id(self, url):
+        url = canonicalize_url(url)
+        if self.indexer is not None:
+            return self.indexer.get_url_id(url)
+        return self.get_entry_id("urllist", "url", url)
+
+    def save_page_state(self, url, response):
+        self.conn.execute("INSERT OR REPLACE INTO pagestate(urlid,etag,lastmodified,hash,fetched) VALUES (?,?,?,?,?)",
+                          (self.get_url_id(url), response.headers.get("ETag"), response.headers.get("Last-Modified"),
+                           sha1(response.content).hexdigest(), int(time())))
+
+    def get_page_state(self, url):
+        row = self.conn.execute("SELECT pagestate.etag,pagestate.lastmodified,pagestate.hash FROM pagestate "
+                                "JOIN urllist ON urllist.rowid=pagestate.urlid WHERE urllist.url=?",
+                                (canonicalize_url(url),)).fetchone()
+        return row if row is not None else (None, None, None)
+
+    def log_page(self, url):
+        """Log that the postings or outbound links of `url` changed, for `refresh_shards`."""
+        self.conn.execute("INSERT INTO pagelog(urlid) VALUES (?)", (self.get_url_id(url),))
+
+    def remove_page(self, url):
+        """Delete the postings and outbound links of `url`, logging the removed links for the PageRank update."""
+        self.flush()
+        url_id = self.get_url_id(url)
+        self.log_page(url)
+        links = self.conn.execute("SELECT rowid,toid FROM link WHERE fromid=?", (url_id,)).fetchall()
+        for chunk in chunks([link_id for (link_id, _) in links]):
+            self.conn.execute(f"DELETE FROM linkwords WHERE linkid IN ({','.join(['?'] * len(chunk))})", chunk)
+        self.conn.execute("DELETE FROM link WHERE fromid=?", (url_id,))
+        self.conn.executemany("INSERT INTO linklog(fromid,toid,added) VALUES (?,?,0)",
+                              [(url_id, to_id) for (_, to_id) in links])
+        self.conn.execute("DELETE FROM wordlocation WHERE urlid=?", (url_id,))
+        if self.indexer is not None:
+            self.indexer.indexed_urls.discard(url_id)
+
+    def canonicalize_urls(self):
+        """Rewrite URLs stored before they were canonicalized into their `canonicalize_url` spelling.
+
+        A URL whose canonical spelling is stored as well is merged into that row: its links move over, and so do
+        its postings and page state unless the canonical row has its own. Moved links are logged in `linklog`
+        for the PageRank update and the pages whose links moved in `pagelog` for `refresh_shards`.
+        """
+        url_ids = dict([(url, rowid) for (rowid, url) in self.conn.execute("SELECT rowid,url FROM urllist")])
+        for (url, old_id) in list(url_ids.items()):
+            canonical = canonicalize_url(url)
+            if canonical == url:
+                continue
+            new_id = url_ids.get(canonical)
+            if new_id is None:
+                self.conn.execute("UPDATE urllist SET url=? WHERE rowid=?", (canonical, old_id))
+                url_ids[canonical] = old_id
+                continue
+            links = self.conn.execute("SELECT fromid,toid FROM link WHERE fromid=? OR toid=?",
+                                      (old_id, old_id)).fetchall()
+            self.conn.execute("UPDATE link SET fromid=? WHERE fromid=?", (new_id, old_id))
+            self.conn.execute("UPDATE link SET toid=? WHERE toid=?", (new_id, old_id))
+            self_links = [link_id for (link_id,) in self.conn.execute("SELECT rowid FROM link WHERE fromid=toid")]
+            for chunk in chunks(self_links):
+                self.conn.execute(f"DELETE FROM linkwords WHERE linkid IN ({','.join(['?'] * len(chunk))})", chunk)
+            self.conn.execute("DELETE FROM link WHERE fromid=toid")
+            self.conn.executemany("INSERT INTO linklog(fromid,toid,added) VALUES (?,?,1)",
+                                  [(new_id if from_id == old_id else from_id, new_id if to_id == old_id else to_id)
+                                   for (from_id, to_id) in links if from_id != to_id])
+            for table in ["wordlocation", "pagestate"]:
+                if self.conn.execute(f"SELECT 1 FROM {table} WHERE urlid=? LIMIT 1", (new_id,)).fetchone() is None:
+                    self.conn.execute(f"UPDATE {table} SET urlid=? WHERE urlid=?", (new_id, old_id))
+                else:
+                    self.conn.execute(f"DELETE FROM {table} WHERE urlid=?", (old_id,))
+            self.conn.execute("DELETE FROM urllist WHERE rowid=?", (old_id,))
+            self.conn.executemany("INSERT INTO pagelog(urlid) VALUES (?)",
+                                  [(url_id,) for url_id in set([old_id, new_id] + [from_id for (from_id, _) in links])])
+            del url_ids[url]
+        self.conn.commit()
 
     def separate_words(self, text):
         return seperate_words(text)
 
     def is_indexed(self, url):
-        u = self.conn.execute(
-            "SELECT rowid FROM urllist WHERE url=?", (url,)).fetchone()
-        if u is not None:
-            v = self.conn.execute(
-                "SELECT * FROM wordlocation WHERE urlid=?", (u[0],)).fetchone()
-            if v is not None:
-                return True
-        return False
-
-    def add_link_ref(self, urlFrom, urlTo, linkText):
-        words = self.separate_words(linkText)
+        url = canonicalize_url(url)
+        if self.indexer is not None:
+            return self.indexer.is_indexed(url)
+        v = self.conn.execute(
+            "SELECT 1 FROM wordlocation WHERE urlid=(SELECT rowid FROM urllist WHERE url=?) LIMIT 1", (url,)).fetchone()
+        return v is not None
+
+    def add_link_ref(self, urlFrom, urlTo, linkText, words=None):
+        (urlFrom, urlTo) = (canonicalize_url(urlFrom), canonicalize_url(urlTo))
+        if words is None:
+            words = self.separate_words(linkText)
+        if self.indexer is not None:
+            self.indexer.add_link(urlFrom, urlTo, words, self.IGNOREWORDS)
+            self.tokens_indexed = self.indexer.tokens
+            return
         fromid = self.get_entry_id('urllist', 'url', urlFrom)
         toid = self.get_entry_id('urllist', 'url', urlTo)
         if fromid == toid:
@@ -77,60 +217,188 @@ class Crawler(object):
         cur = self.conn.execute(
             "insert into link(fromid,toid) values (%d,%d)" % (fromid, toid))
         linkid = cur.lastrowid
+        self.conn.execute(
+            "insert into linklog(fromid,toid,added) values (%d,%d,1)" % (fromid, toid))
         for word in words:
             if word in self.IGNOREWORDS:
                 continue
             wordid = self.get_entry_id('wordlist', 'word', word)
             self.conn.execute(
                 "insert into linkwords(linkid,wordid) values (%d,%d)" % (linkid, wordid))
+            self.tokens_indexed += 1
 
-    def crawl(self, pages: list):
-        new_pages = True
-        depth = 0
-        while new_pages and depth <= 5000:
-            new_pages = []
-            depth += 1
-            for page in pages:
-                try:
-                    content = get_webpage(page).content
-                    soup = BeautifulSoup(content, "html.parser")
-                except:
-                    print(f"Could not open page {page}")
+    def get_page_text(self, soup):
+        return get_page_text(soup)
+
+    def get_page_links(self, soup):
+        return get_page_links(soup, self.BASE_URL, self.IGNOREURL)
+
+    def parse_page(self, content):
+        soup = BeautifulSoup(content, "html.parser")
+        return self.get_page_text(soup), self.get_page_links(soup)
+
+    def fetch(self, page, headers=None):
+        return get_webpage(page, headers=dict(self.headers, **(headers or {})))
+
+    def index_page(self, page, text, links, response=None):
+        if response is not None and not self.is_indexed(page):
+            self.save_page_state(page, response)
+        self.log_page(page)
+        self.add_to_index(page, text)
+        new_pages = []
+        for (url, link_text) in links:
+            try:
+                if self.is_indexed(url):
                     continue
-                try:
-                    try:
-                        self.add_to_index(
-                            page, soup.title.text + soup.body.article.text)
-                    except:
-                        self.add_to_index(
-                            page, soup.title.text + soup.body.text)
-                except:
-                    try:
-                        self.add_to_index(page, soup.body.article.text)
-                    except:
-                        self.add_to_index(page, soup.body.text)
-                # print(page, soup.title.text)
-                links = soup.body.findAll("a")
-                for link in links:
-                    try:
-                        try:
-                            link["href"]
-                        except:
-                            continue
-                        if link["href"].startswith("javascript") or link["href"].startswith("about:blank") or \
-                                link["href"].startswith("mailto"):
-                            continue
-                        url = (self.BASE_URL if not link["href"].startswith(
-                            "http") else "") + link["href"]
-                        if self.is_indexed(url) or "https://www.helloworld.net/redirect?" in url or \
-                                not url.startswith("https://www.helloworld.net") or url in self.IGNOREURL:
-                            continue
-                        self.add_link_ref(page, url, link.text)
-                        new_pages.append(url)
-                    except:
-                        pass
-                self.db_commit()
-            pages = new_pages
+                self.add_link_ref(page, url, link_text)
+                new_pages.append(url)
+            except:
+                pass
+        self.db_commit()
+        return new_pages
+
+    def index_record(self, record, response=None):
+        """Index a page that was already parsed and tokenized by `tokenize_page`.
+
+        Args:
+            record (tuple): `(url, words, links)` with `links` a list of `(url, anchor words)` pairs.
+            response (requests.Response, optional): Response the page came from, to remember for `recrawl`.
+                Defaults to None.
+
+        Returns:
+            list: Linked pages that still have to be crawled.
+        """
+        (page, words, links) = record
+        if response is not None and not self.is_indexed(page):
+            self.save_page_state(page, response)
+        self.log_page(page)
+        self.add_to_index(page, None, words=words)
+        new_pages = []
+        for (url, link_words) in links:
+            try:
+                if self.is_indexed(url):
+                    continue
+                self.add_link_ref(page, url, None, words=link_words)
+                new_pages.append(url)
+            except:
+                pass
+        self.db_commit()
+        return new_pages
+
+    def checkpoint(self, frontier):
+        self.flush()
+        frontier.checkpoint()
+
+    def crawl(self, pages: list, checkpoint=None):
+        """Crawl `pages` and every page they lead to, most linked pages first.
+
+        Args:
+            pages (list): URLs to start with.
+            checkpoint (str, optional): File the frontier is saved to every `CHECKPOINT_INTERVAL` pages. A crawl
+                started again with the same file resumes where the last one stopped. Defaults to None.
+        """
+        frontier = Frontier(checkpoint)
+        for page in pages:
+            frontier.push(page)
+        crawled = 0
+        while frontier:
+            page = frontier.pop()
+            try:
+                response = self.fetch(page)
+                text, links = self.parse_page(response.content)
+            except:
+                print(f"Could not open page {page}")
+                frontier.done(page)
+                continue
+            for url in self.index_page(page, text, links, response):
+                frontier.push(url)
+            frontier.done(page)
+            crawled += 1
+            if checkpoint is not None and crawled % self.CHECKPOINT_INTERVAL == 0:
+                self.checkpoint(frontier)
+        if checkpoint is not None:
+            self.checkpoint(frontier)
+        self.flush()
+
+    def reindex_page(self, page, content):
+        """Replace the postings and outbound links of an indexed page with those of its new `content`.
+
+        Unlike `index_page`, links to pages that are already indexed are kept too, since the old ones were removed.
+
+        Returns:
+            list: Linked pages that are not indexed yet.
+        """
+        text, links = self.parse_page(content)
+        self.remove_page(page)
+        self.add_to_index(page, text)
+        new_pages = []
+        for (url, link_text) in links:
+            try:
+                if not self.is_indexed(url):
+                    new_pages.append(url)
+                self.add_link_ref(page, url, link_text)
+            except:
+                pass
+        self.db_commit()
+        return new_pages
+
+    def recrawl(self, pages=None):
+        """Fetch indexed pages again and re-index the ones whose content changed.
+
+        Every page is requested with `If-None-Match`/`If-Modified-Since` from its last fetch, so a `304 Not Modified`
+        skips it. A page whose body hashes the same as before is skipped as well. Changed pages get their postings
+        and links rewritten, with the removed and added links logged in `linklog` for the incremental PageRank update.
+
+        Args:
+            pages (list, optional): URLs to refresh. Defaults to None, which refreshes every indexed page.
+
+        Returns:
+            dict: Counts of `not_modified`, `unchanged`, `changed` and `failed` pages, the `changed_urls` and the
+                `new_pages` linked from changed pages that are not indexed yet.
+        """
+        self.flush()
+        for name in ["wordlocurlidx", "linkwordlinkidx"]:
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {self.SECONDARY_INDEXES[name]}")
+        if pages is None:
+            pages = [url for (url,) in self.conn.execute(
+                "SELECT url FROM urllist WHERE rowid IN (SELECT DISTINCT urlid FROM wordlocation)")]
+        stats = {"not_modified": 0, "unchanged": 0, "changed": 0, "failed": 0, "changed_urls": [], "new_pages": []}
+        for page in pages:
+            (etag, last_modified, content_hash) = self.get_page_state(page)
+            headers = {}
+            if etag is not None:
+                headers["If-None-Match"] = etag
+            if last_modified is not None:
+                headers["If-Modified-Since"] = last_modified
+            try:
+                response = self.fetch(page, headers)
+            except:
+                print(f"Could not open page {page}")
+                stats["failed"] += 1
+                continue
+            if response.status_code == 304:
+                stats["not_modified"] += 1
+                continue
+            if response.status_code >= 400:
+                stats["failed"] += 1
+                continue
+            if sha1(response.content).hexdigest() == content_hash:
+                self.save_page_state(page, response)
+                stats["unchanged"] += 1
+                continue
+            print(f"Re-indexing {page}")
+            try:
+                stats["new_pages"] += self.reindex_page(page, response.content)
+            except:
+                print(f"Could not parse page {page}")
+                stats["failed"] += 1
+                continue
+            self.save_page_state(page, response)
+            stats["changed"] += 1
+            stats["changed_urls"].append(page)
+        self.flush()
+        stats["new_pages"] = list(dict.fromkeys(stats["new_pages"]))
+        return stats
 
     def create_index_tables(self):
         self.conn.execute('create table urllist(url)')
@@ -140,37 +408,22 @@ class Crawler(object):
         self.conn.execute('create table linkwords(wordid,linkid)')
         self.conn.execute('create index wordidx on wordlist(word)')
         self.conn.execute('create index urlidx on urllist(url)')
-        self.conn.execute('create index wordurlidx on wordlocation(wordid)')
-        self.conn.execute('create index urltoidx on link(toid)')
-        self.conn.execute('create index urlfromidx on link(fromid)')
-        self.db_commit()
-
-    def calculate_pagerank(self, iterations=20):
-        self.conn.execute("DROP TABLE IF EXISTS pagerank")
-        self.conn.execute("CREATE TABLE pagerank(urlid PRIMARY KEY,score)")
-
-        self.conn.execute(
-            f"INSERT INTO pagerank SELECT rowid, {self.PAGERANK_INITIAL_VALUE} FROM urllist")
+        for (name, columns) in self.SECONDARY_INDEXES.items():
+            self.conn.execute(f'create index {name} on {columns}')
         self.db_commit()
 
-        for i in range(iterations):
-            print(f"Calculating PageRank... Iteration {i}")
-            row_ids = self.conn.execute("SELECT rowid FROM urllist")
-            for (urlid,) in row_ids:
-                pr = self.PAGERANK_MIN_VALUE
-
-                linkers = self.conn.execute(
-                    "SELECT DISTINCT fromid FROM link WHERE toid=?", (urlid,))
-                for (linker,) in linkers:
-                    linking_pr = self.conn.execute(
-                        "SELECT score FROM pagerank WHERE urlid=?", (linker,)).fetchone()[0]
-                    linking_count = self.conn.execute(
-                        "SELECT COUNT(*) FROM link WHERE fromid=?", (linker,)).fetchone()[0]
-                    pr += self.PAGERANK_DAMPING_FACTOR * \
-                        (linking_pr / linking_count)
-                self.conn.execute(
-                    "UPDATE pagerank SET score=? WHERE urlid=?", (pr, urlid))
-            self.db_commit()
+    def calculate_pagerank(self, iterations=100, tolerance=1e-6, incremental=False):
+        self.flush()
+        pagerank = PageRank(self.PAGERANK_DAMPING_FACTOR, self.PAGERANK_MIN_VALUE, tolerance, iterations)
+        pagerank.load(self.conn)
+        if incremental and pagerank.update(self.conn):
+            print(pagerank.report())
+        else:
+            pagerank.run(self.PAGERANK_INITIAL_VALUE)
+            pagerank.save(self.conn)
+            print(f"Calculated PageRank in {pagerank.iterations} iterations")
+        self.generation.bump()
+        return pagerank
 
 
 if __name__ == "__main__":
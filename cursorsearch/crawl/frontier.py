@@ -0,0 +1,262 @@
+import heapq
+import os
+import posixpath
+import sqlite3 as sqlite
+import sys
+from functools import lru_cache
+from hashlib import blake2b
+from math import ceil, log
+from urllib.parse import urlsplit, urlunsplit
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+@lru_cache(maxsize=65536)
+def canonicalize_url(url):
+    """Normalize a URL so that different spellings of one page compare equal.
+
+    The scheme and host are lowercased, default ports, the fragment and a trailing slash are dropped, `.` and
+    `..` path segments are resolved and query parameters are sorted. Their encoding is left untouched.
+    """
+    try:
+        parts = urlsplit(url.strip())
+        port = parts.port
+    except ValueError:
+        return url
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or "").lower()
+    if port is not None and DEFAULT_PORTS.get(scheme) != port:
+        netloc += f":{port}"
+    if parts.username is not None:
+        netloc = parts.netloc.rsplit("@", 1)[0] + "@" + netloc
+    path = posixpath.normpath(parts.path) if parts.path else "/"
+    if path == ".":
+        path = "/"
+    query = "&".join(sorted([param for param in parts.query.split("&") if param]))
+    return urlunsplit((scheme, netloc, path, query, ""))
+
+
+def hash_url(url):
+    digest = blake2b(url.encode("utf-8"), digest_size=16).digest()
+    return (int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1)
+
+
+class BloomFilter(object):
+    def __init__(self, capacity, error_rate=0.001) -> None:
+        """Fixed-size Bloom filter over strings, sized for `capacity` entries at a false positive rate of `error_rate`.
+
+        Positions come from double hashing one 128-bit BLAKE2 digest, so every lookup hashes the key once.
+        """
+        super().__init__()
+        self.capacity = capacity
+        self.size = max(8, ceil(-capacity * log(error_rate) / log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, hashed):
+        (h1, h2) = hashed
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, hashed):
+        for position in self.positions(hashed):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def contains(self, hashed):
+        for position in self.positions(hashed):
+            if not self.bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    @property
+    def nbytes(self):
+        return len(self.bits)
+
+
+class ScalableBloomFilter(object):
+    def __init__(self, capacity=100000, error_rate=0.001, growth=2, tightening=0.5) -> None:
+        """Bloom filter that grows with the number of entries instead of needing their count up front.
+
+        Once a filter holds its capacity, a new one `growth` times as large is added with a false positive rate
+        `tightening` times lower, which keeps the combined rate below `error_rate` however many are added.
+
+        Args:
+            capacity (int, optional): Entries of the first filter. Defaults to 100000.
+            error_rate (float, optional): Upper bound of the false positive rate. Defaults to 0.001.
+            growth (int, optional): Capacity of every filter as a multiple of the previous one. Defaults to 2.
+            tightening (float, optional): Error rate of every filter as a fraction of the previous one. Defaults to 0.5.
+        """
+        super().__init__()
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.growth = growth
+        self.tightening = tightening
+        self.filters = []
+
+    def add(self, url):
+        hashed = hash_url(url)
+        if not self.filters or self.filters[-1].count >= self.filters[-1].capacity:
+            i = len(self.filters)
+            self.filters.append(BloomFilter(self.capacity * self.growth ** i,
+                                            self.error_rate * (1 - self.tightening) * self.tightening ** i))
+        self.filters[-1].add(hashed)
+
+    def __contains__(self, url):
+        hashed = hash_url(url)
+        return any(bloom.contains(hashed) for bloom in self.filters)
+
+    def __len__(self):
+        return sum([bloom.count for bloom in self.filters])
+
+    @property
+    def nbytes(self):
+        return sum([bloom.nbytes for bloom in self.filters])
+
+
+class Frontier(object):
+    def __init__(self, path=None, capacity=100000, error_rate=0.001, batch_size=10000) -> None:
+        """URLs waiting to be fetched, most linked first, each queued once per crawl.
+
+        URLs are canonicalized before anything else. Whether one was seen already is answered by a scalable Bloom
+        filter in memory; only when the filter says yes is the exact set of seen URLs in SQLite consulted, which
+        also catches the filter's false positives. Every time a queued URL is linked again its count goes up,
+        and `pop` returns the URL with the most inbound links, the earliest found first among equals.
+
+        With `path` the seen set and the queue are kept in that file and `checkpoint` saves the queue there, so
+        a crawl started again with the same file resumes where it stopped. URLs popped but not `done` at the
+        last checkpoint are queued again. A checkpoint with nothing left to crawl empties the file, so the next
+        crawl with it starts over instead of skipping every URL seen before. Without `path` SQLite uses a
+        temporary file.
+
+        Args:
+            path (str, optional): Checkpoint file. Defaults to None.
+            capacity (int, optional): URLs the first Bloom filter is sized for. Defaults to 100000.
+            error_rate (float, optional): False positive rate of the Bloom filter. Defaults to 0.001.
+            batch_size (int, optional): Seen URLs buffered in memory before they are written out. Defaults to 10000.
+        """
+        super().__init__()
+        self.path = path
+        self.batch_size = batch_size
+        self.conn = sqlite.connect(path if path is not None else "")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS seen(url TEXT PRIMARY KEY)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS queue(url TEXT PRIMARY KEY,inlinks INTEGER,seq INTEGER)")
+        self.bloom = ScalableBloomFilter(capacity, error_rate)
+        self.pending = set()
+        self.queued = {}
+        self.heap = []
+        self.in_flight = {}
+        self.seq = 0
+        self.lookups = 0
+        self.false_positives = 0
+        if self.conn.execute("SELECT COUNT(*) FROM queue").fetchone()[0] == 0:
+            # Nothing to resume, like after a finished crawl.
+            self.conn.execute("DELETE FROM seen")
+            self.conn.commit()
+        for (url,) in self.conn.execute("SELECT url FROM seen"):
+            self.bloom.add(url)
+        for (url, inlinks, seq) in self.conn.execute("SELECT url,inlinks,seq FROM queue"):
+            self.queued[url] = (inlinks, seq)
+            self.heap.append((-inlinks, seq, url))
+            self.seq = max(self.seq, seq + 1)
+        heapq.heapify(self.heap)
+
+    def __del__(self):
+        self.conn.close()
+
+    def is_seen(self, url):
+        if url not in self.bloom:
+            return False
+        if url in self.pending:
+            return True
+        self.lookups += 1
+        if self.conn.execute("SELECT 1 FROM seen WHERE url=?", (url,)).fetchone() is None:
+            self.false_positives += 1
+            return False
+        return True
+
+    def push(self, url):
+        """Queue `url` unless it was seen before, in which case a queued URL moves up one inbound link.
+
+        Returns:
+            bool: Whether the URL was new.
+        """
+        url = canonicalize_url(url)
+        if url in self.queued:
+            (inlinks, seq) = self.queued[url]
+            self.queued[url] = (inlinks + 1, seq)
+            heapq.heappush(self.heap, (-inlinks - 1, seq, url))
+            return False
+        if url in self.in_flight or self.is_seen(url):
+            return False
+        self.bloom.add(url)
+        self.pending.add(url)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        self.queued[url] = (1, self.seq)
+        heapq.heappush(self.heap, (-1, self.seq, url))
+        self.seq += 1
+        return True
+
+    def is_current(self, entry):
+        return self.queued.get(entry[2]) == (-entry[0], entry[1])
+
+    def pop(self):
+        entry = heapq.heappop(self.heap)
+        while not self.is_current(entry):
+            entry = heapq.heappop(self.heap)
+        url = entry[2]
+        self.in_flight[url] = self.queued.pop(url)
+        if len(self.heap) > 2 * len(self.queued) + 1000:
+            # Every extra inbound link leaves an outdated entry behind, drop them once they pile up.
+            self.heap = [entry for entry in self.heap if self.is_current(entry)]
+            heapq.heapify(self.heap)
+        return url
+
+    def done(self, url):
+        """Mark a popped URL as handled, fetched or not, so a resumed crawl does not fetch it again."""
+        self.in_flight.pop(canonicalize_url(url), None)
+
+    def flush(self):
+        self.conn.executemany("INSERT OR IGNORE INTO seen(url) VALUES (?)", [(url,) for url in self.pending])
+        self.conn.commit()
+        self.pending.clear()
+
+    def checkpoint(self):
+        """Save the seen URLs and the queue, including URLs that are popped but not `done`, to the checkpoint file.
+
+        Once nothing is queued or popped the crawl is complete and the file is emptied instead.
+        """
+        if not self.queued and not self.in_flight:
+            self.pending.clear()
+            self.conn.execute("DELETE FROM seen")
+            self.conn.execute("DELETE FROM queue")
+            self.conn.commit()
+            return
+        self.flush()
+        self.conn.execute("DELETE FROM queue")
+        self.conn.executemany("INSERT INTO queue(url,inlinks,seq) VALUES (?,?,?)",
+                              [(url, inlinks, seq) for (url, (inlinks, seq)) in
+                               list(self.in_flight.items()) + list(self.queued.items())])
+        self.conn.commit()
+
+    def stats(self):
+        """Sizes of the frontier, with the memory it takes per million seen URLs."""
+        seen = len(self.bloom)
+        queue_bytes = sys.getsizeof(self.heap) + sum([sys.getsizeof(entry) for entry in self.heap]) + \
+            sys.getsizeof(self.queued) + sum([sys.getsizeof(url) for url in self.queued])
+        return {
+            "seen": seen,
+            "queued": len(self.queued),
+            "in_flight": len(self.in_flight),
+            "bloom_filters": len(self.bloom.filters),
+            "bloom_bytes": self.bloom.nbytes,
+            "bloom_bytes_per_million": self.bloom.nbytes * 1000000 / max(1, seen),
+            "queue_bytes": queue_bytes,
+            "disk_bytes": os.path.getsize(self.path) if self.path is not None and os.path.exists(self.path) else None,
+            "lookups": self.lookups,
+            "false_positives": self.false_positives
+        }
+
+    def __len__(self):
+        return len(self.queued)
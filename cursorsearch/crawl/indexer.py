@@ -0,0 +1,109 @@
+class BulkIndexer(object):
+    def __init__(self, conn, batch_size=50) -> None:
+        """Buffers the postings and links of crawled pages and writes them in batches.
+
+        Word and URL ids are resolved from in-process dictionaries and new rows get their ids assigned
+        here, so indexing a page issues no per-token SQL. Everything buffered is written with `executemany`
+        in one transaction once `batch_size` pages have been added, or when `flush` is called.
+
+        Args:
+            conn (sqlite3.Connection): Connection to the index database.
+            batch_size (int, optional): Number of pages written per transaction. Defaults to 50.
+        """
+        super().__init__()
+        self.conn = conn
+        self.batch_size = batch_size
+        self.loaded = False
+        self.word_ids = {}
+        self.url_ids = {}
+        self.indexed_urls = set()
+        self.new_words = []
+        self.new_urls = []
+        self.locations = []
+        self.links = []
+        self.link_words = []
+        self.pages = 0
+        self.tokens = 0
+
+    def load(self):
+        self.word_ids = dict([(word, rowid) for (rowid, word) in self.conn.execute("SELECT rowid,word FROM wordlist")])
+        self.url_ids = dict([(url, rowid) for (rowid, url) in self.conn.execute("SELECT rowid,url FROM urllist")])
+        self.indexed_urls = set([urlid for (urlid,) in self.conn.execute("SELECT DISTINCT urlid FROM wordlocation")])
+        self.next_word_id = self.conn.execute("SELECT IFNULL(MAX(rowid),0) FROM wordlist").fetchone()[0] + 1
+        self.next_url_id = self.conn.execute("SELECT IFNULL(MAX(rowid),0) FROM urllist").fetchone()[0] + 1
+        self.next_link_id = self.conn.execute("SELECT IFNULL(MAX(rowid),0) FROM link").fetchone()[0] + 1
+        self.loaded = True
+
+    def get_word_id(self, word):
+        if not self.loaded:
+            self.load()
+        word_id = self.word_ids.get(word)
+        if word_id is None:
+            word_id = self.next_word_id
+            self.next_word_id += 1
+            self.word_ids[word] = word_id
+            self.new_words.append((word_id, word))
+        return word_id
+
+    def get_url_id(self, url):
+        if not self.loaded:
+            self.load()
+        url_id = self.url_ids.get(url)
+        if url_id is None:
+            url_id = self.next_url_id
+            self.next_url_id += 1
+            self.url_ids[url] = url_id
+            self.new_urls.append((url_id, url))
+        return url_id
+
+    def is_indexed(self, url):
+        if not self.loaded:
+            self.load()
+        return self.url_ids.get(url) in self.indexed_urls
+
+    def add_page(self, url, words, ignore_words):
+        url_id = self.get_url_id(url)
+        for i in range(len(words)):
+            word = words[i]
+            if word in ignore_words or not word.strip():
+                continue
+            self.locations.append((url_id, self.get_word_id(word), i))
+            self.tokens += 1
+        self.indexed_urls.add(url_id)
+
+    def add_link(self, url_from, url_to, words, ignore_words):
+        from_id = self.get_url_id(url_from)
+        to_id = self.get_url_id(url_to)
+        if from_id == to_id:
+            return
+        link_id = self.next_link_id
+        self.next_link_id += 1
+        self.links.append((link_id, from_id, to_id))
+        for word in words:
+            if word in ignore_words:
+                continue
+            self.link_words.append((link_id, self.get_word_id(word)))
+            self.tokens += 1
+
+    def end_page(self):
+        self.pages += 1
+        if self.pages >= self.batch_size:
+            self.flush()
+            return True
+        return False
+
+    def flush(self):
+        with self.conn:
+            self.conn.executemany("INSERT INTO wordlist(rowid,word) VALUES (?,?)", self.new_words)
+            self.conn.executemany("INSERT INTO urllist(rowid,url) VALUES (?,?)", self.new_urls)
+            self.conn.executemany("INSERT INTO wordlocation(urlid,wordid,location) VALUES (?,?,?)", self.locations)
+            self.conn.executemany("INSERT INTO link(rowid,fromid,toid) VALUES (?,?,?)", self.links)
+            self.conn.executemany("INSERT INTO linklog(fromid,toid,added) VALUES (?,?,1)",
+                                  [(from_id, to_id) for (_, from_id, to_id) in self.links])
+            self.conn.executemany("INSERT INTO linkwords(linkid,wordid) VALUES (?,?)", self.link_words)
+        self.new_words = []
+        self.new_urls = []
+        self.locations = []
+        self.links = []
+        self.link_words = []
+        self.pages = 0
@@ -0,0 +1,194 @@
+import numpy as np
+from cursorsearch.util import chunks
+
+
+class PageRank(object):
+    def __init__(self, damping=0.85, min_value=0.15, tolerance=1e-6, max_iterations=100) -> None:
+        """PageRank over the `link` table, computed with vectorized power iteration.
+
+        The link graph is read once into a compressed sparse row (CSR) adjacency structure: `indptr[i]` to
+        `indptr[i + 1]` slices `indices` to the targets of URL `url_ids[i]`. Repeated links between the same
+        two pages count once. The rank of pages without outbound links is spread evenly over all pages, so
+        no rank leaks out of the graph and the scores always add up to the number of URLs.
+
+        Args:
+            damping (float, optional): Damping factor. Defaults to 0.85.
+            min_value (float, optional): Rank every page gets regardless of its links. Defaults to 0.15.
+            tolerance (float, optional): Stop once no score changes by more than this. Defaults to 1e-6.
+            max_iterations (int, optional): Upper bound on the number of iterations. Defaults to 100.
+        """
+        super().__init__()
+        self.damping = damping
+        self.min_value = min_value
+        self.tolerance = tolerance
+        self.max_iterations = max_iterations
+        self.iterations = 0
+        self.pushes = 0
+        self.edges_touched = 0
+        self.url_ids = np.zeros(0, dtype=np.int64)
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.indices = np.zeros(0, dtype=np.int64)
+        self.scores = np.zeros(0)
+
+    def load(self, conn):
+        self.url_ids = np.fromiter((rowid for (rowid,) in conn.execute("SELECT rowid FROM urllist ORDER BY rowid")),
+                                   dtype=np.int64)
+        edges = np.fromiter((url_id for row in conn.execute("SELECT fromid,toid FROM link") for url_id in row),
+                            dtype=np.int64).reshape(-1, 2)
+        width = int(edges.max()) + 1 if len(edges) else 1
+        edges = np.unique(edges[:, 0] * width + edges[:, 1])
+        self.set_graph(self.url_ids, edges // width, edges % width)
+
+    def set_graph(self, url_ids, from_ids, to_ids):
+        self.url_ids = np.asarray(url_ids, dtype=np.int64)
+        n = len(self.url_ids)
+        sources, known_sources = self.positions(from_ids)
+        targets, known_targets = self.positions(to_ids)
+        known = known_sources & known_targets
+        sources = sources[known]
+        targets = targets[known]
+        order = np.lexsort((targets, sources))
+        self.indices = targets[order]
+        self.indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=n), out=self.indptr[1:])
+
+    def positions(self, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        positions = np.searchsorted(self.url_ids, ids)
+        found = positions < len(self.url_ids)
+        found[found] &= self.url_ids[positions[found]] == ids[found]
+        return positions, found
+
+    def out_degrees(self):
+        return np.diff(self.indptr)
+
+    def load_stored(self, conn):
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(pagerank)")]
+        if "outdegree" not in columns:
+            return None
+        stored = np.array(conn.execute("SELECT urlid,score,outdegree FROM pagerank").fetchall(),
+                          dtype=np.float64).reshape(-1, 3)
+        if not len(stored):
+            return None
+        return stored
+
+    def update(self, conn):
+        """Bring the stored scores up to date with the link rows logged in `linklog` since the last run.
+
+        The scores are split as `scores = c * x`, where `x` solves `x = 1 + damping * P'x` without any
+        redistribution of dangling rank and `c` is a scalar that puts the dangling rank back. Changing a link
+        only changes `x` near the link, so residuals are computed for new pages and for the targets of pages
+        whose links changed, then pushed along outbound links (Gauss-Southwell) until all are below
+        `tolerance * (1 - damping)`. `c` is then recomputed in closed form.
+
+        Returns:
+            bool: False if none of the stored scores belong to a page still in the graph and a full run is needed.
+        """
+        stored = self.load_stored(conn)
+        if stored is None:
+            return False
+        n = len(self.url_ids)
+        scores = np.zeros(n)
+        old_out_degrees = np.full(n, -1, dtype=np.int64)
+        positions, found = self.positions(stored[:, 0])
+        scores[positions[found]] = stored[found, 1]
+        old_out_degrees[positions[found]] = stored[found, 2]
+        known = old_out_degrees >= 0
+        if not known.any():
+            return False
+        initial = scores.copy()
+        old_scale = self.min_value + self.damping * scores[known & (old_out_degrees == 0)].sum() / known.sum()
+        x = scores / old_scale
+
+        changes = np.array(conn.execute("SELECT fromid,toid FROM linklog").fetchall(), dtype=np.int64).reshape(-1, 2)
+        sources, found = self.positions(changes[:, 0])
+        sources = np.unique(sources[found])
+        targets, found = self.positions(changes[:, 1])
+        affected = [np.flatnonzero(~known), targets[found]]
+        for source in sources:
+            affected.append(self.indices[self.indptr[source]:self.indptr[source + 1]])
+        affected = np.unique(np.concatenate(affected))
+        out_degrees = self.out_degrees()
+
+        shares = np.divide(x, out_degrees, out=np.zeros(n), where=out_degrees > 0)
+        inbound = np.zeros(n)
+        for chunk in chunks(self.url_ids[affected].tolist()):
+            edges = np.array(conn.execute(
+                f"SELECT DISTINCT fromid,toid FROM link WHERE toid IN ({','.join(['?'] * len(chunk))})", chunk
+            ).fetchall(), dtype=np.int64).reshape(-1, 2)
+            linkers, found = self.positions(edges[:, 0])
+            linked, _ = self.positions(edges[:, 1])
+            np.add.at(inbound, linked[found], shares[linkers[found]])
+            self.edges_touched += len(edges)
+        residuals = np.zeros(n)
+        residuals[affected] = 1.0 + self.damping * inbound[affected] - x[affected]
+
+        threshold = self.tolerance * (1 - self.damping) / old_scale
+        frontier = affected[np.abs(residuals[affected]) > threshold]
+        while len(frontier):
+            pushed = residuals[frontier]
+            x[frontier] += pushed
+            residuals[frontier] = 0.0
+            self.pushes += len(frontier)
+            counts = out_degrees[frontier]
+            total = counts.sum()
+            offsets = np.repeat(self.indptr[frontier] - np.cumsum(counts) + counts, counts) + np.arange(total)
+            targets = self.indices[offsets]
+            weights = np.repeat(self.damping * pushed / np.maximum(counts, 1), counts)
+            self.edges_touched += total
+            if total * 8 > n:
+                residuals += np.bincount(targets, weights=weights, minlength=n)
+                frontier = np.flatnonzero(np.abs(residuals) > threshold)
+            else:
+                np.add.at(residuals, targets, weights)
+                targets = np.unique(targets)
+                frontier = targets[np.abs(residuals[targets]) > threshold]
+
+        scale = self.min_value / (1 - self.damping * x[out_degrees == 0].sum() / n)
+        self.scores = scale * x
+        self.save(conn, (self.scores != initial) | (out_degrees != old_out_degrees))
+        return True
+
+    def report(self):
+        edges = len(self.indices)
+        sweeps = self.edges_touched / edges if edges else 0.0
+        return f"Updated PageRank incrementally: {self.pushes} pushes touching {self.edges_touched} edges, " \
+            f"the work of {sweeps:.1f} power iterations over {edges} edges"
+
+    def step(self, scores):
+        n = len(self.url_ids)
+        out_degrees = self.out_degrees()
+        dangling = out_degrees == 0
+        shares = np.divide(scores, out_degrees, out=np.zeros(n), where=~dangling)
+        inbound = np.bincount(self.indices, weights=np.repeat(shares, out_degrees), minlength=n)
+        return self.min_value + self.damping * (inbound + scores[dangling].sum() / n)
+
+    def run(self, initial=1.0):
+        n = len(self.url_ids)
+        scores = np.broadcast_to(np.asarray(initial, dtype=np.float64), (n,)).copy()
+        self.iterations = 0
+        while n and self.iterations < self.max_iterations:
+            updated = self.step(scores)
+            self.iterations += 1
+            delta = np.abs(updated - scores).max()
+            scores = updated
+            if delta < self.tolerance:
+                break
+        self.scores = scores
+        return scores
+
+    def save(self, conn, changed=None):
+        url_ids = self.url_ids
+        scores = self.scores
+        out_degrees = self.out_degrees()
+        if changed is not None:
+            url_ids = url_ids[changed]
+            scores = scores[changed]
+            out_degrees = out_degrees[changed]
+        with conn:
+            if changed is None:
+                conn.execute("DROP TABLE IF EXISTS pagerank")
+                conn.execute("CREATE TABLE pagerank(urlid PRIMARY KEY,score,outdegree)")
+            conn.executemany("INSERT OR REPLACE INTO pagerank(urlid,score,outdegree) VALUES (?,?,?)",
+                             zip(url_ids.tolist(), scores.tolist(), out_degrees.tolist()))
+            conn.execute("DELETE FROM linklog")
@@ -0,0 +1,64 @@
+import jieba
+from bs4 import BeautifulSoup
+from cursorsearch.util import seperate_words
+from cursorsearch.crawl.frontier import canonicalize_url
+
+
+def init_worker():
+    """Load jieba's dictionary once when a parser process starts instead of on its first call."""
+    jieba.initialize()
+
+
+def get_page_text(soup):
+    try:
+        try:
+            return soup.title.text + soup.body.article.text
+        except:
+            return soup.title.text + soup.body.text
+    except:
+        try:
+            return soup.body.article.text
+        except:
+            return soup.body.text
+
+
+def get_page_links(soup, base_url, ignore_urls=()):
+    links = []
+    for link in soup.body.findAll("a"):
+        try:
+            link["href"]
+        except:
+            continue
+        if link["href"].startswith("javascript") or link["href"].startswith("about:blank") or \
+                link["href"].startswith("mailto"):
+            continue
+        url = canonicalize_url((base_url if not link["href"].startswith(
+            "http") else "") + link["href"])
+        if f"{base_url}/redirect?" in url or not url.startswith(base_url) or url in ignore_urls:
+            continue
+        links.append((url, link.text))
+    return links
+
+
+def parse_page(content, base_url, ignore_urls=()):
+    soup = BeautifulSoup(content, "html.parser")
+    return get_page_text(soup), get_page_links(soup, base_url, ignore_urls)
+
+
+def tokenize_page(url, content, base_url, ignore_urls=()):
+    """Parse a downloaded page and tokenize its text and anchor texts.
+
+    This is a plain module-level function so it can be sent to a process pool; only the compact record
+    travels back to the writer.
+
+    Args:
+        url (str): URL the page was downloaded from.
+        content (bytes): Raw HTML of the page.
+        base_url (str): Only links under this URL are kept.
+        ignore_urls (list, optional): Links to leave out. Defaults to ().
+
+    Returns:
+        tuple: `(url, words, links)`, where `links` is a list of `(url, anchor words)` pairs.
+    """
+    text, links = parse_page(content, base_url, ignore_urls)
+    return (url, seperate_words(text), [(link_url, seperate_words(link_text)) for (link_url, link_text) in links])
@@ -1,21 +1,109 @@
-from math import tanh
+import numpy as np
 import sqlite3 as sqlite
-from cursorsearch.util import dtanh
+from contextlib import nullcontext
+from threading import RLock
+from time import perf_counter, time
+from cursorsearch.util import Generation, ReaderPool, chunks, dtanh
+
+def forward(w_i, w_o):
+    """Activations of the input, hidden and output layers for the given weights."""
+    a_i = np.ones(w_i.shape[0])
+    a_h = np.tanh(a_i @ w_i)
+    return a_i, a_h, np.tanh(a_h @ w_o)
 
 class Predictor(object):
-    def __init__(self, dbName) -> None:
+    def __init__(self, dbName, generation=None, conn=None) -> None:
         super().__init__()
-        self.conn = sqlite.connect(dbName)
+        self.conn = conn if conn is not None else sqlite.connect(dbName, check_same_thread=False)
+        self.lock = RLock()
         self.DEFAULT = -0.2
+        self.INDEXES = {
+            "hiddenkeyidx": "hiddennode(create_key)",
+            "hiddenusedidx": "hiddennode(lastused)",
+            "wordhiddenidx": "wordhidden(fromid,toid)",
+            "wordhiddentoidx": "wordhidden(toid)",
+            "hiddenurlidx": "hiddenurl(fromid,toid)",
+            "hiddenurltoidx": "hiddenurl(toid)"
+        }
+        self.generation = generation if generation is not None else Generation()
+        self.used = {}
+        self.inferences = 0
+        self.inference_time = 0.0
+        self.max_inference_time = 0.0
+        if conn is None:
+            try:
+                self.migrate()
+            except sqlite.OperationalError:
+                # Another process holds the lock because it is migrating the same database.
+                pass
     
     def __del__(self):
         self.conn.close()
     
+    def commit(self):
+        self.flush_usage()
+        self.conn.commit()
+        self.generation.bump()
+
     def make_tables(self):
-        self.conn.execute("CREATE TABLE hiddennode(create_key)")
+        self.conn.execute("CREATE TABLE hiddennode(create_key,lastused)")
         self.conn.execute("CREATE TABLE wordhidden(fromid,toid,strength)")
         self.conn.execute("CREATE TABLE hiddenurl(fromid,toid,strength)")
+        for (name, columns) in self.INDEXES.items():
+            self.conn.execute(f"CREATE INDEX {name} ON {columns}")
+        self.conn.commit()
+
+    def migrate(self):
+        """Add the `lastused` column and the indexes to a predictor database made by an older version.
+
+        Nodes that predate `lastused` count as used at the time of the migration.
+        """
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(hiddennode)")]
+        if not columns:
+            return
+        if "lastused" not in columns:
+            self.conn.execute("ALTER TABLE hiddennode ADD COLUMN lastused")
+            self.conn.execute("UPDATE hiddennode SET lastused=?", (time(),))
+        for (name, columns) in self.INDEXES.items():
+            self.conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {columns}")
         self.conn.commit()
+
+    def touch(self, hiddenIds, when=None):
+        """Remember that hidden nodes took part in a prediction, to be written as `lastused` on the next commit."""
+        when = when if when is not None else time()
+        for hidden_id in hiddenIds:
+            self.used[hidden_id] = max(when, self.used.get(hidden_id, 0))
+
+    def take_usage(self):
+        with self.lock:
+            (used, self.used) = (self.used, {})
+        return used
+
+    def add_usage(self, used):
+        """Merge `{hidden_id: when}` taken from another predictor, like a searcher's read-only one, into `used`."""
+        with self.lock:
+            for (hidden_id, when) in used.items():
+                self.used[hidden_id] = max(when, self.used.get(hidden_id, 0))
+
+    def take_inferences(self):
+        """Number, total and maximum seconds of the predictions made since the last call."""
+        with self.lock:
+            taken = (self.inferences, self.inference_time, self.max_inference_time)
+            (self.inferences, self.inference_time, self.max_inference_time) = (0, 0.0, 0.0)
+        return taken
+
+    def add_inferences(self, inferences, inference_time, max_inference_time):
+        """Count predictions made by another predictor, like a shard's, in `report`."""
+        with self.lock:
+            self.inferences += inferences
+            self.inference_time += inference_time
+            self.max_inference_time = max(self.max_inference_time, max_inference_time)
+
+    def flush_usage(self):
+        if not self.used or isinstance(self.conn, ReaderPool):
+            return
+        self.conn.executemany("UPDATE hiddennode SET lastused=? WHERE rowid=?",
+                              [(when, hidden_id) for (hidden_id, when) in self.take_usage().items()])
     
     def get_table(self, layer):
         return ("wordhidden" if layer == 0 else "hiddenurl")
@@ -36,98 +124,219 @@ class Predictor(object):
         else:
             self.conn.execute(f"UPDATE {table} SET strength={strength} WHERE rowid=?", (res[0],))
     
-    def generate_hidden_node(self, wordIds, urls):
+    def generate_hidden_node(self, wordIds, urls, commit=True):
         if len(wordIds) > 3: return None
         create_key = "_".join(sorted([str(wi) for wi in wordIds]))
         res = self.conn.execute("SELECT rowid FROM hiddennode WHERE create_key=?", (create_key,)).fetchone()
 
         if res is None:
-            cursor = self.conn.execute("INSERT INTO hiddennode (create_key) VALUES (?)", (create_key,))
+            cursor = self.conn.execute("INSERT INTO hiddennode (create_key,lastused) VALUES (?,?)",
+                                       (create_key, time()))
             hidden_id = cursor.lastrowid
-            for word_id in wordIds:
-                self.set_strength(word_id, hidden_id, 0, 1.0 / len(wordIds))
-            for url_id in urls:
-                self.set_strength(hidden_id, url_id, 1, 0.1)
-            self.conn.commit()
-    
+            self.conn.executemany("INSERT INTO wordhidden (fromid,toid,strength) VALUES (?,?,?)",
+                                  [(word_id, hidden_id, 1.0 / len(wordIds)) for word_id in dict.fromkeys(wordIds)])
+            self.conn.executemany("INSERT INTO hiddenurl (fromid,toid,strength) VALUES (?,?,?)",
+                                  [(hidden_id, url_id, 0.1) for url_id in dict.fromkeys(urls)])
+            if commit:
+                self.commit()
+
     def get_all_hidden_ids(self, wordIds, urlIds):
         l1 = {}
-        for wordId in wordIds:
-            cursor = self.conn.execute("SELECT toid FROM wordhidden WHERE fromid=?", (wordId,))
+        for chunk in chunks(dict.fromkeys(wordIds)):
+            cursor = self.conn.execute(
+                f"SELECT toid FROM wordhidden WHERE fromid IN ({','.join(['?'] * len(chunk))})", chunk)
             for row in cursor: l1[row[0]] = 1
-        for url_id in urlIds:
-            cursor = self.conn.execute("SELECT fromid FROM hiddenurl WHERE toid=?", (url_id,))
+        for chunk in chunks(dict.fromkeys(urlIds)):
+            cursor = self.conn.execute(
+                f"SELECT fromid FROM hiddenurl WHERE toid IN ({','.join(['?'] * len(chunk))})", chunk)
             for row in cursor: l1[row[0]] = 1
         return list(l1.keys())
-    
+
+    def get_weights(self, layer, fromIds, toIds):
+        """Read every stored weight between `fromIds` and `toIds` with one query per chunk of ids.
+
+        Returns the weight matrix, filled with the layer's default where nothing is stored, and the rowids of
+        the stored weights keyed by `(fromid, toid)` so they can be updated in place later.
+        """
+        table = self.get_table(layer)
+        weights = np.full((len(fromIds), len(toIds)), self.DEFAULT if layer == 0 else 0.0)
+        from_index = {}
+        for (i, from_id) in enumerate(fromIds):
+            from_index.setdefault(from_id, []).append(i)
+        to_index = {}
+        for (j, to_id) in enumerate(toIds):
+            to_index.setdefault(to_id, []).append(j)
+        rowids = {}
+        if not fromIds or not toIds:
+            return weights, rowids
+        column, ids = ("fromid", from_index) if len(from_index) <= len(to_index) else ("toid", to_index)
+        for chunk in chunks(ids):
+            cursor = self.conn.execute(
+                f"SELECT rowid,fromid,toid,strength FROM {table} WHERE {column} IN ({','.join(['?'] * len(chunk))})",
+                chunk)
+            for (rowid, from_id, to_id, strength) in cursor:
+                if from_id not in from_index or to_id not in to_index:
+                    continue
+                rowids[(from_id, to_id)] = rowid
+                for i in from_index[from_id]:
+                    for j in to_index[to_id]:
+                        weights[i, j] = strength
+        return weights, rowids
+
+    def get_network(self, wordIds, urlIds):
+        """Hidden node ids and both weight matrices of the network between `wordIds` and `urlIds`, with rowids."""
+        hidden_ids = self.get_all_hidden_ids(wordIds, urlIds)
+        (w_i, w_i_rowids) = self.get_weights(0, wordIds, hidden_ids)
+        (w_o, w_o_rowids) = self.get_weights(1, hidden_ids, urlIds)
+        return hidden_ids, w_i, w_i_rowids, w_o, w_o_rowids
+
     def setup_network(self, wordIds, urlIds):
         self.word_ids = wordIds
-        self.hidden_ids = self.get_all_hidden_ids(wordIds, urlIds)
         self.url_ids = urlIds
-
-        self.a_i = [1.0] * len(self.word_ids)
-        self.a_h = [1.0] * len(self.hidden_ids)
-        self.a_o = [1.0] * len(self.url_ids)
-
-        self.w_i = [[self.get_strength(word_id, hidden_id, 0) for hidden_id in self.hidden_ids] for word_id in self.word_ids]
-        self.w_o = [[self.get_strength(hidden_id, url_id, 1) for url_id in self.url_ids] for hidden_id in self.hidden_ids]
+        (self.hidden_ids, self.w_i, self.w_i_rowids, self.w_o, self.w_o_rowids) = self.get_network(wordIds, urlIds)
 
     def feed_forward(self):
-        for i in range(len(self.word_ids)):
-            self.a_i[i] = 1.0
-
-        for i in range(len(self.hidden_ids)):
-            sum = 0.0
-            for j in range(len(self.word_ids)):
-                sum += self.a_i[j] * self.w_i[j][i]
-            self.a_h[i] = tanh(sum)
-        
-        for i in range(len(self.url_ids)):
-            sum = 0.0
-            for j in range(len(self.hidden_ids)):
-                sum += self.a_h[j] * self.w_o[j][i]
-            self.a_o[i] = tanh(sum)
-
-        return self.a_o[:]
-    
+        (self.a_i, self.a_h, self.a_o) = forward(self.w_i, self.w_o)
+        return self.a_o.tolist()
+
     def get_result(self, wordIds, urlIds):
-        self.setup_network(wordIds, urlIds)
-        return self.feed_forward()
-    
+        """Predicted relevance of every URL in `urlIds` for the query `wordIds`.
+
+        The activations stay local, so searches only hold `lock` while reading the weights, which shares the
+        connection with training, and not at all when every thread reads through its own `ReaderPool` connection.
+        """
+        start = perf_counter()
+        with nullcontext() if isinstance(self.conn, ReaderPool) else self.lock:
+            (hidden_ids, w_i, _, w_o, _) = self.get_network(wordIds, urlIds)
+        (_, _, a_o) = forward(w_i, w_o)
+        elapsed = perf_counter() - start
+        with self.lock:
+            self.touch(hidden_ids)
+            self.inferences += 1
+            self.inference_time += elapsed
+            self.max_inference_time = max(self.max_inference_time, elapsed)
+        return a_o.tolist()
+
     def back_propagate(self, targets, N=0.5):
-        output_deltas = [0.0] * len(self.url_ids)
-        for i in range(len(self.url_ids)):
-            error = targets[i] - self.a_o[i]
-            output_deltas[i] = dtanh(self.a_o[i]) * error
-        hidden_deltas = [0.0] * len(self.hidden_ids)
-        for i in range(len(self.hidden_ids)):
-            error = float(0)
-            for j in range(len(self.url_ids)):
-                error = error + output_deltas[j] * self.w_o[i][j]
-            hidden_deltas[i] = dtanh(self.a_h[i]) * error
-        for i in range(len(self.hidden_ids)):
-            for j in range(len(self.url_ids)):
-                change = output_deltas[j] * self.a_h[i]
-                self.w_o[i][j] = self.w_o[i][j] + N * change
-        for i in range(len(self.word_ids)):
-            for j in range(len(self.hidden_ids)):
-                change = hidden_deltas[j] * self.a_i[i]
-                self.w_i[i][j] = self.w_i[i][j] + N * change
-    
-    def update_database(self):
-        for i in range(len(self.word_ids)):
-            for j in range(len(self.hidden_ids)):
-                self.set_strength(self.word_ids[i], self.hidden_ids[j], 0, self.w_i[i][j])
-        for i in range(len(self.hidden_ids)):
-            for j in range(len(self.url_ids)):
-                self.set_strength(self.hidden_ids[i], self.url_ids[j], 1, self.w_o[i][j])
-        self.conn.commit()
-    
-    def train_query(self, wordIds, urlIds, selectedUrl):
-        self.generate_hidden_node(wordIds, urlIds)
-        self.setup_network(wordIds, urlIds)
-        self.feed_forward()
-        targets = [0.0] * len(urlIds)
-        targets[urlIds.index(selectedUrl)] = 1.0
-        error = self.back_propagate(targets)
-        self.update_database()
+        output_deltas = dtanh(self.a_o) * (np.asarray(targets) - self.a_o)
+        hidden_deltas = dtanh(self.a_h) * (self.w_o @ output_deltas)
+        self.w_o = self.w_o + N * np.outer(self.a_h, output_deltas)
+        self.w_i = self.w_i + N * np.outer(self.a_i, hidden_deltas)
+
+    def write_weights(self, layer, fromIds, toIds, weights, rowids):
+        table = self.get_table(layer)
+        updates = {}
+        inserts = {}
+        for (i, from_id) in enumerate(fromIds):
+            for (j, to_id) in enumerate(toIds):
+                rowid = rowids.get((from_id, to_id))
+                if rowid is None:
+                    inserts[(from_id, to_id)] = float(weights[i, j])
+                else:
+                    updates[rowid] = float(weights[i, j])
+        self.conn.executemany(f"UPDATE {table} SET strength=? WHERE rowid=?",
+                              [(strength, rowid) for (rowid, strength) in updates.items()])
+        self.conn.executemany(f"INSERT INTO {table} (fromid,toid,strength) VALUES (?,?,?)",
+                              [(from_id, to_id, strength) for ((from_id, to_id), strength) in inserts.items()])
+
+    def update_database(self, commit=True):
+        self.write_weights(0, self.word_ids, self.hidden_ids, self.w_i, self.w_i_rowids)
+        self.write_weights(1, self.hidden_ids, self.url_ids, self.w_o, self.w_o_rowids)
+        if commit:
+            self.commit()
+
+    def train_query(self, wordIds, urlIds, selectedUrl, commit=True):
+        with self.lock:
+            self.generate_hidden_node(wordIds, urlIds, commit=commit)
+            self.setup_network(wordIds, urlIds)
+            self.touch(self.hidden_ids)
+            self.feed_forward()
+            targets = [0.0] * len(urlIds)
+            targets[urlIds.index(selectedUrl)] = 1.0
+            error = self.back_propagate(targets)
+            self.update_database(commit=commit)
+
+    def train_batch(self, clicks):
+        """Learn from several clicks, in order, inside one transaction.
+
+        Args:
+            clicks (list): `(wordIds, urlIds, selectedUrl)` tuples.
+        """
+        with self.lock:
+            try:
+                for (word_ids, url_ids, selected_url) in clicks:
+                    self.train_query(word_ids, url_ids, selected_url, commit=False)
+            except:
+                self.conn.rollback()
+                raise
+            self.commit()
+
+    def size(self):
+        tables = dict([(table, self.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0])
+                       for table in ["hiddennode", "wordhidden", "hiddenurl"]])
+        (page_count,) = self.conn.execute("PRAGMA page_count").fetchone()
+        (page_size,) = self.conn.execute("PRAGMA page_size").fetchone()
+        return dict(tables, bytes=page_count * page_size)
+
+    def report(self):
+        """Size of the predictor database and the time predictions took since this predictor was opened.
+
+        Returns:
+            dict: Row counts of `hiddennode`, `wordhidden` and `hiddenurl`, the database `bytes`, the
+                `indexes` present, and the number, mean and maximum milliseconds of `get_result` calls.
+        """
+        indexes = [name for (name,) in self.conn.execute("SELECT name FROM sqlite_master WHERE type='index'")]
+        return dict(self.size(), indexes=sorted([name for name in indexes if name in self.INDEXES]),
+                    inferences=self.inferences,
+                    mean_inference_ms=self.inference_time * 1000 / self.inferences if self.inferences else None,
+                    max_inference_ms=self.max_inference_time * 1000)
+
+    def compact(self, max_hidden_nodes=None, max_idle=None, tolerance=1e-5, vacuum=True):
+        """Shrink the network so predictions stay fast as clicks pile up.
+
+        Weights within `tolerance` of the value a missing weight reads as are deleted. Every one of them shifts
+        a prediction by at most `tolerance`, but a prediction sums over all hidden nodes, so keep it small.
+        Hidden nodes without any weight left are deleted, and so are, with
+        their weights, the nodes not used for `max_idle` seconds and the least recently used nodes beyond
+        `max_hidden_nodes`. Queries that relied on a dropped node simply start learning it again.
+
+        Args:
+            max_hidden_nodes (int, optional): Number of most recently used hidden nodes to keep. Defaults to None.
+            max_idle (int, optional): Seconds after which an unused hidden node is dropped. Defaults to None.
+            tolerance (float, optional): How close to the default a weight has to be to be dropped.
+                Defaults to 1e-5.
+            vacuum (bool, optional): Give the freed pages back to the file system. Defaults to True.
+
+        Returns:
+            dict: Rows removed from every table, and the `size` before and after.
+        """
+        with self.lock:
+            self.flush_usage()
+            before = self.size()
+            removed = {}
+            removed["wordhidden"] = self.conn.execute("DELETE FROM wordhidden WHERE abs(strength-?)<?",
+                                                      (self.DEFAULT, tolerance)).rowcount
+            removed["hiddenurl"] = self.conn.execute("DELETE FROM hiddenurl WHERE abs(strength)<?",
+                                                     (tolerance,)).rowcount
+            cold = set([hidden_id for (hidden_id,) in self.conn.execute(
+                "SELECT rowid FROM hiddennode WHERE rowid NOT IN (SELECT toid FROM wordhidden) "
+                "AND rowid NOT IN (SELECT fromid FROM hiddenurl)")])
+            if max_idle is not None:
+                cold.update([hidden_id for (hidden_id,) in self.conn.execute(
+                    "SELECT rowid FROM hiddennode WHERE lastused<?", (time() - max_idle,))])
+            if max_hidden_nodes is not None:
+                cold.update([hidden_id for (hidden_id,) in self.conn.execute(
+                    "SELECT rowid FROM hiddennode ORDER BY lastused DESC,rowid DESC LIMIT -1 OFFSET ?",
+                    (max_hidden_nodes,))])
+            for chunk in chunks(cold):
+                marks = ",".join(["?"] * len(chunk))
+                removed["wordhidden"] += self.conn.execute(f"DELETE FROM wordhidden WHERE toid IN ({marks})",
+                                                           chunk).rowcount
+                removed["hiddenurl"] += self.conn.execute(f"DELETE FROM hiddenurl WHERE fromid IN ({marks})",
+                                                          chunk).rowcount
+                self.conn.execute(f"DELETE FROM hiddennode WHERE rowid IN ({marks})", chunk)
+            removed["hiddennode"] = len(cold)
+            self.commit()
+            if vacuum:
+                self.conn.execute("VACUUM")
+            return {"removed": removed, "before": before, "after": self.size()}
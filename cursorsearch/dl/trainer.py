@@ -0,0 +1,123 @@
+from collections import deque
+from queue import Empty, Queue
+from threading import Lock, Thread
+from time import monotonic
+from cursorsearch.dl.predict import Predictor
+
+
+class TrainingQueue(object):
+    def __init__(self, dbName, batch_size=64, background=True, generation=None) -> None:
+        """Queue of user clicks that trains the predictor off the caller's thread.
+
+        `put` returns immediately. A worker thread with its own predictor connection takes whatever clicks are
+        waiting, up to `batch_size` at a time, and applies them in arrival order with one transaction per
+        batch. Hidden node usage queued with `put_usage` is written along with the next batch. With
+        `background=False` no thread is started and clicks are only applied when `drain` is
+        called, which keeps training deterministic in tests.
+
+        Args:
+            dbName (str): Path to the predictor database.
+            batch_size (int, optional): Maximum number of clicks applied per transaction. Defaults to 64.
+            background (bool, optional): Whether to train on a worker thread. Defaults to True.
+            generation (Generation, optional): Counter bumped after every applied batch. Defaults to None.
+        """
+        super().__init__()
+        self.db_name = dbName
+        self.batch_size = batch_size
+        self.generation = generation
+        self.queue = Queue()
+        self.lock = Lock()
+        self.enqueued_at = deque()
+        self.predictor = None
+        self.applied = 0
+        self.batches = 0
+        self.errors = 0
+        self.thread = None
+        if background:
+            self.thread = Thread(target=self.run, name="cursorsearch-trainer", daemon=True)
+            self.thread.start()
+
+    def put(self, wordIds, urlIds, selectedUrl):
+        with self.lock:
+            self.enqueued_at.append(monotonic())
+        self.queue.put((list(wordIds), list(urlIds), selectedUrl))
+
+    def put_usage(self, used):
+        """Queue `{hidden_id: when}` usage taken from a searcher's predictor, to be saved as `lastused`."""
+        self.queue.put(dict(used))
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def lag(self):
+        """Seconds since the oldest click that has not been applied yet was enqueued."""
+        with self.lock:
+            return monotonic() - self.enqueued_at[0] if self.enqueued_at else 0.0
+
+    def next_batch(self, block=True):
+        try:
+            batch = [self.queue.get(block=block)]
+        except Empty:
+            return []
+        while len(batch) < self.batch_size and batch[-1] is not None:
+            try:
+                batch.append(self.queue.get_nowait())
+            except Empty:
+                break
+        return batch
+
+    def apply(self, batch):
+        clicks = [item for item in batch if isinstance(item, tuple)]
+        usage = [item for item in batch if isinstance(item, dict)]
+        if self.predictor is None:
+            self.predictor = Predictor(self.db_name, generation=self.generation)
+        try:
+            for used in usage:
+                self.predictor.add_usage(used)
+            if clicks:
+                self.predictor.train_batch(clicks)
+                self.applied += len(clicks)
+                self.batches += 1
+            elif usage:
+                self.predictor.commit()
+        except Exception as e:
+            self.errors += 1
+            print(f"Could not apply {len(clicks)} clicks: {e}")
+        finally:
+            with self.lock:
+                for _ in clicks:
+                    self.enqueued_at.popleft()
+            for _ in batch:
+                self.queue.task_done()
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            self.apply(batch)
+            if batch[-1] is None:
+                break
+        self.predictor = None
+
+    def drain(self):
+        """Apply every waiting click on the calling thread. Only available without a worker thread."""
+        if self.thread is not None:
+            raise RuntimeError("drain() is only available with background=False, use flush() instead")
+        while True:
+            batch = self.next_batch(block=False)
+            if not batch:
+                break
+            self.apply(batch)
+
+    def flush(self):
+        """Block until every click enqueued so far has been applied."""
+        if self.thread is None:
+            self.drain()
+        else:
+            self.queue.join()
+
+    def close(self):
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        else:
+            self.drain()
@@ -0,0 +1,100 @@
+from itertools import chain
+from math import prod
+import numpy as np
+from cursorsearch.core.index import MatchRows
+
+
+def normalize_array(scores, smallIsBetter=False, extreme=None):
+    """`normalize_scores` for an array of scores, with the same results."""
+    vsmall = 1e-5
+    if smallIsBetter:
+        min_score = scores.min() if extreme is None else extreme
+        return float(min_score) / np.maximum(vsmall, scores)
+    max_score = scores.max() if extreme is None else extreme
+    if max_score == 0:
+        max_score = vsmall
+    return scores / float(max_score)
+
+
+def top_indices(url_ids, scores, limit=None):
+    """Indices of the `limit` best scores, best first and ties broken by the larger url id.
+
+    With a `limit` the best scores are picked with `np.partition` and only those are sorted, so this takes
+    linear time plus the sort of `limit` values instead of sorting every score.
+    """
+    if limit is None or limit >= len(scores):
+        return np.lexsort((url_ids, scores))[::-1]
+    if limit <= 0:
+        return np.zeros(0, dtype=np.int64)
+    kth = np.partition(scores, len(scores) - limit)[len(scores) - limit]
+    above = np.flatnonzero(scores > kth)
+    tied = np.flatnonzero(scores == kth)
+    tied = tied[np.argsort(url_ids[tied], kind="stable")[::-1][:limit - len(above)]]
+    chosen = np.concatenate([above, tied])
+    return chosen[np.lexsort((url_ids[chosen], scores[chosen]))[::-1]]
+
+
+def rank_columns(url_ids, scores, limit=None):
+    """`sorted(zip(scores, url_ids), reverse=True)[:limit]`, sorted by NumPy."""
+    order = top_indices(url_ids, scores, limit)
+    return list(zip(scores[order].tolist(), url_ids[order].tolist()))
+
+
+class Candidates(object):
+    def __init__(self, rows) -> None:
+        """Matched URLs of a query as one dense id array, so every candidate is scored at once.
+
+        Score columns are float arrays aligned with `url_ids`. The rows of the SQL self-join are grouped by URL
+        once: `locations` holds the word positions of every row and `row_urls` the index in `url_ids` of its
+        URL, which turns per-URL counts and minima into single NumPy reductions. `MatchRows` already hold the
+        position lists of every URL, they are kept in `position_lists`.
+
+        Args:
+            rows: Matched rows as returned by `Searcher.match_query`.
+        """
+        super().__init__()
+        self.rows = rows
+        self.position_lists = None
+        self.locations = None
+        self.row_urls = None
+        self.groups = None
+        if isinstance(rows, MatchRows):
+            self.url_ids = np.array(rows.url_ids, dtype=np.int64)
+            self.position_lists = list(rows.positions.values())
+        else:
+            width = len(rows[0]) if rows else 1
+            table = np.fromiter(chain.from_iterable(rows), np.int64, len(rows) * width).reshape(len(rows), width)
+            (self.url_ids, self.row_urls) = np.unique(table[:, 0], return_inverse=True)
+            self.row_urls = self.row_urls.reshape(-1)
+            self.locations = table[:, 1:]
+        self.sorter = np.argsort(self.url_ids, kind="stable")
+        self.url_list = self.url_ids.tolist()
+
+    def __len__(self):
+        return len(self.url_list)
+
+    def index_of(self, url_ids):
+        """Positions in `url_ids` of an array of candidate url ids."""
+        return self.sorter[np.searchsorted(self.url_ids, url_ids, sorter=self.sorter)]
+
+    def group_min(self, values, initial):
+        """Smallest of `values`, one per SQL row, for every URL, and at most `initial`."""
+        if self.groups is None:
+            order = np.argsort(self.row_urls, kind="stable")
+            starts = np.flatnonzero(np.diff(self.row_urls[order])) + 1
+            self.groups = (order, np.concatenate([[0], starts]))
+        (order, starts) = self.groups
+        return np.minimum(np.minimum.reduceat(values[order], starts).astype(np.float64), initial)
+
+    def counts(self):
+        if self.position_lists is not None:
+            return np.fromiter((prod([len(positions) for positions in position_lists])
+                                for position_lists in self.position_lists), np.float64, len(self))
+        return np.bincount(self.row_urls, minlength=len(self)).astype(np.float64)
+
+    def column(self, scores):
+        """Turn a `{url_id: score}` dict, as returned by custom scorers, into a column."""
+        return np.fromiter((scores[url_id] for url_id in self.url_list), np.float64, len(self))
+
+    def to_dict(self, column):
+        return dict(zip(self.url_list, column.tolist()))
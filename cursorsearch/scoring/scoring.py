@@ -1,4 +1,108 @@
-from cursorsearch.util import normalize_scores
+import numpy as np
+from cursorsearch.util import chunks
+from cursorsearch.core.index import MatchRows, min_chain_distance
+from cursorsearch.scoring.columns import Candidates, normalize_array
+
+
+def get_url_ids(rows):
+    if isinstance(rows, MatchRows):
+        return rows.url_ids
+    return list(set([row[0] for row in rows]))
+
+
+def fill_column(url_ids, cursor_for_chunk):
+    """Values of the `(url_id, value)` rows queried for every chunk of unique `url_ids`, 0 for ids without one."""
+    sorter = np.argsort(url_ids, kind="stable")
+    column = np.zeros(len(url_ids))
+    for chunk in chunks(url_ids.tolist()):
+        found = np.array(cursor_for_chunk(chunk).fetchall(), dtype=np.float64).reshape(-1, 2)
+        column[sorter[np.searchsorted(url_ids, found[:, 0].astype(np.int64), sorter=sorter)]] = found[:, 1]
+    return column
+
+
+def lookup_column(url_ids, mapping):
+    if hasattr(mapping, "get_many"):
+        return mapping.get_many(url_ids, 0)
+    return np.fromiter((mapping.get(url_id, 0) for url_id in url_ids.tolist()), np.float64, len(url_ids))
+
+
+def get_pagerank_column(url_ids, **kwargs):
+    index = kwargs.get("index")
+    if index is not None and index.pageranks is not None:
+        return lookup_column(url_ids, index.pageranks)
+    return fill_column(url_ids, lambda chunk: kwargs["conn"].execute(
+        f"SELECT urlid,score FROM pagerank WHERE urlid IN ({','.join(['?'] * len(chunk))})", chunk))
+
+
+def frequency_column(candidates, **kwargs):
+    return candidates.counts()
+
+
+def first_location_column(candidates, **kwargs):
+    if candidates.position_lists is not None:
+        return np.fromiter((min(1e6, sum([positions[0] for positions in position_lists]))
+                            for position_lists in candidates.position_lists), np.float64, len(candidates))
+    return candidates.group_min(candidates.locations.sum(axis=1), 1e6)
+
+
+def min_distance_column(candidates, **kwargs):
+    if candidates.position_lists is not None:
+        # Queries on one word or one OR group have a single position list per page, like one-word queries.
+        return np.fromiter((1.0 if len(position_lists) <= 1 else min(1e6, min_chain_distance(position_lists))
+                            for position_lists in candidates.position_lists), np.float64, len(candidates))
+    if candidates.locations.shape[1] <= 1:
+        return np.ones(len(candidates))
+    return candidates.group_min(np.abs(np.diff(candidates.locations, axis=1)).sum(axis=1), 1e6)
+
+
+def inbound_count_column(candidates, **kwargs):
+    index = kwargs.get("index")
+    if index is not None and index.inbound_counts is not None:
+        return lookup_column(candidates.url_ids, index.inbound_counts)
+    return fill_column(candidates.url_ids, lambda chunk: kwargs["conn"].execute(
+        f"SELECT toid,COUNT(*) FROM link WHERE toid IN ({','.join(['?'] * len(chunk))}) GROUP BY toid", chunk))
+
+
+def pagerank_column(candidates, **kwargs):
+    return get_pagerank_column(candidates.url_ids, **kwargs)
+
+
+def link_text_column(candidates, **kwargs):
+    column = np.zeros(len(candidates))
+    word_counts = {}
+    for word_id in kwargs["wordIds"]:
+        word_counts[word_id] = word_counts.get(word_id, 0) + 1
+    index = kwargs.get("index")
+    if index is not None and hasattr(index, "get_links"):
+        links = index.get_links(list(word_counts))
+    else:
+        links = []
+        for chunk in chunks(word_counts):
+            cursor = kwargs["conn"].execute(
+                "SELECT linkwords.wordid,link.fromid,link.toid FROM linkwords CROSS JOIN link "
+                f"WHERE linkwords.wordid IN ({','.join(['?'] * len(chunk))}) AND linkwords.linkid=link.rowid", chunk)
+            links += cursor.fetchall()
+    if not len(links):
+        return column
+    links = np.array(links, dtype=np.int64)
+    links = links[np.isin(links[:, 2], candidates.url_ids)]
+    (from_ids, from_index) = np.unique(links[:, 1], return_inverse=True)
+    word_ids = np.array(sorted(word_counts), dtype=np.int64)
+    counts = np.array([word_counts[word_id] for word_id in word_ids.tolist()], dtype=np.int64)
+    scores = counts[np.searchsorted(word_ids, links[:, 0])] * \
+        get_pagerank_column(from_ids, **kwargs)[from_index.reshape(-1)]
+    np.add.at(column, candidates.index_of(links[:, 2]), scores)
+    return column
+
+
+def predictor_column(candidates, **kwargs):
+    return np.asarray(kwargs["predictor"].get_result(kwargs["wordIds"], candidates.url_list), dtype=np.float64)
+
+
+def score_rows(column_func, rows, smallIsBetter=False, **kwargs):
+    """Normalized scores of a column function over the matched `rows`, as the `{url_id: score}` dict scorers return."""
+    candidates = Candidates(rows)
+    return candidates.to_dict(normalize_array(column_func(candidates, **kwargs), smallIsBetter))
 
 
 class Scoring(object):
@@ -7,64 +111,89 @@ class Scoring(object):
 
     @staticmethod
     def frequency_score(rows, **kwargs):
-        counts = dict([(row[0], 0) for row in rows])
-        for row in rows:
-            counts[row[0]] += 1
-        return normalize_scores(counts)
+        return score_rows(frequency_column, rows, **kwargs)
 
     @staticmethod
     def location_score(rows, **kwargs):
-        locations = dict([(row[0], 1e6) for row in rows])
-        for row in rows:
-            loc = sum(row[1:])
-            if loc < locations[row[0]]:
-                locations[row[0]] = loc
-        return normalize_scores(locations, smallIsBetter=True)
+        return score_rows(first_location_column, rows, smallIsBetter=True, **kwargs)
 
     @staticmethod
     def distance_score(rows, **kwargs):
-        if len(rows[0]) <= 2:
-            return dict([(row[0], 1.0) for row in rows])
-        min_distance = dict([(row[0], 1e6) for row in rows])
-        for row in rows:
-            dist = sum([abs(row[i] - row[i - 1]) for i in range(2, len(row))])
-            if dist < min_distance[row[0]]:
-                min_distance[row[0]] = dist
-        return normalize_scores(min_distance, smallIsBetter=True)
+        return score_rows(min_distance_column, rows, smallIsBetter=True, **kwargs)
 
     @staticmethod
     def inbound_link_score(rows, **kwargs):
-        unique_urls = set([row[0] for row in rows])
-        inbound_count = dict([(u, kwargs["conn"].execute(
-            "SELECT COUNT(*) FROM link WHERE toid=?", (u,)).fetchone()[0]) for u in unique_urls])
-        return normalize_scores(inbound_count)
+        return score_rows(inbound_count_column, rows, **kwargs)
 
     @staticmethod
     def pagerank_score(rows, **kwargs):
-        pageranks = dict([(row[0], kwargs["conn"].execute(
-            "SELECT score FROM pagerank WHERE urlid=?", (row[0],)).fetchone()[0]) for row in rows])
-        max_rank = max(pageranks.values())
-        return dict([(u, float(l) / max_rank) for (u, l) in pageranks.items()])
+        return score_rows(pagerank_column, rows, **kwargs)
 
     @staticmethod
     def link_text_score(rows, **kwargs):
-        link_scores = dict([(row[0], 0) for row in rows])
-        for word_id in kwargs["wordIds"]:
-            cursor = kwargs["conn"].execute(
-                "SELECT link.fromid,link.toid FROM linkwords,link WHERE wordid=? AND linkwords.linkid=link.rowid", (word_id,))
-            for (from_id, to_id) in cursor:
-                if to_id in link_scores:
-                    pr = kwargs["conn"].execute(
-                        "SELECT score FROM pagerank WHERE urlid=?", (from_id,)).fetchone()[0]
-                    link_scores[to_id] += pr
-        max_score = max(link_scores.values())
-        return dict([(u, float(l) / max_score) for (u, l) in link_scores.items()])
+        return score_rows(link_text_column, rows, **kwargs)
 
     @staticmethod
     def predictor_score(rows, **kwargs):
-        url_ids = [url_id for url_id in set([row[0] for row in rows])]
-        predictor_results = kwargs["predictor"].get_result(
-            kwargs["wordIds"], url_ids)
-        scores = dict([(url_ids[i], predictor_results[i])
-                      for i in range(len(url_ids))])
-        return normalize_scores(scores)
+        return score_rows(predictor_column, rows, **kwargs)
+
+
+EXPENSIVE_SCORERS = [Scoring.link_text_score, Scoring.predictor_score]
+
+
+def is_expensive(func):
+    """Whether a scorer should only run on the candidate pool of a top-k query.
+
+    Custom scorers can opt in by setting `func.expensive = True`.
+    """
+    return getattr(func, "expensive", func in EXPENSIVE_SCORERS)
+
+
+COLUMN_SCORERS = {
+    Scoring.frequency_score: (frequency_column, False),
+    Scoring.location_score: (first_location_column, True),
+    Scoring.distance_score: (min_distance_column, True),
+    Scoring.inbound_link_score: (inbound_count_column, False),
+    Scoring.pagerank_score: (pagerank_column, False),
+    Scoring.link_text_score: (link_text_column, False),
+    Scoring.predictor_score: (predictor_column, False)
+}
+
+
+def get_column_scorer(func):
+    """`(column_func, smallIsBetter)` computing the raw scores of `func` as an array over `Candidates`, or None.
+
+    Custom scorers can provide one by setting `func.column`, and `func.small_is_better` if smaller raw scores
+    are better.
+    """
+    if hasattr(func, "column"):
+        return (func.column, getattr(func, "small_is_better", False))
+    return COLUMN_SCORERS.get(func)
+
+
+def get_raw_column(func):
+    """`(column_func, smallIsBetter)` giving the scores of `func` before normalization, or None if unknown.
+
+    Scores normalized over one shard's matches differ from those normalized over all matches, so sharded
+    searches compute raw scores and normalize them with the extremes of every shard. Besides the scorers of
+    `get_column_scorer`, custom scorers can take part by setting `func.raw` to a function returning their
+    unnormalized `{url_id: score}` dict, and `func.small_is_better` if smaller raw scores are better.
+    """
+    column = get_column_scorer(func)
+    if column is not None or not hasattr(func, "raw"):
+        return column
+    return (lambda candidates, **kwargs: candidates.column(func.raw(candidates.rows, **kwargs)),
+            getattr(func, "small_is_better", False))
+
+
+def score_column(func, candidates, **kwargs):
+    """Normalized scores of a scorer as an array aligned with `candidates.url_ids`.
+
+    Scorers with a column variant (see `get_column_scorer`) are computed and normalized as arrays. Any other
+    scorer is called with the matched rows like before, and the dict it returns is turned into a column.
+    """
+    column = get_column_scorer(func)
+    if column is None:
+        return candidates.column(func(candidates.rows, **kwargs))
+    (column_func, small_is_better) = column
+    return normalize_array(column_func(candidates, **kwargs), small_is_better)
@@ -0,0 +1,279 @@
+"""Serve a search index over HTTP with JSON responses.
+
+    python -m cursorsearch.serve search_index.db --port 8080
+
+`GET /search?q=...&limit=10&offset=0` searches, `POST /click` with a body like
+`{"query_words": [1, 2], "url_ids": [5, 7, 9], "url_id": 7}` learns from a click, `GET /stats` returns the
+service counters and `GET /health` answers as long as the service is up.
+"""
+import argparse
+import asyncio
+import json
+import signal
+from http import HTTPStatus
+from time import perf_counter
+from urllib.parse import parse_qs, urlsplit
+from cursorsearch import CursorSearch
+
+
+class HttpError(Exception):
+    def __init__(self, status, message, headers=None) -> None:
+        super().__init__(message)
+        self.status = status
+        self.headers = headers if headers is not None else {}
+
+
+class SearchService(object):
+    def __init__(self, engine, executor=None, max_pending=64, max_training_queue=10000, timeout=10.0,
+                 max_limit=100) -> None:
+        """Answers search and click requests for a `CursorSearch` from an asyncio event loop.
+
+        Searches run on `executor`, so the event loop never waits for SQLite or the word segmentation. A search
+        that arrives while an identical one (same query, limit and offset) is being computed waits for that
+        computation instead of starting its own, so a burst of requests for a trending query costs one search.
+
+        Load is shed instead of queued: once `max_pending` distinct searches are queued or running, further ones
+        are rejected at once with `503 Service Unavailable` and a `Retry-After` header, and so are clicks while
+        more than `max_training_queue` wait to be trained on. Requests still waiting for their results after
+        `timeout` seconds get `504 Gateway Timeout`. Latency therefore stays bounded under overload, and
+        clients see fast errors they can retry.
+
+        Args:
+            engine (CursorSearch): Engine to serve. It has to be created with `concurrent=True`, so it can
+                search from several threads, and `background_training=True` keeps clicks off those threads.
+            executor (Executor, optional): Where searches run. Defaults to None, which uses `engine.executor`.
+            max_pending (int, optional): Distinct searches queued or running at once. Defaults to 64.
+            max_training_queue (int, optional): Clicks waiting to be trained on. Defaults to 10000.
+            timeout (float, optional): Seconds a request waits for its results. Defaults to 10.0.
+            max_limit (int, optional): Largest number of results per request. Defaults to 100.
+        """
+        super().__init__()
+        if executor is None and engine.executor is None:
+            raise ValueError("Serve a CursorSearch created with concurrent=True, or pass an executor")
+        self.engine = engine
+        self.executor = executor if executor is not None else engine.executor
+        self.max_pending = max_pending
+        self.max_training_queue = max_training_queue
+        self.timeout = timeout
+        self.max_limit = max_limit
+        self.MAX_BODY = 1 << 20
+        self.KEEP_ALIVE = 5.0
+        self.in_flight = {}
+        self.counters = dict([(name, 0) for name in
+                              ["requests", "searches", "coalesced", "rejected", "timeouts", "errors", "clicks"]])
+        self.started = perf_counter()
+        self.server = None
+
+    def run_search(self, query, limit, offset):
+        start = perf_counter()
+        result = self.engine.search(query, limit=limit, offset=offset)
+        names = self.engine.searcher.get_url_names([row["url_id"] for row in result["results"]])
+        return {
+            "query": query,
+            "query_words": result["query_words"],
+            "results": [{"url_id": row["url_id"], "url": names.get(row["url_id"]), "score": row["score"]}
+                        for row in result["results"]],
+            "took_ms": (perf_counter() - start) * 1000
+        }
+
+    def forget(self, key, future):
+        if self.in_flight.get(key) is future:
+            del self.in_flight[key]
+        if not future.cancelled():
+            # Mark the exception as retrieved in case every waiting request timed out.
+            future.exception()
+
+    async def search(self, query, limit, offset):
+        key = (query, limit, offset)
+        future = self.in_flight.get(key)
+        if future is not None:
+            self.counters["coalesced"] += 1
+        elif len(self.in_flight) >= self.max_pending:
+            self.counters["rejected"] += 1
+            raise HttpError(HTTPStatus.SERVICE_UNAVAILABLE, "Too many searches in progress, try again later",
+                            {"Retry-After": "1"})
+        else:
+            future = asyncio.get_running_loop().run_in_executor(self.executor, self.run_search, query, limit, offset)
+            future.add_done_callback(lambda done: self.forget(key, done))
+            self.in_flight[key] = future
+            self.counters["searches"] += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            self.counters["timeouts"] += 1
+            raise HttpError(HTTPStatus.GATEWAY_TIMEOUT, "The search took too long")
+
+    async def click(self, body):
+        try:
+            click = json.loads(body)
+            word_ids = [int(word_id) for word_id in click["query_words"]]
+            url_ids = [int(url_id) for url_id in click["url_ids"]]
+            selected_url_id = int(click["url_id"])
+        except (ValueError, KeyError, TypeError):
+            raise HttpError(HTTPStatus.BAD_REQUEST,
+                            'Expected a body like {"query_words": [...], "url_ids": [...], "url_id": ...}')
+        if selected_url_id not in url_ids:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "url_id has to be one of url_ids")
+        trainer = self.engine.trainer
+        if trainer is not None and trainer.depth() >= self.max_training_queue:
+            self.counters["rejected"] += 1
+            raise HttpError(HTTPStatus.SERVICE_UNAVAILABLE, "Too many clicks waiting, try again later",
+                            {"Retry-After": "1"})
+        self.counters["clicks"] += 1
+        if trainer is not None:
+            self.engine.train(word_ids, url_ids, selected_url_id)
+        else:
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.engine.train, word_ids, url_ids,
+                                                             selected_url_id)
+
+    def stats(self):
+        stats = dict(self.counters, pending=len(self.in_flight), max_pending=self.max_pending,
+                     uptime=perf_counter() - self.started)
+        if self.engine.trainer is not None:
+            stats["training_queue"] = self.engine.trainer.depth()
+        return stats
+
+    def get_int(self, params, name, default, smallest, largest=None):
+        try:
+            value = int(params[name][0]) if name in params else default
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST, f"{name} has to be an integer")
+        if value < smallest:
+            raise HttpError(HTTPStatus.BAD_REQUEST, f"{name} has to be at least {smallest}")
+        if largest is not None and value > largest:
+            raise HttpError(HTTPStatus.BAD_REQUEST, f"{name} has to be at most {largest}")
+        return value
+
+    async def dispatch(self, method, target, body):
+        self.counters["requests"] += 1
+        url = urlsplit(target)
+        allowed = {"/search": "GET", "/click": "POST", "/stats": "GET", "/health": "GET"}
+        try:
+            if url.path not in allowed:
+                raise HttpError(HTTPStatus.NOT_FOUND, f"No such endpoint {url.path}")
+            if method != allowed[url.path]:
+                raise HttpError(HTTPStatus.METHOD_NOT_ALLOWED, f"Use {allowed[url.path]} for {url.path}",
+                                {"Allow": allowed[url.path]})
+            if url.path == "/search":
+                params = parse_qs(url.query)
+                query = params.get("q", [""])[0].strip()
+                if not query:
+                    raise HttpError(HTTPStatus.BAD_REQUEST, "Missing query parameter q")
+                limit = self.get_int(params, "limit", 10, 1, self.max_limit)
+                offset = self.get_int(params, "offset", 0, 0)
+                return HTTPStatus.OK, await self.search(query, limit, offset), {}
+            if url.path == "/click":
+                await self.click(body)
+                return HTTPStatus.ACCEPTED, {"status": "accepted"}, {}
+            if url.path == "/stats":
+                return HTTPStatus.OK, self.stats(), {}
+            return HTTPStatus.OK, {"status": "ok"}, {}
+        except HttpError as error:
+            return error.status, {"error": str(error)}, error.headers
+        except Exception as error:
+            self.counters["errors"] += 1
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {"error": f"{type(error).__name__}: {error}"}, {}
+
+    def write_response(self, writer, status, payload, headers, keep_alive):
+        status = HTTPStatus(status)
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        lines = [f"HTTP/1.1 {status.value} {status.phrase}",
+                 "Content-Type: application/json; charset=utf-8",
+                 f"Content-Length: {len(data)}",
+                 f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        lines += [f"{name}: {value}" for (name, value) in headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + data)
+
+    async def handle_connection(self, reader, writer):
+        """Answer the requests of one HTTP/1.1 connection in turn, until the client closes it or goes idle."""
+        try:
+            while True:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), self.KEEP_ALIVE)
+                except asyncio.TimeoutError:
+                    break
+                if not request_line:
+                    break
+                parts = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    (name, _, value) = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+                    self.write_response(writer, HTTPStatus.BAD_REQUEST, {"error": "Malformed request line"}, {},
+                                        False)
+                    break
+                (method, target, version) = parts
+                try:
+                    length = int(headers.get("content-length", 0))
+                except ValueError:
+                    length = -1
+                if length < 0 or length > self.MAX_BODY:
+                    self.write_response(writer, HTTPStatus.REQUEST_ENTITY_TOO_LARGE if length > 0 else
+                                        HTTPStatus.BAD_REQUEST, {"error": "Bad Content-Length"}, {}, False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+                (status, payload, extra_headers) = await self.dispatch(method, target, body)
+                self.write_response(writer, status, payload, extra_headers, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8080, backlog=1024):
+        """Serve until SIGINT or SIGTERM."""
+        self.server = await asyncio.start_server(self.handle_connection, host, port, backlog=backlog)
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, self.server.close)
+            except (NotImplementedError, RuntimeError):
+                pass
+        for sock in self.server.sockets:
+            print(f"Serving on http://{sock.getsockname()[0]}:{sock.getsockname()[1]}", flush=True)
+        await self.server.wait_closed()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("database", nargs="?", default="search_index.db")
+    parser.add_argument("--predictor", default="predictor.db", help="predictor database")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--threads", type=int, default=4, help="threads searches run on")
+    parser.add_argument("--max-pending", type=int, default=64, help="distinct searches queued or running")
+    parser.add_argument("--max-training-queue", type=int, default=10000, help="clicks waiting to be trained on")
+    parser.add_argument("--timeout", type=float, default=10.0, help="seconds a request waits for its results")
+    parser.add_argument("--cache-size", type=int, default=1024, help="search results cached, 0 disables")
+    parser.add_argument("--use-index", action="store_true", help="keep the postings of every word in memory")
+    layout = parser.add_mutually_exclusive_group()
+    layout.add_argument("--segment", default=None, help="search the segment in this directory")
+    layout.add_argument("--shards", default=None, help="search the shards in this directory")
+    args = parser.parse_args()
+
+    engine = CursorSearch(args.database, args.predictor, use_index=args.use_index, background_training=True,
+                          cache_size=args.cache_size, segment_path=args.segment, concurrent=True,
+                          search_threads=args.threads, quiet=True, shard_path=args.shards)
+    engine.warm_up()
+    service = SearchService(engine, max_pending=args.max_pending, max_training_queue=args.max_training_queue,
+                            timeout=args.timeout)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        engine.executor.shutdown()
+        engine.save_usage()
+        engine.trainer.close()
+
+
+if __name__ == "__main__":
+    main()
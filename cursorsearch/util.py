@@ -1,4 +1,9 @@
 import jieba
+import os
+import shutil
+import sqlite3 as sqlite
+from threading import Lock, local
+from urllib.request import pathname2url
 
 def seperate_words(text: str) -> list:
     results = jieba.lcut_for_search(text)
@@ -7,13 +12,136 @@ def seperate_words(text: str) -> list:
 def dtanh(y):
     return 1.0 - y * y
 
-def normalize_scores(scores: dict, smallIsBetter=False):
+def normalize_scores(scores: dict, smallIsBetter=False, extreme=None):
     vsmall = 1e-5
     if smallIsBetter:
-        min_score = min(scores.values())
+        min_score = min(scores.values()) if extreme is None else extreme
         return dict([(u, float(min_score) / max(vsmall, l)) for (u, l) in scores.items()])
     else:
-        max_score = max(scores.values())
+        max_score = max(scores.values()) if extreme is None else extreme
         if max_score == 0:
             max_score = vsmall
         return dict([(u, float(c) / max_score) for (u, c) in scores.items()])
+
+def chunks(values, size=500):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+class Generation(object):
+    def __init__(self) -> None:
+        """Counter that is bumped every time the index or the predictor changes.
+
+        `Crawler`, `Predictor` and `Searcher` share one instance, so cached query results can be tagged with the
+        generation they were computed in and dropped once it moves on.
+        """
+        super().__init__()
+        self.value = 0
+        self.lock = Lock()
+
+    def bump(self):
+        with self.lock:
+            self.value += 1
+
+def get_versions(path):
+    """Numbers of the `path.<n>` version directories next to `path`."""
+    (directory, name) = os.path.split(os.path.abspath(path.rstrip(os.sep)))
+    prefix = name + "."
+    return sorted([int(entry[len(prefix):]) for entry in os.listdir(directory)
+                   if entry.startswith(prefix) and entry[len(prefix):].isdigit()])
+
+def next_version(path):
+    """Unused directory next to `path` to write a new version of it to before `publish_version`."""
+    versions = get_versions(path)
+    return f"{path.rstrip(os.sep)}.{versions[-1] + 1 if versions else 1}"
+
+def publish_version(path, version):
+    """Make `path` a symbolic link to the directory `version` from `next_version`.
+
+    The link is replaced with `os.replace`, so readers opening `path` see either the old or the new version and
+    never a missing or half written one. The previous version is kept for readers that resolved the link just
+    before the swap, older ones are deleted. A plain directory left at `path` by an older release is moved aside
+    first, the only moment `path` does not exist.
+    """
+    path = path.rstrip(os.sep)
+    previous = os.path.realpath(path) if os.path.islink(path) else None
+    if os.path.isdir(path) and not os.path.islink(path):
+        previous = next_version(path)
+        os.rename(path, previous)
+    link = path + ".link"
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(os.path.basename(version), link)
+    os.replace(link, path)
+    keep = set([os.path.realpath(version), previous])
+    for number in get_versions(path):
+        old = f"{path}.{number}"
+        if os.path.realpath(old) not in keep:
+            shutil.rmtree(old, ignore_errors=True)
+
+def enable_wal(path):
+    """Switch the database at `path` to write-ahead logging, so readers are never blocked by a writer."""
+    conn = sqlite.connect(path)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+    finally:
+        conn.close()
+
+def get_data_version(conn):
+    if isinstance(conn, ReaderPool):
+        return conn.data_version()
+    return conn.execute("PRAGMA data_version").fetchone()[0]
+
+class ReaderPool(object):
+    def __init__(self, path, timeout=5.0) -> None:
+        """Read-only connections to one database, one per thread.
+
+        Each thread gets its own connection, opened read-only on first use, so any number of threads can
+        query at once. `execute` runs on the calling thread's connection, which lets the pool stand in for a
+        `sqlite3.Connection` wherever the code only reads. Put the database in WAL mode (see `enable_wal`)
+        so the readers don't wait for a writer.
+
+        Args:
+            path (str): Path to the database.
+            timeout (float, optional): Seconds to wait for a lock before failing. Defaults to 5.0.
+        """
+        super().__init__()
+        self.path = path
+        self.timeout = timeout
+        self.local = local()
+        self.lock = Lock()
+        self.connections = []
+        self.watcher = None
+
+    def connect(self):
+        uri = f"file:{pathname2url(os.path.abspath(self.path))}?mode=ro"
+        return sqlite.connect(uri, uri=True, timeout=self.timeout, check_same_thread=False)
+
+    def get(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = self.connect()
+            with self.lock:
+                self.connections.append(conn)
+        return conn
+
+    def execute(self, sql, parameters=()):
+        return self.get().execute(sql, parameters)
+
+    def data_version(self):
+        # data_version is only comparable between calls on the same connection.
+        with self.lock:
+            if self.watcher is None:
+                self.watcher = self.connect()
+            return self.watcher.execute("PRAGMA data_version").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            for conn in self.connections + ([self.watcher] if self.watcher is not None else []):
+                conn.close()
+            self.connections = []
+            self.watcher = None
+
+    def __len__(self):
+        return len(self.connections)
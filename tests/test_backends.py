@@ -0,0 +1,58 @@
+import os
+import tempfile
+import unittest
+from benchmarks.corpus import build_database, make_pages, make_vocabulary
+from cursorsearch.core.engine import Searcher
+from cursorsearch.core.segment import write_segment
+from cursorsearch.core.shard import ShardedSearcher, write_shards
+
+
+class BackendTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        path = os.path.join(cls.directory.name, "index.db")
+        crawler = build_database(path, make_pages(400, words_per_page=100))
+        write_segment(crawler.conn, os.path.join(cls.directory.name, "segment"))
+        write_shards(crawler.conn, os.path.join(cls.directory.name, "shards"), 3)
+        del crawler
+        predictor = os.path.join(cls.directory.name, "predictor.db")
+        cls.sql = Searcher(path, predictDbName=predictor, quiet=True)
+        vocabulary = make_vocabulary(5000)
+        cls.queries = vocabulary[20:40] + [f"{vocabulary[i]} {vocabulary[i + 1]}" for i in range(40, 60, 2)] + \
+            [f'"{vocabulary[0]} {vocabulary[1]}"', f"{vocabulary[2]} NEAR/5 {vocabulary[3]}",
+             f"{vocabulary[30]} OR {vocabulary[31]}", f"{vocabulary[4]} -{vocabulary[5]}"]
+        for query in cls.queries[::3]:
+            results = cls.sql.query(query)
+            url_ids = [result["url_id"] for result in results["results"][:20]]
+            if url_ids:
+                cls.sql.predictor.train_query(results["query_words"], url_ids, url_ids[-1])
+        cls.backends = {
+            "index": Searcher(path, predictDbName=predictor, use_index=True, quiet=True),
+            "segment": Searcher(path, predictDbName=predictor, segment=os.path.join(cls.directory.name, "segment"),
+                                quiet=True),
+            "shards": ShardedSearcher(os.path.join(cls.directory.name, "shards"), predictDbName=predictor, quiet=True)
+        }
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.backends["shards"].close()
+        del cls.backends
+        del cls.sql
+        cls.directory.cleanup()
+
+    def test_rankings_match_sql(self):
+        for query in self.queries:
+            expected = self.sql.query(query)["results"]
+            self.assertTrue(expected, query)
+            for (name, searcher) in self.backends.items():
+                results = searcher.query(query)["results"]
+                self.assertEqual([result["url_id"] for result in results],
+                                 [result["url_id"] for result in expected], f"{name}: {query}")
+                for (result, expected_result) in zip(results, expected):
+                    self.assertAlmostEqual(result["score"], expected_result["score"], places=9,
+                                           msg=f"{name}: {query}")
+
+
+if __name__ == "__main__":
+    unittest.main()
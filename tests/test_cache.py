@@ -0,0 +1,55 @@
+import os
+import sqlite3 as sqlite
+import tempfile
+import unittest
+from benchmarks.corpus import build_database, make_pages, make_vocabulary
+from cursorsearch.core.engine import Searcher
+
+
+class ResultCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "index.db")
+        self.predictor_path = os.path.join(self.directory.name, "predictor.db")
+        build_database(self.path, make_pages(200, words_per_page=50))
+        self.searcher = Searcher(self.path, predictDbName=self.predictor_path, cache_size=100, quiet=True)
+        self.word = make_vocabulary(5000)[30]
+
+    def tearDown(self):
+        del self.searcher
+        self.directory.cleanup()
+
+    def get_url_ids(self):
+        return [result["url_id"] for result in self.searcher.query(self.word)["results"]]
+
+    def test_repeated_query_is_cached(self):
+        self.assertEqual(self.get_url_ids(), self.get_url_ids())
+        self.assertEqual(self.searcher.cache.hits, 1)
+
+    def test_commit_from_other_connection_invalidates(self):
+        before = self.get_url_ids()
+        conn = sqlite.connect(self.path)
+        (word_id,) = conn.execute("SELECT rowid FROM wordlist WHERE word=?", (self.word,)).fetchone()
+        url_id = conn.execute("INSERT INTO urllist(url) VALUES (?)", ("https://www.helloworld.net/p/new",)).lastrowid
+        conn.executemany("INSERT INTO wordlocation(urlid,wordid,location) VALUES (?,?,?)",
+                         [(url_id, word_id, 0), (url_id, word_id, 1)])
+        conn.commit()
+        conn.close()
+        after = self.get_url_ids()
+        self.assertNotIn(url_id, before)
+        self.assertIn(url_id, after)
+        self.assertEqual(self.searcher.cache.hits, 0)
+
+    def test_training_from_other_connection_invalidates(self):
+        results = self.searcher.query(self.word)
+        conn = sqlite.connect(self.predictor_path)
+        conn.execute("INSERT INTO hiddennode(create_key,lastused) VALUES ('other',0)")
+        conn.commit()
+        conn.close()
+        self.searcher.query(self.word)
+        self.assertEqual(self.searcher.cache.hits, 0)
+        self.assertTrue(results["results"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from http.server import ThreadingHTTPServer
+from io import StringIO
+from threading import Thread
+from benchmarks.corpus import make_pages
+from benchmarks.recrawl import Site
+from cursorsearch.crawl.concurrent import ConcurrentCrawler
+
+
+class ConcurrentCrawlerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.site = Site(make_pages(40, words_per_page=30, links_per_page=5))
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.site.make_handler())
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.urls = [self.base_url + self.site.path(i) for i in range(len(self.site.pages))]
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.directory.cleanup()
+
+    def crawl(self, name, **kwargs):
+        crawler = ConcurrentCrawler(os.path.join(self.directory.name, f"{name}.db"), **kwargs)
+        crawler.BASE_URL = self.base_url
+        crawler.create_index_tables()
+        with redirect_stdout(StringIO()):
+            crawler.crawl(self.urls)
+        return crawler
+
+    def assertCrawledOnce(self, crawler):
+        self.assertEqual(crawler.conn.execute("SELECT COUNT(DISTINCT urlid) FROM wordlocation").fetchone()[0],
+                         len(self.urls))
+        self.assertEqual(self.site.requests, len(self.urls))
+
+    def test_threads(self):
+        self.assertCrawledOnce(self.crawl("threads", workers=4))
+
+    def test_parse_workers_and_batches(self):
+        self.assertCrawledOnce(self.crawl("processes", workers=4, parse_workers=2, batch_size=10))
+
+    def test_politeness_delay(self):
+        delay = 0.02
+        self.assertCrawledOnce(self.crawl("polite", workers=4, per_host=4, delay=delay))
+        started = sorted(self.site.started)
+        gaps = [later - earlier for (earlier, later) in zip(started, started[1:])]
+        # Requests leave the crawler at least `delay` apart; allow for scheduling jitter on arrival.
+        self.assertGreaterEqual(started[-1] - started[0], (len(started) - 1) * delay * 0.95)
+        self.assertGreaterEqual(min(gaps), delay * 0.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
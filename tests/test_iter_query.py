@@ -0,0 +1,37 @@
+import os
+import tempfile
+import unittest
+from benchmarks.corpus import build_database, make_pages, make_vocabulary
+from cursorsearch.core.engine import Searcher
+
+
+class IterQueryTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        path = os.path.join(cls.directory.name, "index.db")
+        build_database(path, make_pages(400, words_per_page=100))
+        cls.searcher = Searcher(path, predictDbName=os.path.join(cls.directory.name, "predictor.db"), quiet=True)
+        cls.queries = make_vocabulary(5000)[20:60]
+
+    @classmethod
+    def tearDownClass(cls):
+        del cls.searcher
+        cls.directory.cleanup()
+
+    def test_scores_never_increase(self):
+        for query in self.queries:
+            scores = [result["score"] for result in self.searcher.iter_query(query, batch_size=5)]
+            self.assertTrue(scores, query)
+            for (i, (previous, score)) in enumerate(zip(scores, scores[1:])):
+                self.assertLessEqual(score, previous, f"{query}: result {i + 1} scores higher than result {i}")
+
+    def test_same_order_as_query(self):
+        for query in self.queries:
+            streamed = [(result["score"], result["url_id"]) for result in self.searcher.iter_query(query, batch_size=5)]
+            ranked = [(result["score"], result["url_id"]) for result in self.searcher.query(query)["results"]]
+            self.assertEqual(streamed, ranked, query)
+
+
+if __name__ == "__main__":
+    unittest.main()
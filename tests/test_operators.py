@@ -0,0 +1,72 @@
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+from cursorsearch.core.engine import Searcher
+from cursorsearch.core.segment import write_segment
+from cursorsearch.crawl.crawler import Crawler
+
+PAGES = {
+    "https://example.com/adjacent": "python crawler tutorial java",
+    "https://example.com/apart": "python one two three crawler",
+    "https://example.com/far": "python one two three four crawler",
+    "https://example.com/java": "java tutorial",
+    "https://example.com/reversed": "crawler python"
+}
+
+
+class OperatorTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        path = os.path.join(cls.directory.name, "index.db")
+        crawler = Crawler(path)
+        crawler.create_index_tables()
+        with redirect_stdout(StringIO()):
+            for (url, text) in PAGES.items():
+                crawler.index_page(url, text, [])
+            crawler.calculate_pagerank()
+        segment_path = os.path.join(cls.directory.name, "segment")
+        write_segment(crawler.conn, segment_path)
+        del crawler
+        predictor = os.path.join(cls.directory.name, "predictor.db")
+        cls.searchers = {
+            "sql": Searcher(path, predictDbName=predictor, quiet=True),
+            "index": Searcher(path, predictDbName=predictor, use_index=True, quiet=True),
+            "segment": Searcher(path, predictDbName=predictor, segment=segment_path, quiet=True)
+        }
+
+    @classmethod
+    def tearDownClass(cls):
+        del cls.searchers
+        cls.directory.cleanup()
+
+    def assertMatches(self, query, expected):
+        for (name, searcher) in self.searchers.items():
+            urls = set([searcher.get_url_name(result["url_id"]) for result in searcher.query(query)["results"]])
+            self.assertEqual(urls, set([f"https://example.com/{page}" for page in expected]), f"{name}: {query}")
+
+    def test_phrase(self):
+        self.assertMatches('"python crawler"', ["adjacent"])
+        self.assertMatches('"crawler tutorial java"', ["adjacent"])
+        self.assertMatches('"crawler python"', ["reversed"])
+
+    def test_near_counts_words(self):
+        self.assertMatches("python NEAR/1 crawler", ["adjacent", "reversed"])
+        self.assertMatches("python NEAR/3 crawler", ["adjacent", "reversed"])
+        self.assertMatches("python NEAR/4 crawler", ["adjacent", "apart", "reversed"])
+        self.assertMatches("python NEAR/5 crawler", ["adjacent", "apart", "far", "reversed"])
+
+    def test_or(self):
+        self.assertMatches("python OR java", ["adjacent", "apart", "far", "java", "reversed"])
+        self.assertMatches("tutorial python OR four", ["adjacent"])
+
+    def test_not(self):
+        self.assertMatches("python -java", ["apart", "far", "reversed"])
+        self.assertMatches("python NOT java", ["apart", "far", "reversed"])
+        self.assertMatches('crawler -"python crawler"', ["apart", "far", "reversed"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+import os
+import random
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+from benchmarks.corpus import WhitespaceCrawler, build_database, make_pages
+
+
+class IncrementalPageRankTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        path = os.path.join(self.directory.name, "index.db")
+        corpus = make_pages(300, words_per_page=20)
+        build_database(path, corpus)
+        self.crawler = WhitespaceCrawler(path)
+        self.urls = [url for (url, _, _) in corpus]
+
+    def tearDown(self):
+        del self.crawler
+        self.directory.cleanup()
+
+    def get_scores(self):
+        return dict(self.crawler.conn.execute("SELECT urlid,score FROM pagerank").fetchall())
+
+    def test_update_matches_full_run(self):
+        rnd = random.Random(1)
+        output = StringIO()
+        with redirect_stdout(output):
+            for i in range(20):
+                links = [(url, "new link") for url in rnd.sample(self.urls, 5)]
+                self.crawler.index_page(f"https://www.helloworld.net/new/{i}", "new page", links)
+            for url in rnd.sample(self.urls, 10):
+                self.crawler.remove_page(url)
+            self.crawler.calculate_pagerank(incremental=True)
+            updated = self.get_scores()
+            self.crawler.calculate_pagerank()
+        self.assertIn("incrementally", output.getvalue())
+        full = self.get_scores()
+        self.assertEqual(set(updated), set(full))
+        self.assertLess(max([abs(updated[url_id] - full[url_id]) for url_id in full]), 1e-5)
+
+
+if __name__ == "__main__":
+    unittest.main()
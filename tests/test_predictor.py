@@ -0,0 +1,42 @@
+import os
+import random
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from cursorsearch.dl.predict import Predictor
+
+
+class PredictorTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.predictor = Predictor(os.path.join(self.directory.name, "predictor.db"))
+        self.predictor.make_tables()
+        rnd = random.Random(0)
+        self.queries = []
+        for _ in range(40):
+            word_ids = rnd.sample(range(1, 30), rnd.randint(1, 3))
+            url_ids = rnd.sample(range(1, 200), 20)
+            self.predictor.train_query(word_ids, url_ids, rnd.choice(url_ids))
+            self.queries.append((word_ids, url_ids))
+
+    def tearDown(self):
+        del self.predictor
+        self.directory.cleanup()
+
+    def test_concurrent_results_match_serial(self):
+        serial = [self.predictor.get_result(word_ids, url_ids) for (word_ids, url_ids) in self.queries]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            concurrent = list(executor.map(lambda query: self.predictor.get_result(*query), self.queries * 4))
+        self.assertEqual(concurrent, serial * 4)
+        self.assertEqual(self.predictor.inferences, len(self.queries) * 5)
+
+    def test_results_follow_training(self):
+        (word_ids, url_ids) = self.queries[0]
+        before = self.predictor.get_result(word_ids, url_ids)
+        self.predictor.train_query(word_ids, url_ids, url_ids[0])
+        after = self.predictor.get_result(word_ids, url_ids)
+        self.assertGreater(after[0], before[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+from benchmarks.corpus import WhitespaceCrawler, build_database, make_pages, make_vocabulary
+from cursorsearch.core.segment import Segment, write_segment
+from cursorsearch.util import get_versions
+
+
+class SegmentTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "segment")
+        build_database(os.path.join(self.directory.name, "index.db"), make_pages(200, words_per_page=50))
+        self.crawler = WhitespaceCrawler(os.path.join(self.directory.name, "index.db"))
+        self.word_ids = [self.crawler.get_entry_id("wordlist", "word", word, createnew=False)
+                         for word in make_vocabulary(5000)[20:40]]
+
+    def tearDown(self):
+        del self.crawler
+        self.directory.cleanup()
+
+    def test_reexport_keeps_open_segment(self):
+        write_segment(self.crawler.conn, self.path)
+        old = Segment(self.path)
+        with redirect_stdout(StringIO()):
+            self.crawler.index_page("https://www.helloworld.net/p/new", "new words", [])
+        write_segment(self.crawler.conn, self.path)
+        write_segment(self.crawler.conn, self.path)
+        self.assertTrue(os.path.islink(self.path))
+        self.assertEqual(len(get_versions(self.path)), 2)
+        self.assertIsNone(old.get_url_name(self.crawler.get_url_id("https://www.helloworld.net/p/new")))
+        self.assertEqual(Segment(self.path).get_url_name(self.crawler.get_url_id("https://www.helloworld.net/p/new")),
+                         "https://www.helloworld.net/p/new")
+
+    def test_replaces_plain_directory(self):
+        os.makedirs(self.path)
+        write_segment(self.crawler.conn, self.path)
+        self.assertTrue(os.path.islink(self.path))
+        self.assertEqual(Segment(self.path).meta["urls"],
+                         self.crawler.conn.execute("SELECT COUNT(*) FROM urllist").fetchone()[0])
+
+    def test_links_match_database(self):
+        write_segment(self.crawler.conn, self.path)
+        segment = Segment(self.path)
+        for word_id in self.word_ids:
+            expected = self.crawler.conn.execute(
+                "SELECT linkwords.wordid,link.fromid,link.toid FROM linkwords CROSS JOIN link "
+                "WHERE linkwords.wordid=? AND linkwords.linkid=link.rowid", (word_id,)).fetchall()
+            self.assertEqual(sorted(map(tuple, segment.get_links([word_id]).tolist())), sorted(expected))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+from benchmarks.corpus import WhitespaceCrawler, build_database, make_pages, make_vocabulary
+from cursorsearch.core.shard import ShardedSearcher, refresh_shards, write_shards
+
+
+class ShardedSearcherTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "index.db")
+        self.shard_path = os.path.join(self.directory.name, "shards")
+        build_database(self.path, make_pages(200, words_per_page=50))
+        self.crawler = WhitespaceCrawler(self.path)
+        write_shards(self.crawler.conn, self.shard_path, 2)
+        self.searcher = ShardedSearcher(self.shard_path, predictDbName=os.path.join(self.directory.name, "predictor.db"),
+                                        cache_size=100, quiet=True)
+        self.word = make_vocabulary(5000)[30]
+
+    def tearDown(self):
+        self.searcher.close()
+        del self.searcher
+        del self.crawler
+        self.directory.cleanup()
+
+    def add_page(self, url):
+        with redirect_stdout(StringIO()):
+            self.crawler.index_page(url, f"{self.word} {self.word}", [])
+        return self.crawler.get_url_id(url)
+
+    def test_cached_results_follow_refresh(self):
+        before = [result["url_id"] for result in self.searcher.query(self.word)["results"]]
+        url_id = self.add_page("https://www.helloworld.net/p/new")
+        refresh_shards(self.crawler.conn, self.shard_path)
+        after = [result["url_id"] for result in self.searcher.query(self.word)["results"]]
+        self.assertNotIn(url_id, before)
+        self.assertIn(url_id, after)
+
+    def test_refresh_trims_log(self):
+        self.add_page("https://www.helloworld.net/p/first")
+        refresh_shards(self.crawler.conn, self.shard_path)
+        self.assertEqual(self.crawler.conn.execute("SELECT COUNT(*) FROM pagelog").fetchone()[0], 1)
+        url_id = self.add_page("https://www.helloworld.net/p/second")
+        refresh_shards(self.crawler.conn, self.shard_path)
+        self.assertEqual(self.crawler.conn.execute("SELECT COUNT(*) FROM pagelog").fetchone()[0], 1)
+        self.assertIn(url_id, [result["url_id"] for result in self.searcher.query(self.word)["results"]])
+
+    def test_inferences_collected_from_shards(self):
+        for word in make_vocabulary(5000)[20:30]:
+            self.searcher.query(word)
+        self.assertEqual(self.searcher.predictor.report()["inferences"], 0)
+        self.searcher.collect_inferences()
+        report = self.searcher.predictor.report()
+        self.assertGreaterEqual(report["inferences"], 10)
+        self.assertGreater(report["max_inference_ms"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
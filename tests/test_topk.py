@@ -0,0 +1,54 @@
+import os
+import tempfile
+import unittest
+from benchmarks.corpus import build_database, make_pages, make_vocabulary
+from cursorsearch.core.engine import Searcher
+
+
+class TopKTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        path = os.path.join(cls.directory.name, "index.db")
+        build_database(path, make_pages(400, words_per_page=100))
+        cls.searcher = Searcher(path, predictDbName=os.path.join(cls.directory.name, "predictor.db"), quiet=True)
+        vocabulary = make_vocabulary(5000)
+        cls.queries = vocabulary[20:40] + [f"{vocabulary[i]} {vocabulary[i + 1]}" for i in range(40, 60, 2)]
+        for query in cls.queries[::3]:
+            results = cls.searcher.query(query)
+            url_ids = [result["url_id"] for result in results["results"][:20]]
+            if url_ids:
+                cls.searcher.predictor.train_query(results["query_words"], url_ids, url_ids[-1])
+
+    @classmethod
+    def tearDownClass(cls):
+        del cls.searcher
+        cls.directory.cleanup()
+
+    def get_pages(self, query, pages, exact=True):
+        ranked = []
+        for (limit, offset) in pages:
+            results = self.searcher.query(query, limit=limit, offset=offset, exact=exact)["results"]
+            ranked += [(result["score"], result["url_id"]) for result in results]
+        return ranked
+
+    def test_pages_match_unlimited_ranking(self):
+        for query in self.queries:
+            paged = self.get_pages(query, [(5, 0), (5, 5), (40, 10)])
+            ranked = [(result["score"], result["url_id"]) for result in self.searcher.query(query)["results"]]
+            self.assertEqual(paged, ranked[:50], query)
+
+    def test_paged_scores_never_increase(self):
+        for query in self.queries:
+            scores = [score for (score, _) in self.get_pages(query, [(5, 0), (5, 5), (40, 10)])]
+            for (i, (previous, score)) in enumerate(zip(scores, scores[1:])):
+                self.assertLessEqual(score, previous, f"{query}: result {i + 1} scores higher than result {i}")
+
+    def test_approximate_pages_never_repeat(self):
+        for query in self.queries:
+            url_ids = [url_id for (_, url_id) in self.get_pages(query, [(5, 0), (5, 5), (40, 10)], exact=False)]
+            self.assertEqual(len(url_ids), len(set(url_ids)), query)
+
+
+if __name__ == "__main__":
+    unittest.main()